@@ -0,0 +1,451 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import json
+import logging
+import os
+import re
+import sqlite3
+
+from handson.util import (
+    atomic_write,
+    file_lock,
+    yaml_dump,
+    yaml_load,
+)
+
+log = logging.getLogger(__name__)
+
+# how long (seconds) to wait for another process holding the database lock
+DB_TIMEOUT = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS delegates (
+    delegate INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS roles (
+    delegate INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    extra TEXT,
+    PRIMARY KEY (delegate, role)
+);
+CREATE TABLE IF NOT EXISTS instances (
+    instance_id TEXT PRIMARY KEY,
+    delegate INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    placement TEXT
+);
+CREATE INDEX IF NOT EXISTS instances_by_role
+    ON instances (delegate, role);
+CREATE TABLE IF NOT EXISTS volumes (
+    volume_id TEXT PRIMARY KEY,
+    delegate INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    attached INTEGER
+);
+CREATE INDEX IF NOT EXISTS volumes_by_role
+    ON volumes (delegate, role);
+CREATE TABLE IF NOT EXISTS subnets (
+    delegate INTEGER PRIMARY KEY,
+    subnet_id TEXT,
+    cidr_block TEXT
+);
+CREATE INDEX IF NOT EXISTS subnets_by_id
+    ON subnets (subnet_id);
+CREATE TABLE IF NOT EXISTS keypairs (
+    delegate INTEGER PRIMARY KEY,
+    keyname TEXT
+);
+"""
+
+
+class StateBackend(object):
+    """
+        Interface of the stores that can keep the per-delegate state
+        stanzas, instead of the YAML file. The stanzas are mappings keyed by
+        delegate number; handson.myyaml keeps them in its cache like any
+        other stanza, and calls store() whenever they change. Backends are
+        constructed with the path of the YAML file minus its extension, to
+        which they append their own suffix.
+    """
+
+    # stanzas kept by the backend rather than in the YAML file
+    stanzas = ('clusters', 'keypairs', 'subnets')
+    suffix = None
+
+    def __init__(self, base):
+        self.fn = base + self.suffix
+        self.stored = {}
+
+    def is_new(self):
+        """
+            Tell whether the state has not been imported from the YAML file
+            yet.
+        """
+        raise NotImplementedError
+
+    def import_state(self, state):
+        """
+            Store the given dict mapping stanzas to their values, replacing
+            anything stored before, and remember that the state has been
+            imported.
+        """
+        raise NotImplementedError
+
+    def load(self):
+        """
+            Return a dict mapping each of the stanzas to its value.
+        """
+        raise NotImplementedError
+
+    def store(self, k, value, changed=None):
+        """
+            Persist the new value of stanza k. If changed is given, only the
+            entries of the delegates it lists have changed.
+        """
+        raise NotImplementedError
+
+    def snapshot(self, value):
+        """
+            Return a comparable copy of a delegate's entry.
+        """
+        return json.dumps(value, sort_keys=True)
+
+    def remember(self, state):
+        """
+            Remember the given state as the one stored, so that store() can
+            tell which delegates' entries have changed.
+        """
+        self.stored = dict(
+            (k, dict((d, self.snapshot(v)) for (d, v) in state[k].items()))
+            for k in state
+        )
+        return None
+
+    def changed_delegates(self, k, value, changed=None):
+        """
+            Return the delegates whose entries in stanza k differ between
+            value and what was stored last, considering only those listed
+            in changed, if given.
+        """
+        assert k in self.stanzas, (
+            "Stanza {!r} is not kept by the state backend".format(k))
+        stored = self.stored.setdefault(k, {})
+        if changed is None:
+            changed = set(stored.keys()) | set(value.keys())
+        return sorted(
+            d for d in set(changed)
+            if d not in value or d not in stored or
+            self.snapshot(value[d]) != stored[d]
+        )
+
+    def stored_delegates(self, k, value, delegates):
+        stored = self.stored.setdefault(k, {})
+        for d in delegates:
+            if d in value:
+                stored[d] = self.snapshot(value[d])
+            else:
+                stored.pop(d, None)
+        log.debug("Stored {} entries of delegates {!r} in {!r}"
+                  .format(k, delegates, self.fn))
+        return None
+
+    def close(self):
+        pass
+
+
+class SqliteBackend(StateBackend):
+    """
+        Keep the clusters, subnets and keypairs stanzas in an SQLite
+        database, one row per delegate, role, instance, volume, subnet and
+        keypair, so that updating a delegate touches only its own rows and
+        several processes can share the state.
+    """
+
+    suffix = '.db'
+    tables = {
+        'clusters': ('delegates', 'roles', 'instances', 'volumes'),
+        'keypairs': ('keypairs',),
+        'subnets': ('subnets',),
+    }
+
+    def __init__(self, base):
+        super(SqliteBackend, self).__init__(base)
+        log.debug("Opening state database {!r}".format(self.fn))
+        # all access is serialized by the YAML lock
+        self.conn = sqlite3.connect(
+            self.fn,
+            timeout=DB_TIMEOUT,
+            check_same_thread=False,
+        )
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def is_new(self):
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'imported'"
+        ).fetchone()
+        return row is None
+
+    def import_state(self, state):
+        with self.conn:
+            for k in self.stanzas:
+                for table in self.tables[k]:
+                    self.conn.execute('DELETE FROM {}'.format(table))
+                for (d, value) in (state.get(k) or {}).items():
+                    getattr(self, 'insert_' + k)(d, value or {})
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) "
+                "VALUES ('imported', '1')"
+            )
+        log.info("Imported {} into {!r}"
+                 .format(', '.join(self.stanzas), self.fn))
+        return None
+
+    def load(self):
+        c = self.conn
+        clusters = {}
+        for (d,) in c.execute('SELECT delegate FROM delegates'):
+            clusters[d] = {}
+        for (d, role, extra) in c.execute(
+            'SELECT delegate, role, extra FROM roles'
+        ):
+            clusters.setdefault(d, {})[role] = (
+                json.loads(extra) if extra else {}
+            )
+        for (i_id, d, role, placement) in c.execute(
+            'SELECT instance_id, delegate, role, placement FROM instances'
+        ):
+            r_stanza = clusters[d][role]
+            r_stanza['instance_id'] = i_id
+            if placement is not None:
+                r_stanza['placement'] = placement
+        for (v_id, d, role, attached) in c.execute(
+            'SELECT volume_id, delegate, role, attached FROM volumes'
+        ):
+            r_stanza = clusters[d][role]
+            r_stanza['volume_id'] = v_id
+            if attached is not None:
+                r_stanza['volume_attached'] = bool(attached)
+        subnets = {}
+        for (d, s_id, cidr_block) in c.execute(
+            'SELECT delegate, subnet_id, cidr_block FROM subnets'
+        ):
+            subnets[d] = {}
+            if s_id is not None:
+                subnets[d]['id'] = s_id
+            if cidr_block is not None:
+                subnets[d]['cidr_block'] = cidr_block
+        keypairs = {}
+        for (d, keyname) in c.execute(
+            'SELECT delegate, keyname FROM keypairs'
+        ):
+            keypairs[d] = {'keyname': keyname} if keyname else {}
+        state = {
+            'clusters': clusters,
+            'keypairs': keypairs,
+            'subnets': subnets,
+        }
+        self.remember(state)
+        return state
+
+    def store(self, k, value, changed=None):
+        changed = self.changed_delegates(k, value, changed)
+        if not changed:
+            return None
+        with self.conn:
+            for d in changed:
+                getattr(self, 'delete_' + k)(d)
+                if d in value:
+                    getattr(self, 'insert_' + k)(d, value[d] or {})
+        self.stored_delegates(k, value, changed)
+        return None
+
+    def delete_clusters(self, d):
+        for table in self.tables['clusters']:
+            self.conn.execute(
+                'DELETE FROM {} WHERE delegate = ?'.format(table), (d,)
+            )
+
+    def insert_clusters(self, d, c_stanza):
+        c = self.conn
+        c.execute('INSERT INTO delegates (delegate) VALUES (?)', (d,))
+        for (role, r_stanza) in c_stanza.items():
+            r_stanza = dict(r_stanza or {})
+            i_id = r_stanza.pop('instance_id', None)
+            placement = r_stanza.pop('placement', None)
+            v_id = r_stanza.pop('volume_id', None)
+            attached = r_stanza.pop('volume_attached', None)
+            c.execute(
+                'INSERT INTO roles (delegate, role, extra) VALUES (?, ?, ?)',
+                (d, role, json.dumps(r_stanza) if r_stanza else None)
+            )
+            if i_id:
+                c.execute(
+                    'INSERT INTO instances (instance_id, delegate, role, '
+                    'placement) VALUES (?, ?, ?, ?)',
+                    (i_id, d, role, placement)
+                )
+            if v_id:
+                c.execute(
+                    'INSERT INTO volumes (volume_id, delegate, role, '
+                    'attached) VALUES (?, ?, ?, ?)',
+                    (v_id, d, role, attached)
+                )
+
+    def delete_subnets(self, d):
+        self.conn.execute('DELETE FROM subnets WHERE delegate = ?', (d,))
+
+    def insert_subnets(self, d, s_stanza):
+        self.conn.execute(
+            'INSERT INTO subnets (delegate, subnet_id, cidr_block) '
+            'VALUES (?, ?, ?)',
+            (d, s_stanza.get('id'), s_stanza.get('cidr_block'))
+        )
+
+    def delete_keypairs(self, d):
+        self.conn.execute('DELETE FROM keypairs WHERE delegate = ?', (d,))
+
+    def insert_keypairs(self, d, k_stanza):
+        self.conn.execute(
+            'INSERT INTO keypairs (delegate, keyname) VALUES (?, ?)',
+            (d, k_stanza.get('keyname'))
+        )
+
+    def close(self):
+        self.conn.close()
+
+
+class ShardBackend(StateBackend):
+    """
+        Keep the clusters, subnets and keypairs entries of each delegate in
+        a YAML file of its own, in a directory next to the YAML file. Each
+        shard is read and written under an advisory fcntl lock, and only the
+        stanzas that changed are replaced, so ho processes working on
+        different delegates never overwrite each other's state.
+    """
+
+    suffix = '.d'
+    shard_re = re.compile(r'^delegate-(\d+)\.yaml$')
+
+    def __init__(self, base):
+        super(ShardBackend, self).__init__(base)
+        if not os.path.isdir(self.fn):
+            os.mkdir(self.fn)
+
+    def shard_file_name(self, d):
+        return os.path.join(self.fn, 'delegate-{}.yaml'.format(d))
+
+    def shard_lock_name(self, d):
+        return os.path.join(self.fn, 'delegate-{}.lock'.format(d))
+
+    def imported_file_name(self):
+        return os.path.join(self.fn, 'imported')
+
+    def read_shard(self, d):
+        fn = self.shard_file_name(d)
+        if not os.path.exists(fn):
+            return {}
+        with open(fn) as f:
+            shard = yaml_load(f)
+        return shard or {}
+
+    def write_shard(self, d, shard):
+        fn = self.shard_file_name(d)
+        if shard:
+            atomic_write(fn, yaml_dump(shard))
+        elif os.path.exists(fn):
+            os.unlink(fn)
+        return None
+
+    def update_shard(self, d, updates):
+        """
+            Replace the given stanzas (a dict mapping them to the new
+            entries, or to None to drop them) in the shard of delegate d.
+        """
+        with file_lock(self.shard_lock_name(d)):
+            shard = self.read_shard(d)
+            for (k, entry) in updates.items():
+                if entry is None:
+                    shard.pop(k, None)
+                else:
+                    shard[k] = entry
+            self.write_shard(d, shard)
+        return None
+
+    def is_new(self):
+        return not os.path.exists(self.imported_file_name())
+
+    def import_state(self, state):
+        delegates = set()
+        for k in self.stanzas:
+            delegates |= set((state.get(k) or {}).keys())
+        for d in sorted(delegates):
+            self.update_shard(d, dict(
+                (k, (state.get(k) or {}).get(d)) for k in self.stanzas
+            ))
+        atomic_write(self.imported_file_name(), '')
+        log.info("Imported {} into {!r}"
+                 .format(', '.join(self.stanzas), self.fn))
+        return None
+
+    def load(self):
+        state = dict((k, {}) for k in self.stanzas)
+        for fn in sorted(os.listdir(self.fn)):
+            match = self.shard_re.match(fn)
+            if not match:
+                continue
+            d = int(match.group(1))
+            with file_lock(self.shard_lock_name(d), shared=True):
+                shard = self.read_shard(d)
+            for k in self.stanzas:
+                if k in shard:
+                    state[k][d] = shard[k]
+        self.remember(state)
+        return state
+
+    def store(self, k, value, changed=None):
+        changed = self.changed_delegates(k, value, changed)
+        for d in changed:
+            self.update_shard(d, {k: value.get(d)})
+        if changed:
+            self.stored_delegates(k, value, changed)
+        return None
+
+
+backends = {
+    'shards': ShardBackend,
+    'sqlite': SqliteBackend,
+}
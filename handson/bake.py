@@ -0,0 +1,300 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import argparse
+import logging
+import time
+
+from handson.config import config
+from handson.misc import (
+    CustomFormatter,
+    InitArgs,
+)
+from handson.myyaml import (
+    lock as yaml_lock,
+    stanza,
+)
+from handson.parallel import run_in_parallel
+from handson.parsers import (
+    dry_run_only_parser,
+    parallel_parser,
+)
+from handson.poller import shared_poller
+from handson.region import Region
+from handson.subnet import Subnet
+from handson.tag import tag_resources
+from handson.template import render_user_data
+from handson.userdata import (
+    build_user_data,
+    part_type,
+)
+
+log = logging.getLogger(__name__)
+
+# where the wrapped bake scripts and their success markers go on the builder
+BAKE_DIR = '/var/lib/handson-bake'
+
+# wraps a bake script, so that it leaves a marker behind if it succeeds
+WRAPPER = """#!/bin/sh
+mkdir -p {dir}
+cat > {dir}/{n}.sh <<'HANDSON_BAKE_EOF'
+{text}HANDSON_BAKE_EOF
+chmod 700 {dir}/{n}.sh
+{dir}/{n}.sh && touch {dir}/{n}.sh.ok
+"""
+
+# appended to the bake user-data: the builder powers itself off once every
+# bake script has succeeded, which is how we know that the image can be
+# created. If one has failed, the builder keeps running and the bake times
+# out.
+POWEROFF_PART = ('zz-poweroff', """#!/bin/sh
+for s in {dir}/*.sh ; do
+    test -e "$s" || continue
+    test -e "$s.ok" || exit 1
+done
+poweroff
+""".format(dir=BAKE_DIR))
+
+
+def wrap_script(n, text):
+    """
+        Return the bake user-data part text, wrapped so that it leaves a
+        success marker behind if it is a script. Other parts are returned
+        as they are.
+    """
+    if part_type(text) != 'x-shellscript':
+        return text
+    if not text.endswith('\n'):
+        text += '\n'
+    return WRAPPER.format(dir=BAKE_DIR, n=n, text=text)
+
+
+class Bake(object):
+
+    @staticmethod
+    def get_parser():
+        parser = argparse.ArgumentParser(
+            usage='ho bake',
+            formatter_class=CustomFormatter,
+            parents=[dry_run_only_parser(), parallel_parser()],
+            conflict_handler='resolve',
+            add_help=False,
+        )
+
+        parser.add_argument(
+            'role_list', nargs='*', metavar='ROLE',
+            help="role(s) to bake; if none are given, all roles that have "
+                 "bake-user-data are baked",
+        )
+
+        parser.add_argument(
+            '-t', '--timeout',
+            type=int, default=3600, metavar='SECONDS',
+            help="Give up on a builder that has not powered off by then",
+        )
+
+        parser.set_defaults(
+            func=BakeRoles,
+        )
+
+        return parser
+
+
+class Baker(Region):
+    """
+        Bakes the AMI for a single role: launches a builder instance from
+        the role's base AMI with the role's bake-user-data, waits for it to
+        power itself off, creates an AMI from it and terminates it.
+    """
+
+    def __init__(self, args, role):
+        super(Baker, self).__init__(args)
+        self.args = args
+        rd = config().role_defs[role]
+        self._baker = {
+            'base_ami_id': rd.base_ami_id or rd.ami_id,
+            'ec2': self.ec2(),
+            'poller': shared_poller(args),
+            'rd': rd,
+            'role': role,
+        }
+
+    def user_data(self):
+        rd = self._baker['rd']
+        # only the tokens that are the same on every node make sense here
+        values = {
+            'MASTER_IP': '10.0.0.10',
+            'ROLE': self._baker['role'],
+            'REGION': self.region(),
+        }
+        if isinstance(rd.bake_user_data, (list, tuple)):
+            files = rd.bake_user_data
+        else:
+            files = [rd.bake_user_data]
+        parts = [
+            (fn, wrap_script(n, render_user_data(
+                fn, values, rd.replace_from_environment or ())))
+            for (n, fn) in enumerate(files)
+        ]
+        parts.append(POWEROFF_PART)
+        return build_user_data(parts, compressed=rd.compress_user_data)
+
+    def image_name(self):
+        return "{}-{}-{}".format(
+            stanza('nametag'),
+            self._baker['role'],
+            time.strftime('%Y%m%d%H%M%S', time.gmtime()),
+        )
+
+    def launch(self, subnet_id):
+        ec2 = self._baker['ec2']
+        rd = self._baker['rd']
+        role = self._baker['role']
+        reservation = ec2.run_instances(
+            self._baker['base_ami_id'],
+            subnet_id=subnet_id,
+            instance_type=rd.type,
+            placement=self.availability_zone(),
+            user_data=self.user_data(),
+            instance_initiated_shutdown_behavior='stop',
+        )
+        i_obj = reservation.instances[0]
+        tag_resources(ec2, [i_obj.id], {
+            'Name': "{}-bake-{}".format(stanza('nametag'), role),
+            'Role': role,
+        })
+        log.info("Launched {} builder (instance ID {}) from {}"
+                 .format(role, i_obj.id, self._baker['base_ami_id']))
+        return i_obj.id
+
+    def bake(self, subnet_id):
+        """
+            Bake the AMI and return its ID. An AMI that does not become
+            available is deregistered.
+        """
+        ec2 = self._baker['ec2']
+        poller = self._baker['poller']
+        role = self._baker['role']
+        i_id = self.launch(subnet_id)
+        ami_id = None
+        try:
+            log.info("Waiting for {} builder to run its user-data and power "
+                     "off".format(role))
+            poller.wait('instance', i_id, 'stopped',
+                        deadline=self.args.timeout)
+            name = self.image_name()
+            ami_id = ec2.create_image(
+                i_id, name,
+                description="{} role, baked from {}".format(
+                    role, self._baker['base_ami_id']),
+            )
+            tag_resources(ec2, [ami_id], {
+                'Name': stanza('nametag'),
+                'Role': role,
+            })
+            poller.wait('image', ami_id, 'available')
+        except Exception:
+            if ami_id:
+                log.warning("Deregistering {} AMI {}, which did not become "
+                            "available".format(role, ami_id))
+                ec2.deregister_image(ami_id)
+            raise
+        finally:
+            log.info("Terminating {} builder (instance ID {})"
+                     .format(role, i_id))
+            ec2.terminate_instances(instance_ids=[i_id])
+        log.info("Baked {} AMI {} ({})".format(role, ami_id, name))
+        self.update_role_definition(ami_id)
+        return ami_id
+
+    def update_role_definition(self, ami_id):
+        """
+            Make the role use the new AMI. The AMI it was baked from is kept
+            as base-ami-id, so that baking again starts from a clean image.
+        """
+        role = self._baker['role']
+        with yaml_lock:
+            rd = stanza('role-definitions')
+            r = rd.get(role) or {}
+            r.setdefault('base-ami-id', self._baker['base_ami_id'])
+            r['ami-id'] = ami_id
+            rd[role] = r
+            stanza('role-definitions', rd)
+        return None
+
+
+class BakeRoles(InitArgs):
+
+    def __init__(self, args):
+        super(BakeRoles, self).__init__(args)
+        self.args = args
+
+    def roles_to_bake(self):
+        role_defs = config().role_defs
+        if self.args.role_list:
+            for role in self.args.role_list:
+                assert role in role_defs, (
+                    "Role {!r} is not defined".format(role))
+                assert role_defs[role].bake_user_data, (
+                    "Role {!r} has no bake-user-data".format(role))
+            return list(self.args.role_list)
+        return sorted(
+            role for role in role_defs if role_defs[role].bake_user_data
+        )
+
+    def run(self):
+        roles = self.roles_to_bake()
+        if not roles:
+            log.warning("No role has bake-user-data: nothing to bake")
+            return None
+        if self.args.dry_run:
+            for role in roles:
+                rd = config().role_defs[role]
+                log.info("Dry run: would bake role {} from {}"
+                         .format(role, rd.base_ami_id or rd.ami_id))
+            return None
+        # builders go into the Salt Master's subnet, which must give them a
+        # public IP so they can reach the package repositories
+        s = Subnet(self.args, 0)
+        s_obj = s.subnet_obj(create=True)
+        s.set_map_public_ip(s_obj.id)
+        results = run_in_parallel(
+            lambda role: Baker(self.args, role).bake(s_obj.id),
+            roles,
+            parallel=self.args.parallel,
+        )
+        failed = []
+        for role in roles:
+            (ok, result) = results[role]
+            if not ok:
+                log.error("Failed to bake role {}: {}".format(role, result))
+                failed.append(role)
+        assert not failed, "Failed to bake role(s) {!r}".format(failed)
+        return None
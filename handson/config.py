@@ -0,0 +1,164 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import threading
+
+from handson.myyaml import (
+    generation,
+    lock as yaml_lock,
+    role_def_valid,
+    role_definition_keys,
+    stanza,
+    tree_stanzas,
+    validate_cluster_definition,
+)
+
+log = logging.getLogger(__name__)
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def attribute_name(key):
+    return key.replace('-', '_')
+
+
+class Frozen(object):
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(
+            "{} objects are read-only".format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError(
+            "{} objects are read-only".format(type(self).__name__))
+
+
+class RoleDef(Frozen):
+    """
+        A resolved, read-only role definition: the built-in defaults,
+        overridden by the 'defaults' role definition from the YAML file,
+        overridden by the role's own definition. Attributes are named after
+        the role definition keys, with dashes replaced by underscores.
+    """
+
+    __slots__ = ('role',) + tuple(
+        attribute_name(key) for key in role_definition_keys
+    )
+
+    def __init__(self, role, values):
+        object.__setattr__(self, 'role', role)
+        for key in role_definition_keys:
+            val = values.get(key)
+            if isinstance(val, list):
+                val = tuple(val)
+            object.__setattr__(self, attribute_name(key), val)
+
+    def as_dict(self):
+        return dict(
+            (key, getattr(self, attribute_name(key)))
+            for key in role_definition_keys
+        )
+
+    def replace(self, changes):
+        """
+            Return a copy with the values of the given dict (keyed by role
+            definition keys) changed.
+        """
+        values = self.as_dict()
+        values.update(changes)
+        return RoleDef(self.role, values)
+
+    def __repr__(self):
+        return "RoleDef({!r}, {!r})".format(self.role, self.as_dict())
+
+
+class Config(Frozen):
+    """
+        Snapshot of the cluster configuration, compiled from the YAML tree
+        once and shared by everyone until the tree changes:
+
+        cluster_roles: tuple of the roles in the cluster definition, in
+            order (validated)
+        role_defs: dict mapping each role to its RoleDef
+    """
+
+    __slots__ = ('generation', 'cluster_roles', 'role_defs')
+
+    def __init__(self, generation, cluster_roles, role_defs):
+        object.__setattr__(self, 'generation', generation)
+        object.__setattr__(self, 'cluster_roles', cluster_roles)
+        object.__setattr__(self, 'role_defs', role_defs)
+
+
+def compile_config():
+    """
+        Validate the cluster definition and the role definitions and build
+        a Config from them.
+    """
+    with yaml_lock:
+        gen = generation()
+        validate_cluster_definition()
+        cluster_roles = tuple(
+            entry['role'] for entry in stanza('cluster-definition')
+        )
+        rd = stanza('role-definitions')
+        base = dict(tree_stanzas['role-definitions']['default']['defaults'])
+        base.update(rd.get('defaults') or {})
+        role_defs = {}
+        for role in rd:
+            if role == 'defaults':
+                continue
+            if rd[role] is not None:
+                assert role_def_valid(role), (
+                    "Role definition {!r} is invalid".format(role))
+            values = dict(base)
+            values.update(rd[role] or {})
+            role_defs[role] = RoleDef(role, values)
+    log.debug("Compiled configuration: cluster roles {!r}"
+              .format(cluster_roles))
+    return Config(gen, cluster_roles, role_defs)
+
+
+def config():
+    """
+        Return the configuration snapshot, compiling it if the YAML tree has
+        changed since it was last compiled.
+    """
+    global _config
+    c = _config
+    if c is not None and c.generation == generation():
+        return c
+    with _config_lock:
+        if _config is None or _config.generation != generation():
+            _config = compile_config()
+        return _config
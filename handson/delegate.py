@@ -28,20 +28,35 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
-import copy
+import handson.pkgcache as pkgcache
 import logging
-import time
 
+from boto.ec2.blockdevicemapping import (
+    BlockDeviceMapping,
+    BlockDeviceType,
+)
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+from handson.config import config
+from handson.fleet import Fleet
 from handson.keypair import Keypair
-from handson.myyaml import stanza
+from handson.myyaml import (
+    journal,
+    stanza,
+)
+from handson.phonehome import callback_url
+from handson.poller import shared_poller
 from handson.region import Region
 from handson.subnet import Subnet
-from handson.tag import apply_tag
-from handson.util import (
-    derive_ip_address,
-    get_file_as_string,
-    template_token_subst,
-)
+from handson.tag import Tagger
+from handson.template import render_user_data
+from handson.userdata import build_user_data
+from handson.util import derive_ip_address
+from handson.waiter import WaitTimeout
 
 log = logging.getLogger(__name__)
 
@@ -60,15 +75,17 @@ class Delegate(Region):
             'delegate': delegate,
             'ec2': ec2,
             'keyname': k.get_keyname_from_yaml(),
+            'poller': shared_poller(self.args),
             'roles': {},
             'subnet_obj': s_obj,
         }
 
-    def apply_tags(self, aws_obj, role=None):
-        delegate = self._delegate['delegate']
-        apply_tag(aws_obj, tag='Name', val=stanza('nametag'))
-        apply_tag(aws_obj, tag='Role', val=role)
-        apply_tag(aws_obj, tag='Delegate', val=delegate)
+    def tags(self, role=None):
+        return {
+            'Name': stanza('nametag'),
+            'Role': role,
+            'Delegate': self._delegate['delegate'],
+        }
 
     def preexisting_instances(self):
         delegate = self._delegate['delegate']
@@ -85,40 +102,37 @@ class Delegate(Region):
         return count
 
     def set_subnet_map_public_ip(self):
-        """
-            Attempts to set the MapPublicIpOnLaunch attribute to True.
-            Code taken from http://stackoverflow.com/questions/25977048
-            Author: Mark Doliner
-        """
-        ec2 = self._delegate['ec2']
-        subnet_id = self._delegate['subnet_obj'].id
-        orig_api_version = ec2.APIVersion
-        ec2.APIVersion = '2014-06-15'
-        ec2.get_status(
-            'ModifySubnetAttribute',
-            {'SubnetId': subnet_id, 'MapPublicIpOnLaunch.Value': 'true'},
-            verb='POST'
+        Subnet(self.args, self._delegate['delegate']).set_map_public_ip(
+            self._delegate['subnet_obj'].id
         )
-        ec2.APIVersion = orig_api_version
         return None
 
     def roles_to_install(self):
         delegate = self._delegate['delegate']
-        rti = []
-        rdd = {}
+        cfg = config()
         if delegate == 0:
-            role_def = self.assemble_role_def('master')
-            rdd['master'] = role_def
-            rti.append('master')
-        if delegate > 0:
-            cluster_def = stanza('cluster-definition')
-            for cluster_def_entry in cluster_def:
-                role = cluster_def_entry['role']
-                role_def = self.assemble_role_def(role)
-                rdd[role] = role_def
-                rti.append(role)
+            rti = ['master']
+        else:
+            rti = list(cfg.cluster_roles)
+        rdd = dict((role, cfg.role_defs[role]) for role in rti)
         return (rti, rdd)
 
+    def package_cache_upstreams(self, master_ip):
+        """
+            Return the (scheme, host) tuples of the repositories used by the
+            user-data of the cluster roles, which the package cache on the
+            Salt Master is to proxy.
+        """
+        cfg = config()
+        files = set()
+        for role in cfg.cluster_roles:
+            user_data = cfg.role_defs[role].user_data
+            if isinstance(user_data, (list, tuple)):
+                files.update(user_data)
+            elif user_data:
+                files.add(user_data)
+        return pkgcache.upstreams(sorted(files), master_ip)
+
     def ready_to_install(self, dry_run=False):
         if self.preexisting_instances():
             return False
@@ -127,13 +141,6 @@ class Delegate(Region):
         (rti, self._delegate['role_defs']) = self.roles_to_install()
         return rti
 
-    def assemble_role_def(self, role):
-        rd = stanza('role-definitions')
-        rv = copy.deepcopy(rd['defaults'])
-        for a in rd[role]:
-            rv[a] = rd[role][a]
-        return rv
-
     def instantiate_role(self, role):
         delegate = self._delegate['delegate']
         ec2 = self._delegate['ec2']
@@ -142,79 +149,77 @@ class Delegate(Region):
         private_ip = derive_ip_address(
             self._delegate['subnet_obj'].cidr_block,
             self._delegate['delegate'],
-            rd['last-octet'],
+            rd.last_octet,
         )
         # kwargs we use always
         our_kwargs = {
             "key_name": self._delegate['keyname'],
             "subnet_id": self._delegate['subnet_obj'].id,
-            "instance_type": rd['type'],
+            "instance_type": rd.type,
             "private_ip_address": private_ip,
             "placement": self.availability_zone()
         }
         # conditional kwargs
-        if rd['user-data']:
-            u = get_file_as_string(rd['user-data'])
-            log.info("Read {} characters of user-data from file {}"
-                     .format(len(u), rd['user-data']))
-            # FIXME master IP address is hardcoded
-            # FIXME template_token_subst() calls are hardcoded
-            u = template_token_subst(u, '@@MASTER_IP@@', '10.0.0.10')
-            u = template_token_subst(u, '@@DELEGATE@@', delegate)
-            u = template_token_subst(u, '@@ROLE@@', role)
-            u = template_token_subst(u, '@@NODE_NO@@', rd['node-no'])
-            u = template_token_subst(u, '@@REGION@@', self.region())
+        # FIXME master IP address is hardcoded
+        master_ip = '10.0.0.10'
+        values = {
+            'MASTER_IP': master_ip,
+            'DELEGATE': delegate,
+            'ROLE': role,
+            'NODE_NO': rd.node_no,
+            'REGION': self.region(),
+        }
+        callback = callback_url(delegate, role)
+        if callback:
+            values['CALLBACK'] = callback
+        # several files are combined into a multipart message
+        if not rd.user_data:
+            files = []
+        elif isinstance(rd.user_data, (list, tuple)):
+            files = list(rd.user_data)
+        else:
+            files = [rd.user_data]
+        parts = [
+            (fn, render_user_data(fn, values,
+                                  rd.replace_from_environment or ()))
+            for fn in files
+        ]
+        master_rd = config().role_defs.get('master')
+        if master_rd and master_rd.package_cache:
+            if role == 'master':
+                parts.append(('package-cache', pkgcache.setup_script(
+                    self.package_cache_upstreams(master_ip), master_ip,
+                    callback=callback)))
+            else:
+                parts = [(fn, pkgcache.rewrite(text, master_ip))
+                         for (fn, text) in parts]
+        if parts:
+            u = build_user_data(parts, compressed=rd.compress_user_data)
+            log.info("Built {} bytes of user-data from {}"
+                     .format(len(u), ', '.join(fn for (fn, _) in parts)))
             our_kwargs['user_data'] = u
-        reservation = ec2.run_instances(rd['ami-id'], **our_kwargs)
+        vol_size = int(rd.volume) if rd.volume else 0
+        if vol_size > 0:
+            log.info("Role {} requires {}GB volume".format(role, vol_size))
+        if vol_size > 0 and rd.volume_mode == 'block-device':
+            # volume is created along with the instance, and deleted along
+            # with it
+            bdm = BlockDeviceMapping()
+            bdm['/dev/sdb'] = BlockDeviceType(
+                size=vol_size,
+                delete_on_termination=True,
+            )
+            our_kwargs['block_device_map'] = bdm
+        reservation = ec2.run_instances(rd.ami_id, **our_kwargs)
         i_obj = reservation.instances[0]
-        self.apply_tags(i_obj, role=role)
+        tagger = self._delegate['tagger']
+        tagger.add(i_obj.id, self.tags(role=role))
         v_obj = None
-        if rd['volume']:
-            vol_size = int(rd['volume'])
-            log.info("Role {} requires {}GB volume".format(role, vol_size))
-            if vol_size > 0:
-                v_obj = ec2.create_volume(vol_size, i_obj.placement)
-                self.apply_tags(v_obj, role=role)
+        if vol_size > 0 and rd.volume_mode == 'attach':
+            v_obj = ec2.create_volume(vol_size, i_obj.placement)
+            tagger.add(v_obj.id, self.tags(role=role))
         return (i_obj, v_obj)
 
-    def instance_await_state(self, role, instance_id, state='running'):
-        return self.await_state(
-            role,
-            instance_id,
-            state=state,
-            thing='instance'
-        )
-
-    def volume_await_state(self, role, volume_id, state='running'):
-        return self.await_state(
-            role,
-            volume_id,
-            state=state,
-            thing='volume'
-        )
-
-    def await_state(self, role, t_id, thing=None, state=None):
-        log.info("Waiting for {} {} to reach '{}' state"
-                 .format(role, thing, state))
-        ec2 = self._delegate['ec2']
-        while True:
-            if thing == 'instance':
-                things = ec2.get_only_instances(instance_ids=[t_id])
-                aws_state = things[0].state
-            elif thing == 'volume':
-                things = ec2.get_all_volumes(volume_ids=[t_id])
-                aws_state = things[0].status
-            else:
-                assert 1 == 0, "Programmer brain failure"
-            log.info("Current state is {}".format(aws_state))
-            if aws_state != state:
-                log.info("Sleeping for 5 seconds")
-                time.sleep(5)
-            else:
-                # log.info("Sleeping another 5 seconds for good measure"
-                # time.sleep(5)
-                break
-
     def install(self, dry_run=False):
         self._delegate['roles'] = self.ready_to_install(dry_run=dry_run)
         if not self._delegate['roles']:
@@ -222,184 +227,107 @@ class Delegate(Region):
         if dry_run:
             log.info("Dry run: doing nothing")
         delegate = self._delegate['delegate']
-        c_stanza = stanza('clusters')
-        c_stanza[delegate] = {}
-        stanza('clusters', c_stanza)
+        journal('delegate installing', ['clusters', delegate], {})
         self.set_subnet_map_public_ip()
         # instantiate node for each role
+        self._delegate['tagger'] = Tagger(self._delegate['ec2'])
         aws_objs = {}
         for role in self._delegate['roles']:
-            c_stanza[delegate][role] = {}
-            stanza('clusters', c_stanza)
             (i_obj, v_obj) = self.instantiate_role(role)
             aws_objs[role] = {}
             aws_objs[role]['instance_obj'] = i_obj
             aws_objs[role]['volume_obj'] = v_obj
-            c_stanza[delegate][role]['instance_id'] = i_obj.id
-            c_stanza[delegate][role]['placement'] = i_obj.placement
+            r_stanza = {
+                'instance_id': i_obj.id,
+                'placement': i_obj.placement,
+            }
             if v_obj:
-                c_stanza[delegate][role]['volume_id'] = v_obj.id
-            stanza('clusters', c_stanza)
+                r_stanza['volume_id'] = v_obj.id
+            journal('instance launched', ['clusters', delegate, role],
+                    r_stanza)
             log.info("Instantiated {} node (instance ID {})"
                      .format(role, i_obj.id))
+        self._delegate['tagger'].flush()
         # attach volumes
-        ec2 = self._delegate['ec2']
+        pending = {}
         for role in self._delegate['roles']:
             i_obj = aws_objs[role]['instance_obj']
             v_obj = aws_objs[role]['volume_obj']
             if v_obj:
-                c_stanza[delegate][role]['volume_id'] = v_obj.id
-                self.instance_await_state(role, i_obj.id, state='running')
-                self.volume_await_state(role, v_obj.id, state='available')
-                assert ec2.attach_volume(v_obj.id, i_obj.id, '/dev/sdb'), (
-                    "Failed to attach volume to role {}, delegate {}"
-                    .format(role, delegate))
+                pending[role] = (i_obj.id, v_obj.id)
+        self.attach_volumes(pending)
         return None
 
-    def is_attached(self, v_id, i_id):
-        ec2 = self._delegate['ec2']
-        attached_vol = ec2.get_all_volumes(
-            filters={
-                "volume-id": v_id,
-                "attachment.instance-id": i_id,
-                "attachment.device": "/dev/sdb"
-            }
-        )
-        log.debug("attached_vol == {}".format(attached_vol))
-        if attached_vol is None or len(attached_vol) == 0:
-            return False
-        return True
-
-    def wait_for_detachment(self, v_id, i_id):
-        log.info("Waiting for volume {} to be detached from instance {}"
-                 .format(v_id, i_id))
-        while True:
-            if self.is_attached(v_id, i_id):
-                time.sleep(5)
-                log.info("Still attached")
-                continue
-            log.info("Volume has been detached")
-            break
-
-    def walk_clusters(self, operation=None, dry_run=False):
-        ec2 = self._delegate['ec2']
+    def attach_volumes(self, pending):
+        """
+            Given a dict mapping roles to (instance ID, volume ID) tuples,
+            attach each volume to its instance as soon as the instance is
+            running and the volume is available. All pending instances and
+            volumes are polled together, so the slowest node determines how
+            long this takes.
+        """
         delegate = self._delegate['delegate']
-        c_stanza = stanza('clusters')
-        if delegate not in c_stanza:
-            log.warning("Delegate {} has no instances"
-                        .format(delegate))
-            return None
-
-        if operation == "start":
-            what_done = "started"
-            do_what = ec2.start_instances
-        elif operation == "stop":
-            what_done = "stopped"
-            do_what = ec2.stop_instances
-        elif operation == "wipeout":
-            what_done = "terminated"
-            do_what = ec2.terminate_instances
-        else:
-            assert 1 == 0
-
-        instance_id_list = []
-        iv_map = {}  # keys are instance IDs and values are volume IDs
-        for role in c_stanza[delegate]:
-            if dry_run:
-                log.info("Dry run: doing nothing for role {!r}"
-                         .format(role))
-                continue
-            i_id = c_stanza[delegate][role]['instance_id']
-            instance_id_list.append(i_id)
-            if 'volume_id' in c_stanza[delegate][role]:
-                iv_map[i_id] = {
-                    'volume_id': c_stanza[delegate][role]['volume_id'],
-                    'role': role
-                }
-        if operation == "wipeout" and iv_map:
-            ec2.stop_instances(instance_ids=iv_map.keys())
-            # for i_id in iv_map.keys():
-            #     self.instance_await_state(
-            #         iv_map[i_id]['role'],
-            #         i_id,
-            #         state='stopped',
-            #     )
-            log.info("Detaching {} volumes...".format(len(iv_map)))
-            for i_id in iv_map.keys():
-                v_id = iv_map[i_id]['volume_id']
-                v_list = ec2.get_all_volume_status(volume_ids=[v_id])
-                log.debug("Volume {} status {}"
-                          .format(v_id, v_list[0].__dict__))
-                if self.is_attached(v_id, i_id):
-                    ec2.detach_volume(
-                        v_id,
-                        instance_id=i_id,
-                        device='/dev/sdb',
-                        force=True
-                    )
-            log.info("Deleting {} volumes...".format(len(iv_map)))
-            for i_id in iv_map.keys():
-                v_id = iv_map[i_id]['volume_id']
-                self.wait_for_detachment(v_id, i_id)
-                ec2.delete_volume(v_id)
-        if instance_id_list:
-            do_what(instance_ids=instance_id_list)
-        if operation == "wipeout" and not dry_run:
-            del(c_stanza[delegate])
-            stanza('clusters', c_stanza)
-        log.info("{} instances {} for delegate {}"
-                 .format(len(instance_id_list), what_done, delegate))
+        ec2 = self._delegate['ec2']
+        poller = self._delegate['poller']
+        pending = dict(pending)
+        ready = queue.Queue()
+        for (i_id, v_id) in pending.values():
+            poller.register('instance', i_id, 'running',
+                            lambda r_id, state: ready.put((r_id, state)))
+            poller.register('volume', v_id, 'available',
+                            lambda r_id, state: ready.put((r_id, state)))
+        ready_ids = set()
+        while pending:
+            log.info("Waiting for {} volume(s) to become attachable"
+                     .format(len(pending)))
+            (r_id, state) = ready.get()
+            if state is None:
+                raise WaitTimeout(
+                    "Delegate {}: timed out waiting for {} to become ready"
+                    .format(delegate, r_id))
+            ready_ids.add(r_id)
+            for role in sorted(pending.keys()):
+                (i_id, v_id) = pending[role]
+                if i_id not in ready_ids or v_id not in ready_ids:
+                    continue
+                log.info("Attaching volume {} to {} node (instance ID {})"
+                         .format(v_id, role, i_id))
+                assert ec2.attach_volume(v_id, i_id, '/dev/sdb'), (
+                    "Failed to attach volume to role {}, delegate {}"
+                    .format(role, delegate))
+                journal('volume attached',
+                        ['clusters', delegate, role, 'volume_attached'], True)
+                del(pending[role])
+        return None
 
     def wipeout(self, dry_run=False):
-        self.walk_clusters(operation='wipeout', dry_run=dry_run)
+        delegate = self._delegate['delegate']
+        Fleet(self.args, [delegate]).wipeout(dry_run=dry_run)
 
     def stop(self, dry_run=False):
-        self.walk_clusters(operation='stop', dry_run=dry_run)
+        delegate = self._delegate['delegate']
+        Fleet(self.args, [delegate]).stop(dry_run=dry_run)
 
     def start(self, dry_run=False):
-        self.walk_clusters(operation='start', dry_run=dry_run)
-
-    def fetch_public_ip(self, role):
-        ec2 = self._delegate['ec2']
-        subnet_id = self._delegate['subnet_obj'].id
-        instances = ec2.get_only_instances(
-            filters={
-                "subnet-id": subnet_id,
-                "tag-key": "Role",
-                "tag-value": role
-            }
-        )
-        found = False
-        public_ip = ''
-        for i in instances:
-            public_ip = "{}".format(i.ip_address)
-            found = True
-        if not found:
-            public_ip = "(none)"
-        return public_ip
+        delegate = self._delegate['delegate']
+        Fleet(self.args, [delegate]).start(dry_run=dry_run)
 
     def probe(self):
         delegate = self._delegate['delegate']
-        c_stanza = stanza('clusters')
-        if delegate not in c_stanza:
-            log.info("Delegate {} not instantiated".format(delegate))
+        public_ips = self.public_ips()
+        if public_ips is None:
             return None
-        d_stanza = c_stanza[delegate]
         retval = False
-        for role in d_stanza.keys():
+        for role in public_ips.keys():
             retval = True
             log.info("Delegate {}, role {}, public IP {}"
-                     .format(delegate, role, self.fetch_public_ip(role)))
+                     .format(delegate, role, public_ips[role]))
         return retval
 
     def public_ips(self):
         delegate = self._delegate['delegate']
-        c_stanza = stanza('clusters')
-        public_ips = {}
-        if delegate not in c_stanza:
+        public_ips = Fleet(self.args, [delegate]).public_ips()
+        if delegate not in public_ips:
             log.info("Delegate {} not instantiated".format(delegate))
             return None
-        d_stanza = c_stanza[delegate]
-        for role in d_stanza.keys():
-            public_ips[role] = self.fetch_public_ip(role)
-        return public_ips
+        return public_ips[delegate]
@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import argparse
+import logging
+
+from handson.cluster_options import (
+    ClusterOptions,
+)
+from handson.misc import (
+    CustomFormatter,
+    InitArgs,
+)
+from handson.parallel import run_in_parallel
+from handson.parsers import (
+    cluster_options_parser,
+    parallel_parser,
+    ssh_user_parser,
+)
+from handson.ssh import (
+    ConnectionManager,
+    fleet_nodes,
+    host_alias,
+    write_ssh_config,
+)
+
+log = logging.getLogger(__name__)
+
+
+class Exec(object):
+
+    @staticmethod
+    def get_parser():
+        parser = argparse.ArgumentParser(
+            usage='ho exec',
+            formatter_class=CustomFormatter,
+            parents=[
+                cluster_options_parser(),
+                parallel_parser(),
+                ssh_user_parser(),
+            ],
+            conflict_handler='resolve',
+            add_help=False,
+        )
+
+        what = parser.add_mutually_exclusive_group(required=True)
+
+        what.add_argument(
+            '-c', '--command',
+            help="Command to run on each node",
+        )
+
+        what.add_argument(
+            '-s', '--script',
+            help="Local script to run on each node (with bash)",
+        )
+
+        parser.add_argument(
+            '-r', '--roles',
+            nargs='+', metavar='ROLE',
+            help="Run only on nodes with these roles",
+        )
+
+        parser.add_argument(
+            '-t', '--timeout',
+            type=int, default=600, metavar='SECONDS',
+            help="Kill the command on nodes where it runs longer than this",
+        )
+
+        parser.set_defaults(
+            func=ExecCommand,
+        )
+
+        return parser
+
+
+class ExecCommand(InitArgs, ClusterOptions):
+
+    def __init__(self, args):
+        super(ExecCommand, self).__init__(args)
+        self.args = args
+
+    def nodes(self):
+        """
+            Return a sorted list of (delegate, role, public IP) tuples of
+            the selected nodes, and refresh the ssh_config, which covers all
+            nodes, on the way. The public IP is None for nodes that have
+            none.
+        """
+        nodes = fleet_nodes(self.args)
+        write_ssh_config(nodes, self.args.user)
+        roles = self.args.roles
+        return [
+            (d, role, ip) for (d, role, ip) in nodes
+            if d in self.args.delegate_list and
+            (not roles or role in roles)
+        ]
+
+    def exec_node(self, node):
+        (d, role, _) = node
+        manager = ConnectionManager()
+        if self.args.script:
+            with open(self.args.script, 'rb') as f:
+                return manager.run(host_alias(d, role), 'bash -s',
+                                   timeout=self.args.timeout, stdin=f)
+        return manager.run(host_alias(d, role), self.args.command,
+                           timeout=self.args.timeout)
+
+    def run(self):
+        self.process_delegate_list()
+        nodes = self.nodes()
+        assert nodes, "No running nodes selected"
+        unreachable = [n for n in nodes if n[2] is None]
+        for (d, role, _) in unreachable:
+            log.warning("Delegate {}, role {} has no public IP"
+                        .format(d, role))
+        nodes = [n for n in nodes if n[2] is not None]
+        if self.args.dry_run:
+            log.info("Dry run: would run on {} node(s)".format(len(nodes)))
+            return None
+        results = run_in_parallel(
+            self.exec_node,
+            nodes,
+            parallel=self.args.parallel,
+        )
+        failed = [host_alias(d, role) for (d, role, _) in unreachable]
+        for node in nodes:
+            (d, role, ip) = node
+            (ok, rc) = results[node]
+            if not ok:
+                status = "error: {}".format(rc)
+            elif rc is None:
+                status = "timed out"
+            else:
+                status = "exit status {}".format(rc)
+            log.info("Delegate {}, role {} ({}): {}"
+                     .format(d, role, ip, status))
+            if not ok or rc != 0:
+                failed.append(host_alias(d, role))
+        log.info("Command succeeded on {} of {} node(s)"
+                 .format(len(nodes) + len(unreachable) - len(failed),
+                         len(nodes) + len(unreachable)))
+        assert not failed, (
+            "Command failed on node(s) {}".format(', '.join(failed)))
+        return None
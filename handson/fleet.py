@@ -0,0 +1,232 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+from handson.myyaml import (
+    journal,
+    stanza,
+)
+from handson.poller import shared_poller
+from handson.region import Region
+from handson.util import chunks
+
+log = logging.getLogger(__name__)
+
+# maximum number of resource IDs passed to a single bulk API call
+API_CHUNK = 200
+# page size of the inventory describe, and the instance states it covers
+INVENTORY_PAGE = 1000
+INVENTORY_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+
+class Fleet(Region):
+    """
+        Operations on a set of delegates at once. Unlike Delegate, a Fleet
+        works from the clusters stanza alone: it does not look up keypairs
+        or subnets, and it acts on all selected delegates with a few bulk
+        API calls.
+    """
+
+    def __init__(self, args, delegates):
+        super(Fleet, self).__init__(args)
+        self.args = args
+        self._fleet = {
+            'delegates': list(delegates),
+        }
+
+    def resources(self):
+        """
+            Read the instance and volume IDs of the selected delegates from
+            the clusters stanza in one pass. Returns a tuple (delegates,
+            instances, volumes): the selected delegates that have a cluster,
+            and two dicts mapping instance and volume IDs, respectively, to
+            (delegate, role) tuples.
+        """
+        c_stanza = stanza('clusters')
+        delegates = []
+        instances = {}
+        volumes = {}
+        for d in self._fleet['delegates']:
+            if d not in c_stanza:
+                log.warning("Delegate {} has no instances".format(d))
+                continue
+            delegates.append(d)
+            for role in c_stanza[d]:
+                r_stanza = c_stanza[d][role] or {}
+                if r_stanza.get('instance_id'):
+                    instances[r_stanza['instance_id']] = (d, role)
+                if r_stanza.get('volume_id'):
+                    volumes[r_stanza['volume_id']] = (d, role)
+        return (delegates, instances, volumes)
+
+    def inventory(self):
+        """
+            Fetch every live instance in the VPC with one paginated describe
+            and index them in memory by (delegate, role), as given by their
+            Delegate and Role tags. Returns the index, a dict the values of
+            which are instance objects.
+        """
+        ec2 = self.ec2()
+        filters = {
+            'instance-state-name': INVENTORY_STATES,
+        }
+        vpc_id = stanza('vpc').get('id')
+        if vpc_id:
+            filters['vpc-id'] = vpc_id
+        index = {}
+        next_token = None
+        while True:
+            reservations = ec2.get_all_reservations(
+                filters=filters,
+                max_results=INVENTORY_PAGE,
+                next_token=next_token,
+            )
+            for r in reservations:
+                for i_obj in r.instances:
+                    d = i_obj.tags.get('Delegate')
+                    role = i_obj.tags.get('Role')
+                    if d is None or role is None:
+                        continue
+                    try:
+                        d = int(d)
+                    except ValueError:
+                        continue
+                    index[(d, role)] = i_obj
+            next_token = reservations.next_token
+            if not next_token:
+                break
+        log.debug("Inventory holds {} instances".format(len(index)))
+        return index
+
+    def public_ips(self):
+        """
+            Return a dict mapping each selected delegate that has a cluster
+            to a dict mapping its roles to their public IP addresses, or
+            "(none)" for roles that have none.
+        """
+        c_stanza = stanza('clusters')
+        index = self.inventory()
+        public_ips = {}
+        for d in self._fleet['delegates']:
+            if d not in c_stanza:
+                continue
+            public_ips[d] = {}
+            for role in c_stanza[d]:
+                i_obj = index.get((d, role))
+                if i_obj is None or not i_obj.ip_address:
+                    public_ips[d][role] = "(none)"
+                else:
+                    public_ips[d][role] = "{}".format(i_obj.ip_address)
+        return public_ips
+
+    def walk_instances(self, operation, dry_run=False):
+        """
+            Start or stop all instances of the selected delegates.
+        """
+        ec2 = self.ec2()
+        if operation == "start":
+            what_done = "started"
+            do_what = ec2.start_instances
+        elif operation == "stop":
+            what_done = "stopped"
+            do_what = ec2.stop_instances
+        else:
+            assert 1 == 0, "Unknown operation {!r}".format(operation)
+        (delegates, instances, _) = self.resources()
+        if dry_run:
+            log.info("Dry run: doing nothing for {} instances of delegates "
+                     "{!r}".format(len(instances), delegates))
+            return None
+        for chunk in chunks(sorted(instances), API_CHUNK):
+            do_what(instance_ids=chunk)
+        log.info("{} instances {} for delegates {!r}"
+                 .format(len(instances), what_done, delegates))
+        return None
+
+    def start(self, dry_run=False):
+        return self.walk_instances('start', dry_run=dry_run)
+
+    def stop(self, dry_run=False):
+        return self.walk_instances('stop', dry_run=dry_run)
+
+    def delete_volumes(self, volumes):
+        """
+            Delete each of the given volumes as soon as it becomes available
+            (i.e. detached). Returns the list of volumes that could not be
+            deleted.
+        """
+        ec2 = self.ec2()
+        poller = shared_poller(self.args)
+        ready = queue.Queue()
+        for v_id in volumes:
+            poller.register('volume', v_id, 'available',
+                            lambda r_id, state: ready.put((r_id, state)))
+        failed = []
+        for _ in range(len(volumes)):
+            (v_id, state) = ready.get()
+            if state is None:
+                failed.append(v_id)
+                continue
+            log.debug("Deleting volume {}".format(v_id))
+            ec2.delete_volume(v_id)
+        return failed
+
+    def wipeout(self, dry_run=False):
+        """
+            Terminate all instances of the selected delegates, delete their
+            volumes and remove them from the clusters stanza.
+        """
+        (delegates, instances, volumes) = self.resources()
+        if dry_run:
+            log.info("Dry run: doing nothing for {} instances and {} "
+                     "volumes of delegates {!r}"
+                     .format(len(instances), len(volumes), delegates))
+            return None
+        ec2 = self.ec2()
+        # terminating an instance detaches its volumes
+        for chunk in chunks(sorted(instances), API_CHUNK):
+            ec2.terminate_instances(instance_ids=chunk)
+        log.info("{} instances terminated for delegates {!r}"
+                 .format(len(instances), delegates))
+        if volumes:
+            log.info("Deleting {} volumes...".format(len(volumes)))
+            failed = self.delete_volumes(sorted(volumes))
+            if failed:
+                log.warning("Failed to delete volumes {!r}: delete them "
+                            "manually".format(failed))
+        for d in delegates:
+            journal('delegate wiped', ['clusters', d], delete=True)
+        return None
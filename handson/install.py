@@ -36,15 +36,24 @@ import time
 from handson.cluster_options import (
     ClusterOptions,
 )
+from handson.config import config
 from handson.delegate import Delegate
 from handson.keypair import Keypair
 from handson.misc import (
     CustomFormatter,
     InitArgs,
 )
+from handson.parallel import run_in_parallel
 from handson.parsers import (
     cluster_options_parser,
     dry_run_only_parser,
+    parallel_parser,
+    phone_home_parser,
+)
+from handson.phonehome import (
+    PhoneHome,
+    callback_url,
+    expected_nodes,
 )
 from handson.subnet import Subnet
 from handson.vpc import VPC
@@ -82,7 +91,7 @@ class Install(object):
             help='install subcommand -h',
         )
 
-        subparsers.add_parser(
+        install_delegates = subparsers.add_parser(
             'delegates',
             formatter_class=CustomFormatter,
             description=textwrap.dedent("""\
@@ -96,11 +105,25 @@ class Install(object):
             $ echo $?
             0
 
+            $ ho install delegates --all --parallel 10
+
+            $ ho install delegates --all --wait
+
             """),
             help='Install delegate cluster(s) in AWS',
-            parents=[cluster_options_parser()],
+            parents=[
+                cluster_options_parser(),
+                parallel_parser(),
+                phone_home_parser(),
+            ],
             add_help=False,
-        ).set_defaults(
+        )
+        install_delegates.add_argument(
+            '-w', '--wait',
+            action='store_true', default=None,
+            help="Wait for the nodes to phone home (see ho wait)",
+        )
+        install_delegates.set_defaults(
             func=InstallDelegates,
         )
 
@@ -178,17 +201,78 @@ class InstallDelegates(InitArgs, ClusterOptions):
         super(InstallDelegates, self).__init__(args)
         self.args = args
 
+    def install_delegate(self, d):
+        log.info("Installing cluster for delegate {}".format(d))
+        d_obj = Delegate(self.args, d)
+        d_obj.install(dry_run=self.args.dry_run)
+        return None
+
     def run(self):
         self.process_delegate_list()
-        for d in self.args.delegate_list:
-            log.info("Installing cluster for delegate {}".format(d))
-            d = Delegate(self.args, d)
-            d.install(dry_run=self.args.dry_run)
+        gate = self.gate_on_package_cache()
+        phone_home = None
+        if (self.args.wait or gate) and not self.args.dry_run:
+            # listen before the nodes are launched, so that none is missed
+            phone_home = PhoneHome()
+            phone_home.start()
+        try:
+            self.install(phone_home, gate)
+        finally:
+            if phone_home:
+                phone_home.stop()
+
+    def gate_on_package_cache(self):
+        """
+            Tell whether the delegates must wait for the package cache on
+            the Salt Master, to which their repository URLs point, to be up
+            before they are installed.
+        """
+        master_rd = config().role_defs.get('master')
+        if not (master_rd and master_rd.package_cache):
+            return False
+        if not [d for d in self.args.delegate_list if d != 0]:
+            return False
+        assert callback_url(0, 'master'), (
+            "The Salt Master runs a package cache, so the delegates can only "
+            "be installed once it has phoned home: set the phone-home "
+            "stanza")
+        return True
+
+    def install_delegates(self, delegates):
+        results = run_in_parallel(
+            self.install_delegate,
+            delegates,
+            parallel=self.args.parallel,
+        )
+        failed = []
+        for d in delegates:
+            (ok, result) = results[d]
+            if ok:
+                log.info("Delegate {} installed".format(d))
+            else:
+                log.error("Delegate {} failed to install: {}"
+                          .format(d, result))
+                failed.append(d)
+        assert not failed, (
+            "Failed to install delegate(s) {!r}".format(failed))
+
+    def install(self, phone_home, gate):
+        delegates = list(self.args.delegate_list)
+        if gate and phone_home:
+            if 0 in delegates:
+                self.install_delegates([0])
+                delegates.remove(0)
+            log.info("Waiting for the package cache on the Salt Master")
+            phone_home.wait([(0, 'master')], timeout=self.args.timeout)
+        self.install_delegates(delegates)
         if self.args.master:
             d = Delegate(self.args, 0)
             log.info("Polling for Salt Master public IP")
             while not d.probe():
                 time.sleep(5)
+        if phone_home and self.args.wait:
+            phone_home.wait(expected_nodes(self.args.delegate_list),
+                            timeout=self.args.timeout)
 
 
 class InstallKeypairs(InitArgs, ClusterOptions):
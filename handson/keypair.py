@@ -30,7 +30,10 @@
 #
 import logging
 
-from handson.myyaml import stanza
+from handson.myyaml import (
+    lock as yaml_lock,
+    stanza,
+)
 from handson.region import Region
 from handson.util import get_file_as_string
 
@@ -89,10 +92,11 @@ class Keypair(Region):
         log.info("Keypair {} imported to AWS".format(k_name))
         self._keypair['keypair_obj'] = k_obj
         self._keypair['key_name'] = k_name
-        k_stanza = stanza('keypairs')
-        k_stanza[d] = {}
-        k_stanza[d]['keyname'] = k_name
-        stanza('keypairs', k_stanza)
+        with yaml_lock:
+            k_stanza = stanza('keypairs')
+            k_stanza[d] = {}
+            k_stanza[d]['keyname'] = k_name
+            stanza('keypairs', k_stanza)
 
     def keypair_obj(self, import_ok=False, dry_run=False):
         if self._keypair['keypair_obj'] is not None:
@@ -30,16 +30,22 @@
 #
 
 import handson.myyaml
+import handson.region
+import handson.waiter
 import logging
 import sys
 import textwrap
 
 from argparse import ArgumentParser
+from handson.bake import Bake
+from handson.execute import Exec
 from handson.install import Install
 from handson.misc import CustomFormatter
 from handson.probe import Probe
+from handson.sshcommand import SSH
 from handson.start import Start
 from handson.stop import Stop
+from handson.wait import Wait
 from handson.wipeout import WipeOut
 
 logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
@@ -94,6 +100,51 @@ class HandsOn(object):
             help='subcommand -h',
         )
 
+        subparsers.add_parser(
+            'bake',
+            formatter_class=CustomFormatter,
+            description=textwrap.dedent("""\
+            Bake role AMIs.
+
+            For each role, launches a builder instance that runs the role's
+            bake-user-data, creates an AMI from it and sets the role's ami-id
+            to that AMI.
+            """),
+            epilog=textwrap.dedent("""
+            Examples:
+
+            $ ho bake
+            $ ho bake mon1 osd --parallel 2
+
+            """),
+            help='Bake role AMIs',
+            parents=[Bake.get_parser()],
+            add_help=False,
+        )
+
+        subparsers.add_parser(
+            'exec',
+            formatter_class=CustomFormatter,
+            description=textwrap.dedent("""\
+            Run a command on nodes over SSH.
+
+            Runs the command (or local script) on every selected node, up to
+            --parallel at a time, using the keys created by generate-keys.sh.
+            Output is streamed, each line prefixed with the node it comes
+            from, and the exit status of each node is reported at the end.
+            """),
+            epilog=textwrap.dedent("""
+            Examples:
+
+            $ ho exec 1-3 -c uptime
+            $ ho exec --all --roles admin -s states/health-ok.sh -p 20
+
+            """),
+            help='Run a command on nodes over SSH',
+            parents=[Exec.get_parser()],
+            add_help=False,
+        )
+
         subparsers.add_parser(
             'install',
             formatter_class=CustomFormatter,
@@ -130,6 +181,23 @@ class HandsOn(object):
             add_help=False,
         )
 
+        subparsers.add_parser(
+            'ssh',
+            formatter_class=CustomFormatter,
+            description=textwrap.dedent("""\
+            Manage SSH access to the nodes.
+            """),
+            epilog=textwrap.dedent("""
+            Examples:
+
+            $ ho ssh config
+
+            """),
+            help='Manage SSH access to the nodes',
+            parents=[SSH.get_parser()],
+            add_help=False,
+        )
+
         subparsers.add_parser(
             'start',
             formatter_class=CustomFormatter,
@@ -164,6 +232,27 @@ class HandsOn(object):
             add_help=False,
         )
 
+        subparsers.add_parser(
+            'wait',
+            formatter_class=CustomFormatter,
+            description=textwrap.dedent("""\
+            Wait for nodes to finish their user-data.
+
+            Listens for the nodes of the given delegates to phone home (see
+            @@CALLBACK@@ in README.rst) and returns once they all have.
+            """),
+            epilog=textwrap.dedent("""
+            Examples:
+
+            $ ho wait --all
+            $ ho wait 1-3 --roles mon1 mon2 mon3 --timeout 600
+
+            """),
+            help='Wait for nodes to finish their user-data',
+            parents=[Wait.get_parser()],
+            add_help=False,
+        )
+
         subparsers.add_parser(
             'wipeout',
             formatter_class=CustomFormatter,
@@ -192,6 +281,11 @@ class HandsOn(object):
 
         # log.info("HandsOn self.args {!r}".format(self.args))
         handson.myyaml.initialize_internal_buffers()
+        handson.waiter.initialize_internal_buffers()
         self.args.func(self.args).run()
+        handson.waiter.save_stats()
+        handson.myyaml.compact()
+        log.debug("AWS connections: {!r}"
+                  .format(handson.region.connection_stats()))
 
         sys.exit(0)
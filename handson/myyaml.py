@@ -28,12 +28,21 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import copy
+import json
 import logging
 import os
+import pickle
 import pwd
-
-from yaml import safe_load
-from pyaml import dump
+import threading
+
+from handson.backend import backends
+from handson.util import (
+    atomic_write,
+    file_lock,
+    yaml_dump,
+    yaml_load,
+)
 
 
 def get_logged_user():
@@ -48,6 +57,8 @@ def get_logged_user():
 
 log = logging.getLogger(__name__)
 
+volume_modes = ['attach', 'block-device']
+
 tree_stanzas = {
     'cluster-definition': {'default': [{'role': 'admin'}], 'type': list},
     'clusters': {'default': {}, 'type': dict},
@@ -55,6 +66,10 @@ tree_stanzas = {
     'keyname': {'default': get_logged_user(), 'type': str},
     'keypairs': {'default': {}, 'type': dict},
     'nametag': {'default': 'handson', 'type': str},
+    'phone-home': {'default': {
+        'address': None,
+        'port': 8765,
+    }, 'type': dict},
     'region': {'default': {
         'region_str': 'eu-west-1',
         'availability_zone': None
@@ -63,12 +78,17 @@ tree_stanzas = {
         'admin': {'last-octet': 10},
         'defaults': {
             'ami-id': None,
+            'bake-user-data': None,
+            'base-ami-id': None,
+            'compress-user-data': False,
             'last-octet': None,
             'node-no': None,
+            'package-cache': False,
             'replace-from-environment': [],
             'type': 't2.small',
             'user-data': None,
-            'volume': None
+            'volume': None,
+            'volume-mode': 'attach'
         },
         'master': {'last-octet': 10},
         'mon1': {'last-octet': 11},
@@ -77,7 +97,9 @@ tree_stanzas = {
         'osd': {'last-octet': 14},
         'windows': {'last-octet': 15},
     }, 'type': dict},
+    'state-backend': {'default': 'yaml', 'type': str},
     'subnets': {'default': {}, 'type': dict},
+    'transition-times': {'default': {}, 'type': dict},
     'types': {'default': ['t2.micro', 't2.small'], 'type': list},
     'vpc': {'default': {}, 'type': dict}
 }
@@ -90,12 +112,56 @@ _cache = {}
 _cache_populated = False
 _yfn = None
 
+# Serializes access to the cache and the YAML file. Callers that modify a
+# stanza in place (read, mutate, write back) must hold it for the duration.
+lock = threading.RLock()
+
+# Stanzas changed by this process since the YAML file was last written. Only
+# these are written back; the others are taken from the file as it is on
+# disk, so that concurrent ho processes do not undo each other's changes.
+_changed = set()
+
+# Stanzas missing from the YAML file, for which the default has been put in
+# the cache, and stanzas whose type has been checked since they were loaded
+# or last set. Defaults are written to the file only by an explicit flush()
+# (or along with other changes); checked stanzas are returned by stanza()
+# without further ado.
+_defaulted = set()
+_sane = set()
+
+# Bumped whenever the cached configuration may have changed (new load, one of
+# the config_stanzas set or refreshed from disk), so that snapshots compiled
+# from it (see handson.config) can tell when they are stale. Changes to the
+# state stanzas (subnets, keypairs etc.) do not count.
+config_stanzas = ('cluster-definition', 'role-definitions')
+_generation = 0
+
+# Mutations of the cluster state are appended to a journal next to the YAML
+# file (one JSON record per line) and replayed on load; the journal is folded
+# back into the YAML file after this many records and whenever the file is
+# written anyway.
+JOURNAL_COMPACT_RECORDS = 100
+_journal_records = 0
+
+# The per-delegate state stanzas can be kept in a database instead of the
+# YAML file (see handson.backend); None means the YAML file keeps everything.
+_backend = None
+
 
 def initialize_internal_buffers():
-    global _cache, _cache_populated, _yfn
+    global _cache, _cache_populated, _yfn, _journal_records, _backend
+    global _generation
+    _generation += 1
     _cache = {}
     _cache_populated = False
+    _changed.clear()
+    _defaulted.clear()
+    _sane.clear()
     _yfn = None
+    _journal_records = 0
+    if _backend is not None:
+        _backend.close()
+    _backend = None
 
 
 def yaml_file_name(fn=None):
@@ -118,28 +184,297 @@ def load():
         Load yaml tree into cache from yaml file
     """
     global _cache, _cache_populated
-    if _cache_populated:
-        log.debug("YAML cache already populated")
+    with lock:
+        if _cache_populated:
+            log.debug("YAML cache already populated")
+            return None
+        yfn = yaml_file_name()
+        log.debug("Loading YAML file {!r}".format(yfn))
+        if not os.path.exists(yfn):
+            touch(yfn)
+        _cache = read_tree(yfn)
+        assert type(_cache) is dict, "YAML file is not a mapping"
+        replay_journal()
+        _cache_populated = True
+        open_backend()
+    log.info("Loaded yaml tree from {!r}".format(yfn))
+    return None
+
+
+def lock_file_name():
+    return "{}.lock".format(yaml_file_name())
+
+
+def parse_cache_file_name(yfn):
+    (head, tail) = os.path.split(yfn)
+    return os.path.join(head, '.{}.cache'.format(tail))
+
+
+def file_signature(yfn):
+    st = os.stat(yfn)
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+def read_tree(yfn):
+    """
+        Return the tree in the given YAML file. The parsed tree is cached in
+        a pickle next to the file, which is used instead of parsing the file
+        as long as the file's inode, size and mtime are unchanged.
+    """
+    signature = file_signature(yfn)
+    try:
+        with open(parse_cache_file_name(yfn), 'rb') as f:
+            (cached_signature, tree) = pickle.load(f)
+        if tuple(cached_signature) == signature:
+            log.debug("Using parse cache of {!r}".format(yfn))
+            return tree
+    except Exception:
+        # missing, stale or unreadable: parse the file instead
+        pass
+    with open(yfn) as f:
+        tree = yaml_load(f) or {}
+    write_parse_cache(yfn, tree)
+    return tree
+
+
+def write_parse_cache(yfn, tree):
+    try:
+        atomic_write(
+            parse_cache_file_name(yfn),
+            pickle.dumps(
+                (file_signature(yfn), tree), pickle.HIGHEST_PROTOCOL
+            )
+        )
+    except (IOError, OSError) as e:
+        log.debug("Cannot write parse cache of {!r}: {}".format(yfn, e))
+    return None
+
+
+def backend_stanzas():
+    return _backend.stanzas if _backend else ()
+
+
+def open_backend():
+    """
+        Open the state backend selected by the state-backend stanza, if it
+        is not the YAML file itself, and load the stanzas it keeps into the
+        cache. A new backend is populated from the YAML file, from which
+        the imported stanzas are then removed.
+    """
+    global _backend
+    name = _cache.get('state-backend') or 'yaml'
+    if name == 'yaml':
+        return None
+    assert name in backends, "Unknown state-backend {!r}".format(name)
+    _backend = backends[name](os.path.splitext(yaml_file_name())[0])
+    if _backend.is_new():
+        _backend.import_state(
+            dict((k, _cache.get(k)) for k in _backend.stanzas)
+        )
+        _cache.update(_backend.load())
+        flush()
         return None
+    for k in _backend.stanzas:
+        if _cache.get(k):
+            log.warning("Ignoring {!r} stanza in YAML file: it is kept in "
+                        "{!r}".format(k, _backend.fn))
+    _cache.update(_backend.load())
+    return None
+
+
+def write():
+    """
+        Write the cache to the YAML file.
+    """
+    flush()
+    return None
+
+
+def flush():
+    """
+        Write the stanzas changed by this process to the YAML file. Under an
+        exclusive lock on the lock file, the file is read again, the changed
+        stanzas are merged into it (the others are refreshed in the cache
+        from it) and it is atomically replaced.
+    """
+    global _cache, _generation
     yfn = yaml_file_name()
-    log.debug("Loading YAML file {!r}".format(yfn))
-    touch(yfn)
-    with open(yfn) as f:
-        _cache = safe_load(f)
-    if _cache is None:
-        _cache = {}
-    assert type(_cache) is dict, "YAML file is not a mapping"
-    _cache_populated = True
-    log.info("Loaded yaml tree from {!r}".format(yfn))
+    with lock, file_lock(lock_file_name()):
+        tree = read_tree(yfn) if os.path.exists(yfn) else {}
+        for k in list(tree.keys()):
+            if k in backend_stanzas():
+                del(tree[k])
+            elif k not in _changed and tree[k] is not None:
+                if _cache.get(k) != tree[k]:
+                    if k in config_stanzas:
+                        _generation += 1
+                    refresh_stanza(k, tree[k])
+                _defaulted.discard(k)
+                _sane.discard(k)
+        for k in _changed | _defaulted:
+            if k in _cache and k not in backend_stanzas():
+                tree[k] = _cache[k]
+        dump_tree(tree, yfn)
+        _changed.clear()
+        _defaulted.clear()
+        truncate_journal()
+    log.debug("Wrote yaml tree to {!r}".format(yfn))
+    return None
+
+
+def refresh_stanza(k, value):
+    """
+        Replace the cached value of stanza k with the given one, in place if
+        possible, so that callers holding the stanza see the new value and
+        their changes to it are not lost.
+    """
+    old = _cache.get(k)
+    if isinstance(old, dict) and isinstance(value, dict):
+        old.clear()
+        old.update(value)
+    elif isinstance(old, list) and isinstance(value, list):
+        old[:] = value
+    else:
+        _cache[k] = value
+    return None
+
+
+def dump_tree(tree, yfn):
+    """
+        Atomically replace the given YAML file with the given tree.
+    """
+    atomic_write(yfn, yaml_dump(tree))
+    write_parse_cache(yfn, tree)
+    return None
+
+
+def export_state(fn):
+    """
+        Write the whole tree, including the stanzas kept by the state
+        backend, to the given YAML file, which can then be used with the
+        default YAML state backend.
+    """
+    load()
+    with lock:
+        tree = dict(_cache)
+        tree['state-backend'] = 'yaml'
+        dump_tree(tree, fn)
+    log.info("Exported yaml tree to {!r}".format(fn))
     return None
 
 
-def write():  # pragma: no cover
+def journal_file_name():
+    return "{}.journal".format(yaml_file_name())
+
+
+def apply_record(record):
+    """
+        Apply a journal record to the cache.
+    """
     global _cache
-    yfn = yaml_file_name()
-    touch(yfn)
-    with open(yfn, 'w') as outfile:
-        outfile.write(dump(_cache, vspacing=[1, 0]))
+    path = record['path']
+    node = _cache
+    for key in path[:-1]:
+        if node.get(key) is None:
+            node[key] = {}
+        node = node[key]
+    if record['op'] == 'set':
+        node[path[-1]] = record['value']
+    elif record['op'] == 'delete':
+        node.pop(path[-1], None)
+    else:
+        assert 1 == 0, "Unknown journal operation {!r}".format(record['op'])
+    return None
+
+
+def replay_journal():
+    """
+        Apply the records of the journal, if any, to the freshly loaded
+        cache. Records are idempotent, so replaying a journal that was
+        already folded into the YAML file does no harm. A torn last record,
+        left by a crash in the middle of an append, is ignored.
+    """
+    global _journal_records
+    jfn = journal_file_name()
+    if not os.path.exists(jfn):
+        return None
+    with open(jfn) as f:
+        lines = f.readlines()
+    for (n, line) in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            if n == len(lines) - 1:
+                log.warning("Ignoring incomplete last record in journal {!r}"
+                            .format(jfn))
+                break
+            raise
+        apply_record(record)
+        _changed.add(record['path'][0])
+        _journal_records += 1
+    if _journal_records:
+        log.info("Replayed {} record(s) from journal {!r}"
+                 .format(_journal_records, jfn))
+    return None
+
+
+def truncate_journal():
+    global _journal_records
+    jfn = journal_file_name()
+    if os.path.exists(jfn):
+        os.unlink(jfn)
+    _journal_records = 0
+    return None
+
+
+def journal(event, path, value=None, delete=False):
+    """
+        Record a mutation of the state: set the value at the given path of
+        keys (starting with a stanza name), or delete it. The change is
+        applied to the cache and appended to the journal, which is fsynced,
+        so it is durable without rewriting the YAML file.
+    """
+    global _journal_records
+    assert path and path[0] in tree_stanzas, (
+        "YAML stanza {!r} not permitted".format(path[0] if path else None)
+    )
+    load()
+    record = {'event': event, 'path': list(path)}
+    if delete:
+        record['op'] = 'delete'
+    else:
+        record['op'] = 'set'
+        record['value'] = value
+    line = json.dumps(record, sort_keys=True)
+    with lock:
+        stanza_is_sane(path[0])
+        apply_record(record)
+        if path[0] in backend_stanzas():
+            # the backend stores the change durably by itself
+            _backend.store(
+                path[0], _cache[path[0]], path[1:2] if len(path) > 1 else None
+            )
+            log.debug("Stored {}: {}".format(event, line))
+            return None
+        _changed.add(path[0])
+        with open(journal_file_name(), 'a') as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        _journal_records += 1
+        log.debug("Journaled {}: {}".format(event, line))
+        if _journal_records >= JOURNAL_COMPACT_RECORDS:
+            flush()
+    return None
+
+
+def compact():
+    """
+        Fold the journal into the YAML file, if it has any records.
+    """
+    with lock:
+        if _journal_records:
+            flush()
     return None
 
 
@@ -149,10 +484,15 @@ def stanza_is_present(s):
 
 
 def apply_default(k):
+    """
+        Put the default of stanza k in the cache if it is missing from the
+        YAML file. The default is not written to the file at this point.
+    """
     global _cache
     if k not in _cache or _cache[k] is None:
-        _cache[k] = tree_stanzas[k]['default']
-        write()
+        _cache[k] = copy.deepcopy(tree_stanzas[k]['default'])
+        if k not in backend_stanzas():
+            _defaulted.add(k)
     return None
 
 
@@ -164,31 +504,58 @@ def check_if_malformed(k):
 
 
 def stanza_is_sane(k):
+    if k in _sane:
+        return None
     apply_default(k)
     check_if_malformed(k)
+    _sane.add(k)
+    return None
+
+
+def generation():
+    return _generation
 
 
 def stanza(k, new_val=None):
-    global _cache
+    global _cache, _generation
+    if new_val is None and k in _sane and _cache_populated:
+        # fast path: loaded, defaulted and checked already
+        return _cache[k]
     load()
-    if new_val is not None:
-        assert k in tree_stanzas.keys(), (
-            "YAML stanza {!r} not permitted".format(k)
-        )
-        _cache[k] = new_val
-        write()
-    stanza_is_sane(k)
-    return _cache[k]
+    with lock:
+        if new_val is not None:
+            assert k in tree_stanzas.keys(), (
+                "YAML stanza {!r} not permitted".format(k)
+            )
+            _cache[k] = new_val
+            if k in config_stanzas:
+                _generation += 1
+            _defaulted.discard(k)
+            _sane.discard(k)
+            if k in backend_stanzas():
+                _backend.store(k, new_val)
+            else:
+                _changed.add(k)
+                write()
+        stanza_is_sane(k)
+        return _cache[k]
 
 
 def probe_yaml():
     for key in tree_stanzas:
         log.info("Probing {!r} stanza".format(key))
         stanza(key)
+        if key == 'state-backend':
+            assert stanza(key) == 'yaml' or stanza(key) in backends, (
+                "Unknown state-backend {!r}".format(stanza(key)))
         if key == 'cluster-definition':
             validate_cluster_definition()
         if key == 'role-definitions':
             validate_role_definitions()
+    # write the defaults of missing stanzas, if any, in one go
+    with lock:
+        if _defaulted:
+            flush()
     log.info("YAML tree is sane")
 
 
@@ -207,6 +574,18 @@ def role_def_valid(role):
             assert val in stanza('types'), (
                    ("Illegal type {!r} detected in role definition {!r}"
                     .format(val, role)))
+        if key in ('compress-user-data', 'package-cache'):
+            assert type(val) is bool, (
+                   ("Illegal {} {!r} detected in role definition {!r}"
+                    .format(key, val, role)))
+        if key in ('bake-user-data', 'user-data') and type(val) is list:
+            assert val and all(type(fn) is str for fn in val), (
+                   ("Illegal {} {!r} detected in role definition {!r}"
+                    .format(key, val, role)))
+        if key == 'volume-mode':
+            assert val in volume_modes, (
+                   ("Illegal volume-mode {!r} detected in role definition {!r}"
+                    .format(val, role)))
     return True
 
 
@@ -139,3 +139,45 @@ def dry_run_only_parser():
         )
 
         return parser
+
+
+def parallel_parser():
+        parser = argparse.ArgumentParser(
+            add_help=False,
+        )
+
+        parser.add_argument(
+            '-p', '--parallel',
+            type=int, default=1, metavar='N',
+            help="Process up to N delegates concurrently",
+        )
+
+        return parser
+
+
+def phone_home_parser():
+        parser = argparse.ArgumentParser(
+            add_help=False,
+        )
+
+        parser.add_argument(
+            '-t', '--timeout',
+            type=int, default=1800, metavar='SECONDS',
+            help="Give up on nodes that have not phoned home by then",
+        )
+
+        return parser
+
+
+def ssh_user_parser():
+        parser = argparse.ArgumentParser(
+            add_help=False,
+        )
+
+        parser.add_argument(
+            '-u', '--user',
+            default='ec2-user',
+            help="Remote user",
+        )
+
+        return parser
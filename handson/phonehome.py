@@ -0,0 +1,249 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import re
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+try:
+    from http.server import (
+        BaseHTTPRequestHandler,
+        HTTPServer,
+    )
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import (
+        BaseHTTPRequestHandler,
+        HTTPServer,
+    )
+
+try:
+    from urllib.parse import (
+        parse_qs,
+        urlparse,
+    )
+except ImportError:  # pragma: no cover
+    from urlparse import (
+        parse_qs,
+        urlparse,
+    )
+
+from handson.config import config
+from handson.myyaml import (
+    journal,
+    stanza,
+)
+from handson.waiter import (
+    WaitTimeout,
+    record,
+)
+
+log = logging.getLogger(__name__)
+
+READY_PATH_RE = re.compile(r'^/ready/(\d+)/([A-Za-z0-9_.-]+)$')
+
+
+def callback_url(delegate, role):
+    """
+        Return the URL that the given node calls when its user-data has
+        finished (the value of @@CALLBACK@@), or None if no phone-home
+        address is configured.
+    """
+    settings = stanza('phone-home')
+    if not settings.get('address'):
+        return None
+    return 'http://{}:{}/ready/{}/{}'.format(
+        settings['address'], settings.get('port') or 8765, delegate, role)
+
+
+def expected_nodes(delegate_list, roles=None):
+    """
+        Return the sorted list of (delegate, role) tuples of the nodes of the
+        given delegates, optionally restricted to the given roles.
+    """
+    cfg = config()
+    nodes = []
+    for d in delegate_list:
+        for role in (['master'] if d == 0 else cfg.cluster_roles):
+            if roles and role not in roles:
+                continue
+            nodes.append((d, role))
+    return sorted(nodes)
+
+
+def is_installed(delegate, role):
+    clusters = stanza('clusters')
+    return role in (clusters.get(delegate) or {})
+
+
+def is_ready(delegate, role):
+    clusters = stanza('clusters')
+    r_stanza = (clusters.get(delegate) or {}).get(role) or {}
+    return bool(r_stanza.get('ready'))
+
+
+class ReadyHandler(BaseHTTPRequestHandler):
+    """
+        Handles GET /ready/<delegate>/<role>[?uptime=<seconds>], sent by a
+        node when its user-data has finished.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        m = READY_PATH_RE.match(url.path)
+        if not m:
+            self.send_error(404)
+            return None
+        uptime = None
+        try:
+            uptime = float(parse_qs(url.query)['uptime'][0])
+        except (KeyError, ValueError):
+            pass
+        self.server.phone_home.notify(int(m.group(1)), m.group(2), uptime)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.end_headers()
+        self.wfile.write(b'OK\n')
+        return None
+
+    def log_message(self, fmt, *args):
+        log.debug("{}: {}".format(self.client_address[0], fmt % args))
+
+
+class PhoneHome(object):
+    """
+        Listens for the notifications that nodes send at the end of their
+        user-data, records them in the clusters stanza, and waits for a set
+        of nodes to be ready.
+
+        The listener runs in a background thread and only queues the
+        notifications; they are recorded by the thread that waits.
+    """
+
+    def __init__(self):
+        self._phone_home = {
+            'queue': queue.Queue(),
+            'server': None,
+            'thread': None,
+        }
+
+    def start(self):
+        settings = stanza('phone-home')
+        assert settings.get('address'), (
+            "The phone-home stanza has no address, so the nodes cannot "
+            "phone home")
+        port = settings.get('port') or 8765
+        server = HTTPServer(('', port), ReadyHandler)
+        server.phone_home = self
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        self._phone_home['server'] = server
+        self._phone_home['thread'] = t
+        log.info("Listening for nodes phoning home on port {}".format(port))
+        return None
+
+    def stop(self):
+        server = self._phone_home['server']
+        if server is None:
+            return None
+        server.shutdown()
+        server.server_close()
+        self._phone_home['thread'].join()
+        self._phone_home['server'] = None
+        self._phone_home['thread'] = None
+        return None
+
+    def notify(self, delegate, role, uptime):
+        self._phone_home['queue'].put((delegate, role, uptime))
+
+    def ready(self, delegate, role, uptime):
+        """
+            Record that the given node is ready, along with its boot-to-ready
+            latency (uptime), if known.
+        """
+        journal('node ready', ['clusters', delegate, role, 'ready'],
+                True if uptime is None else uptime)
+        if uptime is None:
+            log.info("Delegate {}, role {} is ready".format(delegate, role))
+        else:
+            record('node', 'ready', uptime)
+            log.info("Delegate {}, role {} is ready ({:.0f}s after boot)"
+                     .format(delegate, role, uptime))
+        return None
+
+    def wait(self, nodes, timeout=None):
+        """
+            Block until all the given (delegate, role) nodes, which must be
+            installed, are ready. Nodes that phoned home earlier are taken
+            from the clusters stanza, and calls from other nodes are
+            ignored. Raises WaitTimeout if they are not all ready within
+            timeout seconds.
+        """
+        missing = [n for n in nodes if not is_installed(*n)]
+        assert not missing, (
+            "Node(s) {} are not installed".format(
+                ', '.join("{}/{}".format(d, role) for (d, role) in missing)))
+        pending = set(n for n in nodes if not is_ready(*n))
+        log.info("Waiting for {} of {} node(s) to phone home"
+                 .format(len(pending), len(nodes)))
+        deadline = None if timeout is None else time.time() + timeout
+        while pending:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.time())
+            try:
+                (d, role, uptime) = self._phone_home['queue'].get(
+                    timeout=remaining)
+            except queue.Empty:
+                raise WaitTimeout(
+                    "Timed out waiting for node(s) {} to phone home".format(
+                        ', '.join("{}/{}".format(d, role)
+                                  for (d, role) in sorted(pending))))
+            # the listener is open to anybody: only expected nodes count
+            if (d, role) in nodes and (d, role) not in pending:
+                log.debug("Node {}/{} phoned home again".format(d, role))
+                continue
+            if (d, role) not in pending:
+                log.warning("Ignoring phone call from unexpected node {}/{}"
+                            .format(d, role))
+                continue
+            self.ready(d, role, uptime)
+            pending.discard((d, role))
+            if pending:
+                log.info("{} node(s) still to phone home"
+                         .format(len(pending)))
+        log.info("All {} node(s) are ready".format(len(nodes)))
+        return None
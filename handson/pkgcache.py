@@ -0,0 +1,201 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import re
+
+from handson.util import get_file_as_string
+
+log = logging.getLogger(__name__)
+
+# the cache listens on its own port, so as not to get in the way of whatever
+# else the Salt Master serves over HTTP
+PACKAGE_CACHE_PORT = 8080
+
+# lines of user-data that define repositories: zypper addrepo commands and
+# baseurl entries of .repo files and cloud-config zypper stanzas
+REPO_LINE_RE = re.compile(r'\bzypper\b.*\b(?:addrepo|ar)\b|^\s*baseurl\s*[:=]')
+URL_RE = re.compile(r'\b(https?)://([A-Za-z0-9.-]+)(?=/)')
+
+NGINX_CONF = '/etc/nginx/conf.d/pkgcache.conf'
+# written by the setup script, from the nameserver in /etc/resolv.conf
+NGINX_RESOLVER_CONF = '/etc/nginx/pkgcache-resolver.conf'
+
+NGINX_SERVER = """\
+proxy_cache_path /var/cache/nginx/pkgcache levels=1:2 keys_zone=pkgcache:16m
+                 max_size=20g inactive=30d;
+
+server {{
+    listen {port};
+    allow 10.0.0.0/16;
+    deny all;
+
+    proxy_cache pkgcache;
+    proxy_cache_lock on;
+    proxy_cache_use_stale error timeout updating;
+    proxy_set_header Accept-Encoding "";
+    include {resolver_conf};
+
+{locations}
+    # packages that the upstream redirects to a mirror are fetched from the
+    # mirror by the cache, rather than by the node past it; they are cached
+    # under the URL that the node asked for, whichever mirror served them
+    location @mirror {{
+        set $mirror $upstream_http_location;
+        proxy_pass $mirror;
+        proxy_cache_key $request_uri;
+        proxy_cache_valid 200 30d;
+    }}
+}}
+"""
+
+# metadata (and .repo files, whose URLs are rewritten on the fly) is cached
+# briefly, packages for as long as they are used. The upstreams are given
+# literally, so that they are resolved when nginx starts; only the mirrors
+# that packages are redirected to are looked up at run time.
+NGINX_LOCATIONS = """\
+    location /{scheme}/{host}/ {{
+        proxy_pass {scheme}://{host}/;
+        proxy_cache_valid 200 5m;
+        sub_filter_types *;
+        sub_filter_once off;
+        sub_filter '{scheme}://{host}/' '{url}/';
+    }}
+    location ~ ^/{scheme}/{host_re}/.*\\.rpm$ {{
+        rewrite ^/{scheme}/{host_re}(/.*)$ $1 break;
+        proxy_pass {scheme}://{host};
+        proxy_cache_key $request_uri;
+        proxy_cache_valid 200 30d;
+        proxy_intercept_errors on;
+        error_page 301 302 303 307 = @mirror;
+    }}
+"""
+
+
+def is_master(host, master_ip):
+    return host in (master_ip, 'ip-' + master_ip.replace('.', '-'))
+
+
+def cache_url(master_ip, scheme, host):
+    """
+        Return the URL under which the package cache on the Salt Master
+        serves the given upstream.
+    """
+    return 'http://{}:{}/{}/{}'.format(
+        master_ip, PACKAGE_CACHE_PORT, scheme, host)
+
+
+def repo_urls(text, master_ip):
+    """
+        Return the set of (scheme, host) tuples of the repositories defined
+        in the given user-data, except those on the Salt Master itself.
+    """
+    found = set()
+    for line in text.splitlines():
+        if not REPO_LINE_RE.search(line):
+            continue
+        for (scheme, host) in URL_RE.findall(line):
+            if not is_master(host, master_ip):
+                found.add((scheme, host))
+    return found
+
+
+def rewrite(text, master_ip):
+    """
+        Point the repositories defined in the given user-data at the
+        package cache on the Salt Master.
+    """
+    def replace(m):
+        (scheme, host) = m.groups()
+        if is_master(host, master_ip):
+            return m.group(0)
+        return cache_url(master_ip, scheme, host)
+
+    lines = text.splitlines(True)
+    for (i, line) in enumerate(lines):
+        if REPO_LINE_RE.search(line):
+            lines[i] = URL_RE.sub(replace, line)
+    return ''.join(lines)
+
+
+def upstreams(files, master_ip):
+    """
+        Return the sorted list of (scheme, host) tuples of the repositories
+        defined in the given user-data files.
+    """
+    found = set()
+    for fn in files:
+        found |= repo_urls(get_file_as_string(fn), master_ip)
+    return sorted(found)
+
+
+def setup_script(upstream_list, master_ip, callback=None):
+    """
+        Return a user-data script that turns the Salt Master into a caching
+        proxy for the given upstreams. Once the cache is up, the script
+        phones home to the callback URL, if any, so that the delegate nodes
+        can be installed.
+    """
+    locations = ''.join(
+        NGINX_LOCATIONS.format(
+            scheme=scheme,
+            host=host,
+            host_re=re.escape(host),
+            url=cache_url(master_ip, scheme, host),
+        )
+        for (scheme, host) in upstream_list
+    )
+    conf = NGINX_SERVER.format(
+        port=PACKAGE_CACHE_PORT,
+        resolver_conf=NGINX_RESOLVER_CONF,
+        locations=locations,
+    )
+    log.info("Package cache on {} proxies {}".format(
+        master_ip, ', '.join(host for (scheme, host) in upstream_list)))
+    script = (
+        "#!/bin/bash -x\n"
+        "#\n"
+        "# package cache for the delegate nodes (generated by ho)\n\n"
+        "set -e\n"
+        "zypper -n install nginx\n"
+        "mkdir -p /var/cache/nginx/pkgcache\n"
+        "chown nginx /var/cache/nginx/pkgcache\n"
+        "echo \"resolver $(awk '/^nameserver/ {{print $2; exit}}' "
+        "/etc/resolv.conf);\" >{}\n"
+        "cat <<'EOF' >{}\n{}EOF\n"
+        "systemctl enable nginx.service\n"
+        "systemctl restart nginx.service\n"
+    ).format(NGINX_RESOLVER_CONF, NGINX_CONF, conf)
+    if callback:
+        script += (
+            "UPTIME=$(cut -d' ' -f1 /proc/uptime)\n"
+            "until curl -fsS \"{}?uptime=$UPTIME\" ; do sleep 10 ; done\n"
+        ).format(callback)
+    return script
@@ -0,0 +1,233 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import threading
+import time
+
+from handson.myyaml import stanza
+from handson.region import Region
+from handson.util import chunks
+from handson.waiter import (
+    WaitTimeout,
+    Waiter,
+)
+
+log = logging.getLogger(__name__)
+
+# EC2 accepts at most 200 values per filter
+FILTER_CHUNK = 200
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def shared_poller(args):
+    """
+        Return the process-wide Poller for the region in the YAML, creating
+        it if necessary. All delegates share it, so that one Describe call per
+        tick and resource type covers every pending resource.
+    """
+    region = stanza('region')['region_str']
+    with _pollers_lock:
+        if region not in _pollers:
+            _pollers[region] = Poller(args)
+        return _pollers[region]
+
+
+class Poller(Region):
+    """
+        Watches EC2 resources until they reach a target state.
+
+        Callers register (resource type, resource ID, target state,
+        callback) tuples. A background thread polls all pending resources of
+        each type with a single batched Describe call per tick and invokes
+        callback(resource_id, state) - from the poller thread - as soon as a
+        resource reaches its target state. Each registration has its own
+        Waiter: ticks follow the earliest poll it asks for, and if its
+        deadline passes, the callback is invoked with state None.
+    """
+
+    def __init__(self, args):
+        super(Poller, self).__init__(args)
+        self.args = args
+        self._poller = {
+            'lock': threading.Lock(),
+            'pending': {
+                'image': [],
+                'instance': [],
+                'volume': [],
+            },
+            'thread': None,
+            'wakeup': threading.Event(),
+        }
+
+    def register(self, kind, r_id, state, callback, deadline=None):
+        """
+            Arrange for callback(r_id, state) to be called once resource
+            r_id of the given kind ('image', 'instance' or 'volume') reaches
+            state, or callback(r_id, None) if it has not done so by the
+            deadline.
+        """
+        assert kind in self._poller['pending'], (
+            "Poller cannot watch resources of type {!r}".format(kind))
+        log.debug("Watching {} {} for state '{}'".format(kind, r_id, state))
+        waiter = Waiter(kind, state, deadline=deadline)
+        with self._poller['lock']:
+            self._poller['pending'][kind].append(
+                (r_id, state, callback, waiter)
+            )
+            if self._poller['thread'] is None:
+                t = threading.Thread(target=self.run)
+                t.daemon = True
+                self._poller['thread'] = t
+                t.start()
+        self._poller['wakeup'].set()
+        return None
+
+    def wait(self, kind, r_id, state, deadline=None):
+        """
+            Block until resource r_id of the given kind reaches state.
+            Raises WaitTimeout if it does not do so by the deadline.
+        """
+        log.info("Waiting for {} {} to reach '{}' state"
+                 .format(kind, r_id, state))
+        done = threading.Event()
+        result = []
+
+        def callback(r_id, reached):
+            result.append(reached)
+            done.set()
+
+        self.register(kind, r_id, state, callback, deadline=deadline)
+        done.wait()
+        if result[0] is None:
+            raise WaitTimeout(
+                "Timed out waiting for {} {} to reach '{}' state"
+                .format(kind, r_id, state))
+        return None
+
+    def describe(self, kind, r_ids):
+        """
+            Return a dict mapping each of the given resource IDs to its
+            current state. IDs that EC2 does not (yet) know are omitted.
+        """
+        ec2 = self.ec2()
+        states = {}
+        for chunk in chunks(r_ids, FILTER_CHUNK):
+            if kind == 'image':
+                for img in ec2.get_all_images(image_ids=chunk):
+                    states[img.id] = img.state
+            elif kind == 'instance':
+                for i_obj in ec2.get_only_instances(
+                    filters={"instance-id": chunk}
+                ):
+                    states[i_obj.id] = i_obj.state
+            elif kind == 'volume':
+                for v_obj in ec2.get_all_volumes(
+                    filters={"volume-id": chunk}
+                ):
+                    states[v_obj.id] = v_obj.status
+        return states
+
+    def poll(self):
+        """
+            Poll every pending resource once and fire the callbacks of those
+            that have reached their target state or their deadline. Returns
+            the number of seconds until the next poll is due, or None if
+            nothing is pending any more.
+        """
+        fired = []
+        for kind in sorted(self._poller['pending'].keys()):
+            with self._poller['lock']:
+                pending = list(self._poller['pending'][kind])
+            if not pending:
+                continue
+            r_ids = sorted(set(entry[0] for entry in pending))
+            states = self.describe(kind, r_ids)
+            log.debug("Polled {} {}(s): {!r}".format(len(r_ids), kind, states))
+            now = time.time()
+            with self._poller['lock']:
+                for entry in pending:
+                    (r_id, state, callback, waiter) = entry
+                    if states.get(r_id) == state:
+                        waiter.done()
+                    elif waiter.expired():
+                        log.error(str(waiter.timeout_error(
+                            "{} {}".format(kind, r_id))))
+                        state = None
+                    else:
+                        if waiter.due() <= now:
+                            waiter.reschedule()
+                        continue
+                    self._poller['pending'][kind].remove(entry)
+                    fired.append((callback, r_id, state))
+        for (callback, r_id, state) in fired:
+            callback(r_id, state)
+        return self.next_due()
+
+    def next_due(self):
+        """
+            Return the number of seconds until the next poll is due, or None
+            if nothing is pending.
+        """
+        with self._poller['lock']:
+            dues = [entry[3].due()
+                    for p in self._poller['pending'].values() for entry in p]
+        if not dues:
+            return None
+        return max(0, min(dues) - time.time())
+
+    def sleep(self, delay):
+        """
+            Sleep until the next poll is due, taking into account
+            registrations that arrive in the meantime.
+        """
+        wakeup = self._poller['wakeup']
+        while delay:
+            wakeup.wait(delay)
+            wakeup.clear()
+            delay = self.next_due()
+        return None
+
+    def run(self):
+        while True:
+            try:
+                delay = self.poll()
+            except Exception:  # pragma: no cover
+                log.exception("Poller failure; will retry")
+                delay = 5
+            with self._poller['lock']:
+                if delay is None and not any(
+                    self._poller['pending'].values()
+                ):
+                    self._poller['thread'] = None
+                    return None
+            self.sleep(delay)
@@ -34,7 +34,7 @@ import logging
 import textwrap
 
 from boto import connect_ec2
-from handson.delegate import Delegate
+from handson.fleet import Fleet
 from handson.misc import (
     CustomFormatter,
     InitArgs,
@@ -46,6 +46,10 @@ from handson.parsers import (
 )
 from handson.region import Region
 from handson.subnet import Subnet
+from handson.tag import (
+    Tagger,
+    tag_resources,
+)
 from handson.vpc import VPC
 
 log = logging.getLogger(__name__)
@@ -228,7 +232,7 @@ class Probe(object):
             func=ProbeVPC,
         )
 
-        subparsers.add_parser(
+        yaml_parser = subparsers.add_parser(
             'yaml',
             formatter_class=CustomFormatter,
             description=textwrap.dedent("""\
@@ -248,11 +252,20 @@ class Probe(object):
             $ echo $?
             1
 
+            $ ho probe yaml --export full.yaml
+
             """),
             help='Probe YaML file',
             parents=[subcommand_parser()],
             add_help=False,
-        ).set_defaults(
+        )
+        yaml_parser.add_argument(
+            '--export',
+            metavar='FILE',
+            help='also write the whole tree, including the state kept by '
+                 'the state backend, to FILE',
+        )
+        yaml_parser.set_defaults(
             func=ProbeYaml,
         )
 
@@ -274,9 +287,15 @@ class ProbeDelegates(InitArgs):
 
     def run(self):
         delegates = handson.myyaml.stanza('delegates')
+        f = Fleet(self.args, range(0, delegates + 1))
+        public_ips = f.public_ips()
         for d in range(0, delegates + 1):
-            delegate_obj = Delegate(self.args, d)
-            delegate_obj.probe()
+            if d not in public_ips:
+                log.info("Delegate {} not instantiated".format(d))
+                continue
+            for role in sorted(public_ips[d].keys()):
+                log.info("Delegate {}, role {}, public IP {}"
+                         .format(d, role, public_ips[d][role]))
 
 
 class ProbePublicIPs(InitArgs):
@@ -289,9 +308,10 @@ class ProbePublicIPs(InitArgs):
         level = logging.WARNING
         logging.getLogger('handson').setLevel(level)
         delegates = handson.myyaml.stanza('delegates')
+        f = Fleet(self.args, range(0, delegates + 1))
+        all_public_ips = f.public_ips()
         for d in range(0, delegates + 1):
-            delegate_obj = Delegate(self.args, d)
-            public_ips = delegate_obj.public_ips()
+            public_ips = all_public_ips.get(d)
             if public_ips is None:
                 continue
             if 'admin' in public_ips:
@@ -339,9 +359,19 @@ class ProbeSubnets(InitArgs):
     def run(self):
         delegates = handson.myyaml.stanza('delegates')
         log.info('Probing {!r} subnets'.format(delegates + 1))
+        tagger = None
+        if self.args.retag:
+            tagger = Tagger(VPC(self.args).vpc())
         for d in range(0, delegates + 1):
             c = Subnet(self.args, d)
-            c.subnet_obj(create=False)
+            s_obj = c.subnet_obj(create=False)
+            if tagger and s_obj:
+                tagger.add(s_obj.id, {
+                    'Name': handson.myyaml.stanza('nametag'),
+                    'Delegate': d,
+                })
+        if tagger:
+            tagger.flush()
 
 
 class ProbeVPC(InitArgs):
@@ -351,13 +381,21 @@ class ProbeVPC(InitArgs):
         self.args = args
 
     def run(self):
-        VPC(self.args).vpc_obj(create=False)
+        v = VPC(self.args)
+        vpc_obj = v.vpc_obj(create=False)
+        if self.args.retag and vpc_obj:
+            tag_resources(v.vpc(), [vpc_obj.id], {
+                'Name': handson.myyaml.stanza('nametag'),
+            })
 
 
 class ProbeYaml(InitArgs):
 
     def __init__(self, args):
         super(ProbeYaml, self).__init__(args)
+        self.args = args
 
     def run(self):
         handson.myyaml.probe_yaml()
+        if self.args.export:
+            handson.myyaml.export_state(self.args.export)
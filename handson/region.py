@@ -28,15 +28,81 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import boto
 import boto.ec2
 import boto.vpc
 import logging
+import os
+import threading
 
 from handson.myyaml import stanza
+from handson.throttle import throttle_connection
 # from handson.util import read_user_data
 
 log = logging.getLogger(__name__)
 
+_connections = {}
+_connections_lock = threading.Lock()
+_connection_stats = {
+    'opened': 0,
+    'reused': 0,
+}
+
+
+def credentials_key():
+    """
+        Return the access key ID boto will authenticate with, so that
+        connections made with different credentials are kept apart.
+    """
+    return (
+        os.environ.get('AWS_ACCESS_KEY_ID') or
+        boto.config.get('Credentials', 'aws_access_key_id')
+    )
+
+
+def get_connection(service, region, api_version=None):
+    """
+        Return the process-wide connection to the given service ('ec2' or
+        'vpc') in the given region, opening it if necessary. Connections are
+        shared by all objects and threads; boto keeps their HTTP connections
+        alive in a thread-safe pool. Every call made through them is rate
+        limited by the token buckets in handson.throttle.
+    """
+    key = (service, region, credentials_key(), api_version)
+    with _connections_lock:
+        conn = _connections.get(key)
+        if conn is not None:
+            _connection_stats['reused'] += 1
+            return conn
+        log.debug("Connecting to {} region {}"
+                  .format(service.upper(), region))
+        kwargs = {'is_secure': False}
+        if api_version:
+            kwargs['api_version'] = api_version
+        if service == 'ec2':
+            conn = boto.ec2.connect_to_region(region, **kwargs)
+        elif service == 'vpc':
+            conn = boto.vpc.connect_to_region(region, **kwargs)
+        else:
+            assert 1 == 0, "Unknown service {!r}".format(service)
+        assert conn is not None, (
+               ("Failed to connect to {} service in region {!r}"
+                .format(service.upper(), region)))
+        _connections[key] = throttle_connection(conn, region)
+        _connection_stats['opened'] += 1
+    return conn
+
+
+def connection_stats():
+    """
+        Return a dict with the number of connections opened and the number
+        of times an already open connection was handed out again.
+    """
+    with _connections_lock:
+        stats = dict(_connection_stats)
+        stats['open'] = len(_connections)
+    return stats
+
 
 class Region(object):
 
@@ -73,36 +139,16 @@ class Region(object):
 
     def ec2(self):
         """
-            fetch ec2 connection, open if necessary
+            fetch ec2 connection from the shared pool
         """
-        if self._region['ec2_conn']:
-            return self._region['ec2_conn']
-        region = self.region()
         if self._region['ec2_conn'] is None:
-            log.debug("Connecting to EC2 region {}".format(region))
-            self._region['ec2_conn'] = boto.ec2.connect_to_region(
-                region,
-                is_secure=False
-            )
-        assert self._region['ec2_conn'] is not None, (
-               ("Failed to connect to EC2 service in region {!r}"
-                .format(region)))
+            self._region['ec2_conn'] = get_connection('ec2', self.region())
         return self._region['ec2_conn']
 
     def vpc(self):
         """
-            fetch vpc connection, open if necessary
+            fetch vpc connection from the shared pool
         """
-        if self._region['vpc_conn']:
-            return self._region['vpc_conn']
-        region = self.region()
         if self._region['vpc_conn'] is None:
-            log.debug("Connecting to VPC region {}".format(region))
-            self._region['vpc_conn'] = boto.vpc.connect_to_region(
-                region,
-                is_secure=False
-            )
-        assert self._region['vpc_conn'] is not None, (
-               ("Failed to connect to VPC service in region {!r}"
-                .format(region)))
+            self._region['vpc_conn'] = get_connection('vpc', self.region())
         return self._region['vpc_conn']
@@ -0,0 +1,275 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+from handson.fleet import Fleet
+from handson.myyaml import stanza
+from handson.util import atomic_write
+
+log = logging.getLogger(__name__)
+
+# generated by "ho ssh config" and "ho exec", next to the keys/ directory
+SSH_CONFIG_FILE = 'ssh_config'
+# sockets of the multiplexed master connections
+CONTROL_DIR = '.ssh-control'
+# how long an idle master connection is kept open
+CONTROL_PERSIST = '10m'
+CONNECT_TIMEOUT = 10
+# how long to keep reading output after the command has exited (a process it
+# left behind may hold the output pipe open indefinitely)
+OUTPUT_GRACE = 1
+
+# the nodes are short-lived and their host keys change on every install, and
+# there is nobody to answer prompts when running on many nodes at once
+SSH_OPTIONS = [
+    ('BatchMode', 'yes'),
+    ('StrictHostKeyChecking', 'no'),
+    ('UserKnownHostsFile', '/dev/null'),
+    ('LogLevel', 'ERROR'),
+    ('ConnectTimeout', CONNECT_TIMEOUT),
+    ('IdentitiesOnly', 'yes'),
+    ('ControlMaster', 'auto'),
+    ('ControlPersist', CONTROL_PERSIST),
+]
+
+# serializes the output of concurrent commands, line by line
+_output_lock = threading.Lock()
+
+
+def key_file(delegate):
+    """
+        Return the private key of the given delegate, as created by
+        generate-keys.sh.
+    """
+    k_stanza = stanza('keypairs').get(delegate) or {}
+    keyname = (k_stanza.get('keyname') or
+               "{}-d{}".format(stanza('keyname'), delegate))
+    return os.path.join('keys', keyname)
+
+
+def host_alias(delegate, role):
+    return "d{}-{}".format(delegate, role)
+
+
+def fleet_nodes(args):
+    """
+        Return a sorted list of (delegate, role, public IP) tuples of all
+        live nodes, found with a single inventory describe. The public IP is
+        None for nodes that have none.
+    """
+    index = Fleet(args, []).inventory()
+    return sorted(
+        (d, role, i_obj.ip_address or None)
+        for ((d, role), i_obj) in index.items()
+    )
+
+
+def ssh_config(nodes, user):
+    """
+        Return an ssh_config with a host alias (e.g. d7-mon1) for each of
+        the given (delegate, role, public IP) tuples that has a public IP.
+        Connections to each host are multiplexed over a master connection,
+        which persists for CONTROL_PERSIST after the last session ends.
+    """
+    control_path = os.path.join(os.path.abspath(CONTROL_DIR), '%C')
+    lines = ["# generated by ho - do not edit", ""]
+    for (d, role, ip) in nodes:
+        if ip is None:
+            continue
+        lines.extend([
+            "Host {}".format(host_alias(d, role)),
+            "    HostName {}".format(ip),
+            "    User {}".format(user),
+            "    IdentityFile {}".format(os.path.abspath(key_file(d))),
+            "    ControlPath {}".format(control_path),
+        ])
+        lines.extend("    {} {}".format(k, v) for (k, v) in SSH_OPTIONS)
+        lines.append("")
+    return "\n".join(lines)
+
+
+def write_ssh_config(nodes, user, fn=SSH_CONFIG_FILE):
+    if not os.path.isdir(CONTROL_DIR):
+        os.mkdir(CONTROL_DIR, 0o700)
+    atomic_write(fn, ssh_config(nodes, user))
+    log.debug("Wrote {}".format(fn))
+    return None
+
+
+def stream_output(label, fh, out=None):
+    """
+        Copy the lines read from fh to out (default: stdout), each prefixed
+        with the label, as they arrive.
+    """
+    out = out or sys.stdout
+    for line in iter(fh.readline, b''):
+        line = line.decode('utf-8', 'replace').rstrip('\n')
+        with _output_lock:
+            out.write("[{}] {}\n".format(label, line))
+            out.flush()
+    return None
+
+
+def run(label, argv, timeout=None, stdin=None, out=None):
+    """
+        Run argv, streaming its output (stdout and stderr) prefixed with the
+        label. Kills it after timeout seconds. Returns its exit status, or
+        None if it timed out.
+    """
+    log.debug("{}: running {!r}".format(label, argv))
+    devnull = None
+    if stdin is None:
+        # concurrent commands must not compete for our stdin
+        devnull = stdin = open(os.devnull, 'rb')
+    try:
+        proc = subprocess.Popen(
+            argv,
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+    finally:
+        if devnull:
+            devnull.close()
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        proc.kill()
+
+    def drain():
+        try:
+            stream_output(label, proc.stdout, out=out)
+        finally:
+            proc.stdout.close()
+
+    reader = threading.Thread(target=drain)
+    reader.daemon = True
+    reader.start()
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    try:
+        rc = proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+    # read what the command wrote, but do not wait for EOF: a process it
+    # left behind (e.g. an ssh master connection) may still hold the pipe
+    reader.join(OUTPUT_GRACE)
+    if reader.is_alive():
+        log.debug("{}: output still open after exit, not waiting for it"
+                  .format(label))
+    if timed_out:
+        log.error("{}: timed out after {}s".format(label, timeout))
+        return None
+    return rc
+
+
+class ConnectionManager(object):
+    """
+        Runs commands on nodes through the generated ssh_config, so that
+        they share one multiplexed master connection per node: only the
+        first session to a node pays for the TCP and key exchange
+        handshakes, and the connection is kept warm for the next command,
+        even one run by another ho process.
+    """
+
+    def __init__(self, config_file=SSH_CONFIG_FILE):
+        self._manager = {
+            'config': config_file,
+        }
+
+    def argv(self, alias, command=None, control=None, master=False):
+        argv = ['ssh', '-F', self._manager['config']]
+        if control:
+            argv.extend(['-O', control])
+        if master:
+            argv.extend(['-f', '-N', '-M'])
+        argv.append(alias)
+        if command:
+            argv.append(command)
+        return argv
+
+    def run(self, alias, command, timeout=None, stdin=None, out=None):
+        """
+            Run the command on the node with the given host alias, over its
+            master connection. See run() for the rest.
+        """
+        self.connect(alias)
+        return run(alias, self.argv(alias, command),
+                   timeout=timeout, stdin=stdin, out=out)
+
+    def control(self, alias, command):
+        """
+            Send a control command ('check', 'exit') to the master
+            connection of the given node. Returns True if it succeeded.
+        """
+        with open(os.devnull, 'wb') as devnull:
+            rc = subprocess.call(self.argv(alias, control=command),
+                                 stdout=devnull, stderr=devnull)
+        return rc == 0
+
+    def connect(self, alias):
+        """
+            Start the master connection to the given node, unless there is
+            one already. It is started on its own, with /dev/null as its
+            stdin, stdout and stderr: a master started by a session inherits
+            the session's output pipe, which some OpenSSH releases keep open
+            for as long as the master persists. Returns True if there is a
+            master connection now; if not, the session reports why.
+        """
+        if self.connected(alias):
+            return True
+        log.debug("Opening master connection to {}".format(alias))
+        with open(os.devnull, 'r+b') as devnull:
+            rc = subprocess.call(self.argv(alias, master=True),
+                                 stdin=devnull, stdout=devnull, stderr=devnull)
+        return rc == 0
+
+    def connected(self, alias):
+        return self.control(alias, 'check')
+
+    def disconnect(self, alias):
+        """
+            Close the master connection of the given node, if any. Returns
+            True if there was one.
+        """
+        if not self.connected(alias):
+            return False
+        log.debug("Closing master connection to {}".format(alias))
+        return self.control(alias, 'exit')
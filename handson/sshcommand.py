@@ -0,0 +1,170 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import argparse
+import logging
+import os
+import textwrap
+
+from handson.misc import (
+    CustomFormatter,
+    InitArgs,
+)
+from handson.parallel import run_in_parallel
+from handson.parsers import (
+    parallel_parser,
+    ssh_user_parser,
+    subcommand_parser,
+)
+from handson.ssh import (
+    SSH_CONFIG_FILE,
+    ConnectionManager,
+    fleet_nodes,
+    write_ssh_config,
+)
+
+log = logging.getLogger(__name__)
+
+
+class SSH(object):
+
+    @staticmethod
+    def get_parser():
+        parser = argparse.ArgumentParser(
+            usage='ho ssh',
+            formatter_class=CustomFormatter,
+            description=textwrap.dedent("""\
+            Manage SSH access to the nodes.
+
+            The documentation for each sub-subcommand can be displayed with
+
+               ho ssh sub-subcommand --help
+
+            For instance:
+
+               ho ssh config --help
+               usage: ho ssh config [-h]
+               ...
+
+            For more information, refer to the README.rst file at
+            https://github.com/smithfarm/ceph-auto-aws/README.rst
+            """))
+
+        subparsers = parser.add_subparsers(
+            title='ssh subcommands',
+            description='valid ssh subcommands',
+            help='ssh subcommand -h',
+        )
+
+        subparsers.add_parser(
+            'config',
+            formatter_class=CustomFormatter,
+            description=textwrap.dedent("""\
+            Write an ssh_config covering all nodes.
+
+            Each node gets a host alias like d7-mon1, with the key of its
+            delegate and multiplexed connections.
+            """),
+            epilog=textwrap.dedent("""
+            Example:
+
+            $ ho ssh config
+            $ ssh -F ssh_config d7-mon1
+
+            """),
+            help='Write an ssh_config covering all nodes',
+            parents=[subcommand_parser(), ssh_user_parser()],
+            add_help=False,
+        ).set_defaults(
+            func=SSHConfig,
+        )
+
+        subparsers.add_parser(
+            'disconnect',
+            formatter_class=CustomFormatter,
+            description=textwrap.dedent("""\
+            Close the multiplexed master connections to all nodes.
+
+            """),
+            epilog=textwrap.dedent("""
+            Example:
+
+            $ ho ssh disconnect
+
+            """),
+            help='Close the multiplexed master connections to all nodes',
+            parents=[subcommand_parser(), parallel_parser()],
+            add_help=False,
+        ).set_defaults(
+            func=SSHDisconnect,
+        )
+
+        return parser
+
+
+class SSHConfig(InitArgs):
+
+    def __init__(self, args):
+        super(SSHConfig, self).__init__(args)
+        self.args = args
+
+    def run(self):
+        nodes = fleet_nodes(self.args)
+        write_ssh_config(nodes, self.args.user)
+        for (d, role, ip) in nodes:
+            if ip is None:
+                log.warning("Delegate {}, role {} has no public IP"
+                            .format(d, role))
+        log.info("Wrote {} host(s) to {}"
+                 .format(len([n for n in nodes if n[2]]), SSH_CONFIG_FILE))
+
+
+class SSHDisconnect(InitArgs):
+
+    def __init__(self, args):
+        super(SSHDisconnect, self).__init__(args)
+        self.args = args
+
+    def run(self):
+        assert os.path.exists(SSH_CONFIG_FILE), (
+            "{} not found (run ho ssh config first)".format(SSH_CONFIG_FILE))
+        manager = ConnectionManager()
+        aliases = []
+        with open(SSH_CONFIG_FILE) as f:
+            for line in f:
+                if line.startswith('Host '):
+                    aliases.append(line.split()[1])
+        results = run_in_parallel(
+            manager.disconnect,
+            aliases,
+            parallel=self.args.parallel,
+        )
+        closed = [a for a in aliases if results[a] == (True, True)]
+        log.info("Closed {} master connection(s)".format(len(closed)))
@@ -35,7 +35,7 @@ import textwrap
 from handson.cluster_options import (
     ClusterOptions,
 )
-from handson.delegate import Delegate
+from handson.fleet import Fleet
 from handson.misc import (
     CustomFormatter,
     InitArgs,
@@ -109,7 +109,7 @@ class StopDelegates(InitArgs, ClusterOptions):
 
     def run(self):
         self.process_delegate_list()
-        for d in self.args.delegate_list:
-            log.info("Stopping cluster for delegate {}".format(d))
-            d = Delegate(self.args, d)
-            d.stop(dry_run=self.args.dry_run)
+        log.info("Stopping clusters for delegates {!r}"
+                 .format(self.args.delegate_list))
+        f = Fleet(self.args, self.args.delegate_list)
+        f.stop(dry_run=self.args.dry_run)
@@ -30,8 +30,12 @@
 #
 import logging
 
-from handson.myyaml import stanza
-from handson.tag import apply_tag
+from handson.myyaml import (
+    lock as yaml_lock,
+    stanza,
+)
+from handson.region import get_connection
+from handson.tag import tag_resources
 # from handson.util import read_user_data
 from handson.vpc import VPC
 
@@ -48,6 +52,23 @@ class Subnet(VPC):
             's_obj': None
         }
 
+    def set_map_public_ip(self, subnet_id):
+        """
+            Attempts to set the MapPublicIpOnLaunch attribute of the subnet
+            to True, so that instances launched in it get a public IP.
+            Code taken from http://stackoverflow.com/questions/25977048
+            Author: Mark Doliner
+        """
+        # the connection is shared, so use a separate one for the older API
+        # version rather than changing it on the fly
+        ec2 = get_connection('ec2', self.region(), api_version='2014-06-15')
+        ec2.get_status(
+            'ModifySubnetAttribute',
+            {'SubnetId': subnet_id, 'MapPublicIpOnLaunch.Value': 'true'},
+            verb='POST'
+        )
+        return None
+
     def subnet_obj(self, create=False, dry_run=False):
         """
             Subnet object is returned from cache if cached.
@@ -67,7 +88,8 @@ class Subnet(VPC):
             #
             # create new subnet
             if create:
-                s_stanza[delegate] = {}
+                with yaml_lock:
+                    s_stanza[delegate] = {}
                 log.debug("About to create subnet {}".format(cidr_block))
                 if dry_run:
                     log.info("Dry run: doing nothing")
@@ -85,11 +107,19 @@ class Subnet(VPC):
                             s_obj.cidr_block
                         )
                     )
-                    s_stanza[delegate]['cidr_block'] = s_obj.cidr_block
-                    s_stanza[delegate]['id'] = s_obj.id
-                    stanza('subnets', s_stanza)
-                    apply_tag(s_obj, tag='Name', val=stanza('nametag'))
-                    apply_tag(s_obj, tag='Delegate', val=delegate)
+                    # other delegates may have written the stanza since
+                    # it was read above
+                    with yaml_lock:
+                        s_stanza = stanza('subnets')
+                        s_stanza[delegate] = {
+                            'cidr_block': s_obj.cidr_block,
+                            'id': s_obj.id,
+                        }
+                        stanza('subnets', s_stanza)
+                    tag_resources(vpc, [s_obj.id], {
+                        'Name': stanza('nametag'),
+                        'Delegate': delegate,
+                    })
             else:
                 log.info("Delegate {} subnet ID missing in yaml"
                          .format(delegate))
@@ -109,8 +139,9 @@ class Subnet(VPC):
         ):  # pragma: no cover
             #
             # set cidr_block
-            s_stanza[delegate]['cidr_block'] = s_obj.cidr_block
-            stanza('subnets', s_stanza)
+            with yaml_lock:
+                s_stanza[delegate]['cidr_block'] = s_obj.cidr_block
+                stanza('subnets', s_stanza)
         else:
             #
             # validate cidr_block
@@ -123,9 +154,6 @@ class Subnet(VPC):
                     s_obj.cidr_block
                 ))
         self._subnet['s_obj'] = s_obj
-        # if self.args.retag:
-        #     apply_tag(s_obj, tag='Name', val=stanza('nametag'))
-        #     apply_tag(s_obj, tag='Delegate', val=delegate)
         return s_obj
 
     def wipeout(self, dry_run=False):
@@ -134,10 +162,11 @@ class Subnet(VPC):
             if not dry_run:
                 log.info("Wiping out Subnet ID {}".format(s_obj.id))
                 self.vpc().delete_subnet(s_obj.id)
-                s_stanza = stanza('subnets')
                 d = self._subnet['delegate']
-                del(s_stanza[d])
-                stanza('subnets', s_stanza)
+                with yaml_lock:
+                    s_stanza = stanza('subnets')
+                    del(s_stanza[d])
+                    stanza('subnets', s_stanza)
             else:
                 log.info("Dry run: nothing to do")
         else:
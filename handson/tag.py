@@ -28,26 +28,89 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 import logging
-import sys
 import time
 
+from boto.exception import EC2ResponseError
+from handson.util import chunks
+
 log = logging.getLogger(__name__)
 
+# maximum number of resources tagged by a single CreateTags call
+TAG_CHUNK = 200
+# pauses between retries when a freshly created resource is not yet visible
+RETRY_DELAYS = [1, 1, 2, 4, 8]
+
 
-def apply_tag(obj, tag='Name', val=None):
+def tag_resources(conn, resource_ids, tags):
     """
-        tag an AWS object
+        Apply tags (a dict) to all the given resources with as few CreateTags
+        calls as possible. Resources that were just created may not be
+        visible to CreateTags yet, so "not found" errors are retried.
     """
-    for x in [1, 1, 2, 4, 8]:
-        error = False
-        try:
-            obj.add_tag(tag, val)
-        except:  # pragma: no cover
-            error = True
-            e = sys.exc_info()[0]
-            log.info("Huh, trying again ({})".format(e))
-            time.sleep(x)
-        if not error:
-            log.info("Object {} tagged with {}={}".format(obj, tag, val))
-            break
+    for chunk in chunks(resource_ids, TAG_CHUNK):
+        for x in RETRY_DELAYS + [None]:
+            try:
+                conn.create_tags(chunk, tags)
+                break
+            except EC2ResponseError as e:
+                if x is None or not e.error_code.endswith('.NotFound'):
+                    raise
+                log.info("Huh, trying again ({})".format(e.error_code))
+                time.sleep(x)
+        log.info("Tagged {} with {!r}".format(', '.join(chunk), tags))
     return None
+
+
+class Tagger(object):
+    """
+        Collects (resource, tag, value) requests and applies them with as
+        few CreateTags calls as possible: resources that end up with the same
+        set of tags are tagged together.
+    """
+
+    def __init__(self, conn):
+        self._tagger = {
+            'conn': conn,
+            'pending': {},
+        }
+
+    def add(self, resource_id, tags):
+        """
+            Queue tags (a dict) for the given resource.
+        """
+        pending = self._tagger['pending']
+        pending.setdefault(resource_id, {}).update(tags)
+        return None
+
+    def plan(self):
+        """
+            Return a list of (tags, resource IDs) tuples, one per CreateTags
+            call, covering all queued tags. Resources are grouped either by
+            their complete set of tags or by individual tag, whichever needs
+            fewer calls.
+        """
+        by_set = {}
+        by_tag = {}
+        for (r_id, tags) in self._tagger['pending'].items():
+            pairs = tuple(sorted(
+                (tag, '' if val is None else str(val))
+                for (tag, val) in tags.items()
+            ))
+            by_set.setdefault(pairs, []).append(r_id)
+            for pair in pairs:
+                by_tag.setdefault((pair,), []).append(r_id)
+        groups = by_set if len(by_set) <= len(by_tag) else by_tag
+        return [(dict(pairs), sorted(groups[pairs]))
+                for pairs in sorted(groups.keys())]
+
+    def flush(self):
+        """
+            Apply all queued tags. Returns the number of CreateTags calls
+            made.
+        """
+        calls = 0
+        for (tags, r_ids) in self.plan():
+            tag_resources(self._tagger['conn'], r_ids, tags)
+            calls += (len(r_ids) + TAG_CHUNK - 1) // TAG_CHUNK
+        self._tagger['pending'] = {}
+        return calls
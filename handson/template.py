@@ -0,0 +1,116 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import os
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'@@([A-Za-z0-9_]+)@@')
+
+# parsed templates by file name, with the signature of the file they were
+# parsed from
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+class Template(object):
+    """
+        A user-data template, parsed into a sequence of literal strings and
+        @@TOKEN@@ names, which can be rendered in one pass.
+    """
+
+    def __init__(self, text, name=None):
+        self.name = name
+        pieces = TOKEN_RE.split(text)
+        # literals are at even positions, token names at odd ones
+        self.literals = tuple(pieces[0::2])
+        self.tokens = tuple(pieces[1::2])
+        self.reported = set()
+
+    def render(self, values):
+        """
+            Substitute the values of the given dict (keyed by token name,
+            without the @@) for the tokens. Tokens without a value (or with
+            None) are left as they are, and reported once per template.
+        """
+        out = [self.literals[0]]
+        unfilled = set()
+        for (i, token) in enumerate(self.tokens):
+            if values.get(token) is not None:
+                out.append(str(values[token]))
+            else:
+                unfilled.add(token)
+                out.append('@@{}@@'.format(token))
+            out.append(self.literals[i + 1])
+        unfilled -= self.reported
+        if unfilled:
+            log.warning("Leaving unfilled token(s) {} in {} as they are"
+                        .format(', '.join(sorted(unfilled)),
+                                self.name or 'template'))
+            self.reported |= unfilled
+        return ''.join(out)
+
+
+def load_template(fn):
+    """
+        Return the parsed template in the given file, parsing it only if it
+        has not been parsed before or has changed since.
+    """
+    st = os.stat(fn)
+    signature = (st.st_ino, st.st_size, st.st_mtime)
+    with _templates_lock:
+        cached = _templates.get(fn)
+        if cached and cached[0] == signature:
+            return cached[1]
+    with open(fn) as f:
+        t = Template(f.read(), name=fn)
+    log.debug("Parsed template {} ({} tokens)".format(fn, len(t.tokens)))
+    with _templates_lock:
+        _templates[fn] = (signature, t)
+    return t
+
+
+def render_user_data(fn, values, environment_tokens=()):
+    """
+        Render the user-data template in file fn with the given values,
+        plus the values of the environment variables listed in
+        environment_tokens (the replace-from-environment attribute of the
+        role definition), which must all be set.
+    """
+    values = dict(values)
+    for var in environment_tokens:
+        assert var in os.environ, (
+            "Environment variable {} (replace-from-environment) is not set"
+            .format(var))
+        values[var] = os.environ[var]
+    return load_template(fn).render(values)
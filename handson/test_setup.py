@@ -28,21 +28,39 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import glob
 import handson.myyaml as myyaml
+import handson.waiter as waiter
 # import logging
-# import os
+import os
+import shutil
 
 
 class SetUp(object):
 
     def setUp(self):
-        # try:
-        #     os.remove('./aws.yaml')
-        # except OSError:
-        #     pass
-        pass
+        self.remove_yaml()
+        self.addCleanup(self.remove_yaml)
+
+    def remove_yaml(self):
+        """
+            Remove the YAML file and everything kept next to it (journal,
+            lock, parse cache, state database), so that no test sees what
+            another one left behind.
+        """
+        myyaml.initialize_internal_buffers()
+        waiter.initialize_internal_buffers()
+        for fn in (
+            glob.glob('./aws.yaml*') + glob.glob('./aws.db*') +
+            ['./.aws.yaml.cache']
+        ):
+            if os.path.exists(fn):
+                os.unlink(fn)
+        if os.path.isdir('./aws.d'):
+            shutil.rmtree('./aws.d')
 
     def reset_yaml(self):
         myyaml.initialize_internal_buffers()
+        waiter.initialize_internal_buffers()
         myyaml.yaml_file_name('./aws.yaml')
         myyaml.load()
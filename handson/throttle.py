@@ -0,0 +1,244 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import logging
+import random
+import threading
+import time
+
+from boto.exception import BotoServerError
+
+log = logging.getLogger(__name__)
+
+# sustained rate (calls per second) and burst size of the client-side token
+# buckets, one per region and action family, chosen to stay below the EC2
+# API request limits
+bucket_parameters = {
+    'describe': (20.0, 50),
+    'mutate': (5.0, 20),
+    'tag': (10.0, 20),
+}
+# the rate is halved on every throttling response, but not below this
+MIN_RATE = 0.5
+# and creeps back up by this fraction of the nominal rate on every success
+RECOVERY_STEP = 0.05
+# how often a throttled call is retried, and the backoff between attempts
+MAX_RETRIES = 6
+BASE_BACKOFF = 1
+MAX_BACKOFF = 30
+THROTTLE_CODES = ('RequestLimitExceeded', 'Throttling')
+# server errors that are worth retrying (boto's own retries are disabled, so
+# that throttling errors reach the token buckets; transport errors such as a
+# reset connection are retried as well, see throttle_connection)
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def action_family(action):
+    """
+        Classify an EC2/VPC API action as 'describe', 'tag' or 'mutate'.
+    """
+    if action.startswith('Describe') or action.startswith('Get'):
+        return 'describe'
+    if action in ('CreateTags', 'DeleteTags'):
+        return 'tag'
+    return 'mutate'
+
+
+def get_bucket(region, family):
+    """
+        Return the token bucket for the given region and action family.
+    """
+    key = (region, family)
+    with _buckets_lock:
+        if key not in _buckets:
+            rate, burst = bucket_parameters[family]
+            _buckets[key] = TokenBucket(
+                '{}/{}'.format(region, family), rate, burst
+            )
+        return _buckets[key]
+
+
+def is_throttled(response):
+    """
+        Tell whether an HTTP response from the API is a throttling error.
+        Only 4xx responses are returned by boto; 5xx ones are raised as
+        BotoServerError (see is_throttling_error).
+    """
+    if response.status != 400:
+        return False
+    # boto caches the body, so reading it here does not consume it
+    body = response.read()
+    if not isinstance(body, str):
+        body = body.decode('utf-8', 'replace')
+    return any(code in body for code in THROTTLE_CODES)
+
+
+def is_throttling_error(e):
+    """
+        Tell whether a BotoServerError raised by an API call is a throttling
+        error.
+    """
+    return e.error_code in THROTTLE_CODES
+
+
+def throttle_connection(conn, region):
+    """
+        Route every API call made through a boto EC2/VPC connection via the
+        token buckets of its region.
+    """
+    make_request = conn.make_request
+    # boto retries 5xx responses (including 503 RequestLimitExceeded)
+    # itself, sleeping without telling anybody, and raises BotoServerError
+    # once it gives up: leave the retrying to TokenBucket.call, so that the
+    # buckets see every throttling error. This also turns off boto's
+    # retries of transport errors (socket errors, stale keep-alive
+    # connections), so TokenBucket.call retries the errors boto would have;
+    # boto has already dropped the broken connection from its pool.
+    conn.num_retries = 0
+    transient = tuple(conn.http_exceptions)
+    fatal = tuple(conn.http_unretryable_exceptions)
+
+    def throttled_request(action, *args, **kwargs):
+        bucket = get_bucket(region, action_family(action))
+        return bucket.call(
+            action,
+            lambda: make_request(action, *args, **kwargs),
+            transient=transient,
+            fatal=fatal,
+        )
+
+    conn.make_request = throttled_request
+    return conn
+
+
+class TokenBucket(object):
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.nominal_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.time()
+        self.throttled_count = 0
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.stamp) * self.rate
+        )
+        self.stamp = now
+
+    def acquire(self):
+        """
+            Take one token, sleeping until one is available.
+        """
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return None
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def throttled(self):
+        """
+            Back off after a throttling response: halve the rate and empty
+            the bucket, so that all workers sharing it slow down at once.
+        """
+        with self.lock:
+            self.refill()
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            self.throttled_count += 1
+            log.debug("Throttled on {}, rate now {:.2f}/s"
+                      .format(self.name, self.rate))
+        return None
+
+    def succeeded(self):
+        with self.lock:
+            if self.rate < self.nominal_rate:
+                self.refill()
+                self.rate = min(
+                    self.nominal_rate,
+                    self.rate + self.nominal_rate * RECOVERY_STEP
+                )
+        return None
+
+    def call(self, action, request, transient=(), fatal=()):
+        """
+            Make an API request once a token is available, retrying with
+            jittered exponential backoff while it is throttled or fails with
+            a server error or one of the transient exceptions (unless it is
+            also one of the fatal ones). If the retries run out, the last
+            throttling response is returned (so boto raises its usual error)
+            or the last error is raised.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire()
+            try:
+                response = request()
+            except BotoServerError as e:
+                throttled = is_throttling_error(e)
+                if not throttled and e.status not in RETRY_STATUSES:
+                    raise
+                if throttled:
+                    self.throttled()
+                if attempt == MAX_RETRIES:
+                    raise
+                self.backoff(action, attempt, e.error_code or e.status)
+                continue
+            except transient as e:
+                if isinstance(e, fatal) or attempt == MAX_RETRIES:
+                    raise
+                self.backoff(action, attempt, repr(e))
+                continue
+            if not is_throttled(response):
+                self.succeeded()
+                return response
+            self.throttled()
+            if attempt == MAX_RETRIES:
+                break
+            self.backoff(action, attempt, 'throttled')
+        return response
+
+    def backoff(self, action, attempt, reason):
+        delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+        delay = random.uniform(delay / 2.0, delay)
+        log.info("{} failed ({}); retrying in {:.1f}s"
+                 .format(action, reason, delay))
+        time.sleep(delay)
+        return None
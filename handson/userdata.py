@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import gzip
+import io
+import logging
+import os
+
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+log = logging.getLogger(__name__)
+
+# maximum size of the user-data of an instance (before base64 encoding)
+USER_DATA_LIMIT = 16384
+
+# MIME subtypes of cloud-init user-data parts, by their first line
+part_types = (
+    ('#!', 'x-shellscript'),
+    ('#cloud-config', 'cloud-config'),
+    ('#cloud-boothook', 'cloud-boothook'),
+    ('#include', 'x-include-url'),
+    ('#part-handler', 'part-handler'),
+    ('#upstart-job', 'upstart-job'),
+)
+
+
+def part_type(text):
+    """
+        Return the MIME subtype of a user-data part, recognized by its first
+        line as cloud-init does.
+    """
+    for (prefix, subtype) in part_types:
+        if text.startswith(prefix):
+            return subtype
+    return 'plain'
+
+
+def multipart(parts):
+    """
+        Given a list of (file name, text) tuples, return a MIME multipart
+        message with one part per tuple, which cloud-init processes in
+        order.
+    """
+    msg = MIMEMultipart()
+    for (fn, text) in parts:
+        part = MIMEText(text, part_type(text))
+        part.add_header('Content-Disposition', 'attachment',
+                        filename=os.path.basename(fn))
+        msg.attach(part)
+    return msg.as_string()
+
+
+def compress(text):
+    """
+        Gzip the user-data; cloud-init recognizes and unpacks it.
+    """
+    buf = io.BytesIO()
+    gz = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0)
+    try:
+        gz.write(text.encode('utf-8'))
+    finally:
+        gz.close()
+    return buf.getvalue()
+
+
+def build_user_data(parts, compressed=False):
+    """
+        Build the user-data of an instance from a list of (file name, text)
+        tuples: a single part is used as it is, several parts are combined
+        into a MIME multipart message. If compressed is True, the result is
+        gzipped (and thus bytes rather than a string).
+    """
+    if len(parts) == 1:
+        u = parts[0][1]
+    else:
+        u = multipart(parts)
+    size = len(u.encode('utf-8'))
+    if compressed:
+        u = compress(u)
+        log.debug("User-data compressed from {} to {} bytes"
+                  .format(size, len(u)))
+        size = len(u)
+    assert size <= USER_DATA_LIMIT, (
+        "User-data is {} bytes, more than the limit of {} bytes{}"
+        .format(size, USER_DATA_LIMIT,
+                "" if compressed else " (try compress-user-data)"))
+    return u
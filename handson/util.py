@@ -27,8 +27,27 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 #
+import fcntl
 import logging
+import os
 import re
+import tempfile
+import yaml
+
+from contextlib import contextmanager
+from pyaml import dump as pyaml_dump
+try:
+    from yaml import (
+        CSafeDumper as SafeDumper,
+        CSafeLoader as SafeLoader,
+    )
+    libyaml = True
+except ImportError:
+    from yaml import (
+        SafeDumper,
+        SafeLoader,
+    )
+    libyaml = False
 
 log = logging.getLogger(__name__)
 
@@ -61,10 +80,71 @@ def derive_ip_address(cidr_block, delegate, final8):
     return result
 
 
-def template_token_subst(buf, key, val):
+def chunks(seq, size):
+    """
+        Given a sequence and a chunk size, yield successive chunks of the
+        sequence that are at most size items long.
+    """
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def atomic_write(fn, data):
+    """
+        Atomically replace the file fn with the (byte) string data: write it
+        to a temporary file in the same directory, fsync it and rename it
+        over the original. The mode of the original, if any, is preserved.
+    """
+    (fd, tmp) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(fn)),
+        prefix='.{}.'.format(os.path.basename(fn)),
+    )
+    try:
+        mode = 'w' if isinstance(data, str) else 'wb'
+        with os.fdopen(fd, mode) as outfile:
+            outfile.write(data)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        if os.path.exists(fn):
+            os.chmod(tmp, os.stat(fn).st_mode & 0o7777)
+        else:
+            os.chmod(tmp, 0o644)
+        os.rename(tmp, fn)
+    except Exception:
+        os.unlink(tmp)
+        raise
+    return None
+
+
+@contextmanager
+def file_lock(fn, shared=False):
+    """
+        Hold an advisory fcntl lock on the lock file fn (created if
+        necessary) for the duration of the block. The lock is exclusive
+        unless shared is True.
+    """
+    with open(fn, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def yaml_load(stream):
+    """
+        Parse YAML from a string or file, with the libyaml C bindings if
+        they are available.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def yaml_dump(tree):
     """
-        Given a string (buf), a key (e.g. '@@MASTER_IP@@') and val, replace all
-        occurrences of key in buf with val. Return the new string.
+        Serialize a tree to a YAML string, with the libyaml C bindings if
+        they are available and with pyaml otherwise.
     """
-    targetre = re.compile(re.escape(key))
-    return re.sub(targetre, str(val), buf)
+    if libyaml:
+        return yaml.dump(tree, Dumper=SafeDumper, default_flow_style=False)
+    return pyaml_dump(tree, vspacing=[1, 0])
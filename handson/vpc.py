@@ -32,7 +32,7 @@ import logging
 
 from handson.myyaml import stanza
 from handson.region import Region
-from handson.tag import apply_tag
+from handson.tag import tag_resources
 # from handson.util import read_user_data
 
 log = logging.getLogger(__name__)
@@ -74,7 +74,9 @@ class VPC(Region):
                     log.info("New VPC ID {} created with CIDR block {}".format(
                         vpc_obj.id, vpc_obj.cidr_block
                     ))
-                    apply_tag(vpc_obj, tag='Name', val=stanza('nametag'))
+                    tag_resources(vpc_conn, [vpc_obj.id], {
+                        'Name': stanza('nametag'),
+                    })
                     self._vpc['vpc_obj'] = vpc_obj
                     stanza('vpc', {
                         'cidr_block': vpc_obj.cidr_block,
@@ -0,0 +1,94 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import argparse
+import logging
+
+from handson.cluster_options import (
+    ClusterOptions,
+)
+from handson.misc import (
+    CustomFormatter,
+    InitArgs,
+)
+from handson.parsers import (
+    cluster_options_parser,
+    phone_home_parser,
+)
+from handson.phonehome import (
+    PhoneHome,
+    expected_nodes,
+)
+
+log = logging.getLogger(__name__)
+
+
+class Wait(object):
+
+    @staticmethod
+    def get_parser():
+        parser = argparse.ArgumentParser(
+            usage='ho wait',
+            formatter_class=CustomFormatter,
+            parents=[cluster_options_parser(), phone_home_parser()],
+            conflict_handler='resolve',
+            add_help=False,
+        )
+
+        parser.add_argument(
+            '-r', '--roles',
+            nargs='+', metavar='ROLE',
+            help="Wait only for nodes with these roles",
+        )
+
+        parser.set_defaults(
+            func=WaitNodes,
+        )
+
+        return parser
+
+
+class WaitNodes(InitArgs, ClusterOptions):
+
+    def __init__(self, args):
+        super(WaitNodes, self).__init__(args)
+        self.args = args
+
+    def run(self):
+        self.process_delegate_list()
+        nodes = expected_nodes(self.args.delegate_list, roles=self.args.roles)
+        assert nodes, "No nodes to wait for"
+        phone_home = PhoneHome()
+        phone_home.start()
+        try:
+            phone_home.wait(nodes, timeout=self.args.timeout)
+        finally:
+            phone_home.stop()
+        return None
@@ -0,0 +1,193 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import copy
+import logging
+import random
+import time
+
+from handson.myyaml import (
+    lock as yaml_lock,
+    stanza,
+)
+
+log = logging.getLogger(__name__)
+
+# shortest and longest pause between two polls (seconds)
+MIN_DELAY = 0.5
+MAX_DELAY = 30
+# give up once a transition takes this many times longer than expected,
+# but never sooner than MIN_DEADLINE seconds
+DEADLINE_FACTOR = 10
+MIN_DEADLINE = 300
+
+# typical transition times (seconds), used until we have observed some
+expected_transition_times = {
+    'image:available': 300,
+    'instance:running': 30,
+    'instance:stopped': 45,
+    'instance:terminated': 45,
+    'volume:available': 10,
+    'volume:deleted': 10,
+    'volume:in-use': 5,
+}
+DEFAULT_TRANSITION_TIME = 30
+
+# observed latencies, protected by the YAML lock: a private copy of the
+# 'transition-times' stanza (which a flush of the YAML file may refresh from
+# disk at any time), and the keys recorded in it by this process
+_stats = None
+_recorded = set()
+
+
+class WaitTimeout(Exception):
+    pass
+
+
+def _load_stats():
+    global _stats
+    if _stats is None:
+        _stats = copy.deepcopy(stanza('transition-times'))
+    return _stats
+
+
+def expected_time(kind, state):
+    """
+        Return the expected duration of a transition of a resource of the
+        given kind to the given state: the mean of the latencies observed in
+        previous runs, if any, otherwise the built-in estimate.
+    """
+    key = '{}:{}'.format(kind, state)
+    with yaml_lock:
+        s = _load_stats().get(key)
+    if s and s.get('mean'):
+        return s['mean']
+    return expected_transition_times.get(key, DEFAULT_TRANSITION_TIME)
+
+
+def record(kind, state, seconds):
+    """
+        Fold an observed transition latency into the statistics.
+    """
+    key = '{}:{}'.format(kind, state)
+    with yaml_lock:
+        s = _load_stats().setdefault(key, {'count': 0, 'mean': None})
+        if s['mean'] is None:
+            s['mean'] = float(seconds)
+        else:
+            # exponentially weighted, so that recent runs count for more
+            s['mean'] = 0.8 * s['mean'] + 0.2 * seconds
+        s['mean'] = round(s['mean'], 1)
+        s['count'] += 1
+        _recorded.add(key)
+    log.debug("{} {} reached after {:.1f}s (mean now {}s)"
+              .format(kind, state, seconds, s['mean']))
+    return None
+
+
+def save_stats():
+    """
+        Write the statistics to the YAML file if anything was recorded. Only
+        the transitions recorded by this process are merged into the stanza;
+        the others are kept as they are.
+    """
+    with yaml_lock:
+        if not _recorded:
+            return None
+        t_stanza = dict(stanza('transition-times'))
+        for key in _recorded:
+            t_stanza[key] = copy.deepcopy(_stats[key])
+        stanza('transition-times', t_stanza)
+        _recorded.clear()
+    return None
+
+
+def initialize_internal_buffers():
+    global _stats
+    _stats = None
+    _recorded.clear()
+
+
+class Waiter(object):
+    """
+        Polling schedule for a single resource transition.
+
+        Polls start short (an eighth of the expected transition time) and
+        back off exponentially, with jitter, up to MAX_DELAY. Once the
+        deadline passes, the wait has expired and fails with the
+        WaitTimeout from timeout_error().
+    """
+
+    def __init__(self, kind, state, deadline=None):
+        expected = expected_time(kind, state)
+        if deadline is None:
+            deadline = max(MIN_DEADLINE, DEADLINE_FACTOR * expected)
+        now = time.time()
+        self._waiter = {
+            'kind': kind,
+            'state': state,
+            'base': max(MIN_DELAY, expected / 8.0),
+            'attempt': 0,
+            'start': now,
+            'deadline': now + deadline,
+        }
+        self._waiter['due'] = now + self.next_delay()
+
+    def next_delay(self):
+        """
+            Return the pause before the next poll and advance the schedule.
+        """
+        w = self._waiter
+        delay = min(MAX_DELAY, w['base'] * 2 ** w['attempt'])
+        w['attempt'] += 1
+        return random.uniform(delay / 2.0, delay)
+
+    def due(self):
+        return self._waiter['due']
+
+    def reschedule(self):
+        self._waiter['due'] = time.time() + self.next_delay()
+
+    def expired(self):
+        return time.time() > self._waiter['deadline']
+
+    def elapsed(self):
+        return time.time() - self._waiter['start']
+
+    def done(self):
+        """
+            Record the latency of the transition that just completed.
+        """
+        record(self._waiter['kind'], self._waiter['state'], self.elapsed())
+
+    def timeout_error(self, what):
+        return WaitTimeout(
+            "Timed out after {:.0f}s waiting for {} to reach '{}' state"
+            .format(self.elapsed(), what, self._waiter['state']))
@@ -35,7 +35,7 @@ import textwrap
 from handson.cluster_options import (
     ClusterOptions,
 )
-from handson.delegate import Delegate
+from handson.fleet import Fleet
 from handson.misc import (
     CustomFormatter,
     InitArgs,
@@ -159,10 +159,10 @@ class WipeOutDelegates(InitArgs, ClusterOptions):
 
     def run(self):
         self.process_delegate_list()
-        for d in self.args.delegate_list:
-            log.info("Wiping out cluster for delegate {}".format(d))
-            d = Delegate(self.args, d)
-            d.wipeout(dry_run=self.args.dry_run)
+        log.info("Wiping out clusters for delegates {!r}"
+                 .format(self.args.delegate_list))
+        f = Fleet(self.args, self.args.delegate_list)
+        f.wipeout(dry_run=self.args.dry_run)
 
 
 class WipeOutSubnets(InitArgs, ClusterOptions):
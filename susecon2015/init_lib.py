@@ -9,6 +9,7 @@ import base64
 from boto import vpc, ec2
 from os import environ
 from pprint import pprint
+import random
 import re
 import sys
 import time
@@ -252,21 +253,38 @@ def make_reservation( ec, ami_id, **kwargs ):
     return reservation
 
 
+def wait_with_backoff( check, what, expected=30, deadline=600 ):
+    """
+        Call check() until it returns a true value, which is returned.
+        Polling starts at an eighth of the expected transition time and backs
+        off exponentially (with jitter) up to 30 seconds. Raises SpinupError
+        once deadline seconds have passed.
+    """
+    start = time.time()
+    delay = max( 0.5, expected / 8.0 )
+    while True:
+        result = check()
+        if result:
+            print "{} after {:.1f} seconds".format( what, time.time() - start )
+            return result
+        if time.time() - start > deadline:
+            raise SpinupError( "Timed out after {} seconds waiting for {}".format( deadline, what ) )
+        pause = random.uniform( delay / 2.0, delay )
+        print "Sleeping for {:.1f} seconds".format( pause )
+        time.sleep( pause )
+        delay = min( 30, delay * 2 )
+
+
 def wait_for_running( ec2_conn, instance_id ):
     """
         Given an instance id, wait for its state to change to "running".
     """
     print "Waiting for {} running state".format( instance_id )
-    while True:
+    def check():
         instances = ec2_conn.get_only_instances( instance_ids=[ instance_id ] )
         print "Current state is {}".format( instances[0].state )
-        if instances[0].state != 'running':
-            print "Sleeping for 5 seconds"
-            time.sleep(5)
-        else:
-            print "Waiting another 5 seconds for good measure"
-            time.sleep(5)
-            break
+        return instances[0].state == 'running'
+    wait_with_backoff( check, "{} running".format( instance_id ), expected=30 )
 
 
 def wait_for_available( ec2_conn, volume_id ):
@@ -274,14 +292,11 @@ def wait_for_available( ec2_conn, volume_id ):
         Given a volume id, wait for its state to change to "available".
     """
     print "Waiting for {} available state".format( volume_id )
-    while True:
+    def check():
         volumes = ec2_conn.get_all_volumes( volume_ids=[ volume_id ] )
         print "Current status is {}".format( volumes[0].status )
-        if volumes[0].status != 'available':
-            print "Sleeping for 5 seconds"
-            time.sleep(5)
-        else:
-            break
+        return volumes[0].status == 'available'
+    wait_with_backoff( check, "{} available".format( volume_id ), expected=10 )
 
 
 def wait_for_detachment( ec2_conn, v_id, i_id ):
@@ -290,7 +305,7 @@ def wait_for_detachment( ec2_conn, v_id, i_id ):
         become detached.
     """
     print "Waiting for volume {} to be detached from instnace {}".format(v_id, i_id)
-    while True:
+    def check():
         attached_vol = ec2_conn.get_all_volumes(
             filters={ 
                 "volume-id": v_id,
@@ -299,10 +314,6 @@ def wait_for_detachment( ec2_conn, v_id, i_id ):
             }
         )
         print "attached_vol == {}".format(attached_vol)
-        if attached_vol is None or len(attached_vol) == 0:
-            print "Detached!"
-            break
-        else:
-            time.sleep(5)
-            print "Still attached."
+        return attached_vol is None or len(attached_vol) == 0
+    wait_with_backoff( check, "{} detached".format( v_id ), expected=10 )
 
@@ -0,0 +1,144 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import handson.myyaml as myyaml
+import os
+import unittest
+
+from handson.backend import (
+    ShardBackend,
+    SqliteBackend,
+)
+from handson.test_setup import SetUp
+from pyaml import dump
+from yaml import safe_load
+
+STATE = {
+    'clusters': {
+        1: {
+            'admin': {
+                'instance_id': 'i-1',
+                'placement': 'eu-west-1a',
+                'volume_id': 'vol-1',
+                'volume_attached': True,
+            },
+            'osd': {'instance_id': 'i-2', 'placement': 'eu-west-1a'},
+        },
+        2: {},
+    },
+    'keypairs': {1: {'keyname': 'handson-d1'}},
+    'subnets': {1: {'cidr_block': '10.0.1.0/24', 'id': 'subnet-1'}},
+}
+
+
+class TestBackend(SetUp, unittest.TestCase):
+
+    def test_sqlite_roundtrip(self):
+        b = SqliteBackend('./aws')
+        self.assertTrue(b.is_new())
+        b.import_state(STATE)
+        self.assertFalse(b.is_new())
+        self.assertEqual(b.load(), STATE)
+        c_stanza = b.load()['clusters']
+        c_stanza[3] = {'admin': {'instance_id': 'i-3', 'placement': 'x'}}
+        del(c_stanza[2])
+        b.store('clusters', c_stanza)
+        b.close()
+        b = SqliteBackend('./aws')
+        self.assertEqual(sorted(b.load()['clusters']), [1, 3])
+        rows = b.conn.execute(
+            'SELECT delegate, role FROM instances WHERE instance_id = ?',
+            ('i-3',)
+        ).fetchall()
+        self.assertEqual(rows, [(3, 'admin')])
+        b.close()
+
+    def test_stanzas_in_database(self):
+        self.reset_yaml()
+        myyaml.stanza('subnets', STATE['subnets'])
+        myyaml.stanza('state-backend', 'sqlite')
+        # switching backends imports the state on the next load
+        self.reset_yaml()
+        self.assertEqual(myyaml.stanza('subnets'), STATE['subnets'])
+        with open('./aws.yaml') as f:
+            self.assertNotIn('subnets', safe_load(f))
+        myyaml.journal('instance launched', ['clusters', 5, 'admin'],
+                       {'instance_id': 'i-5'})
+        self.assertFalse(os.path.exists('./aws.yaml.journal'))
+        self.reset_yaml()
+        self.assertEqual(myyaml.stanza('clusters'),
+                         {5: {'admin': {'instance_id': 'i-5'}}})
+        myyaml.export_state('./aws.yaml')
+        self.reset_yaml()
+        self.assertEqual(myyaml.stanza('state-backend'), 'yaml')
+        self.assertEqual(myyaml.stanza('subnets'), STATE['subnets'])
+
+    def test_shards(self):
+        b = ShardBackend('./aws')
+        self.assertTrue(b.is_new())
+        b.import_state(STATE)
+        self.assertFalse(b.is_new())
+        self.assertEqual(b.load(), STATE)
+        self.assertEqual(
+            sorted(fn for fn in os.listdir('./aws.d') if fn.endswith('yaml')),
+            ['delegate-1.yaml', 'delegate-2.yaml']
+        )
+        # two processes, each working on a delegate of its own
+        b1 = ShardBackend('./aws')
+        b2 = ShardBackend('./aws')
+        c1 = b1.load()['clusters']
+        c2 = b2.load()['clusters']
+        c1[5] = {'admin': {'instance_id': 'i-5'}}
+        c2[6] = {'admin': {'instance_id': 'i-6'}}
+        del(c2[2])
+        b1.store('clusters', c1)
+        b2.store('clusters', c2)
+        b2.store('subnets', {1: {'id': 'subnet-1b'}})
+        state = ShardBackend('./aws').load()
+        self.assertEqual(sorted(state['clusters']), [1, 5, 6])
+        self.assertEqual(state['subnets'], {1: {'id': 'subnet-1b'}})
+        self.assertEqual(state['keypairs'], STATE['keypairs'])
+
+    def test_concurrent_yaml_writers(self):
+        self.reset_yaml()
+        myyaml.stanza('delegates', 3)
+        # another ho process changes a different stanza meanwhile
+        with open('./aws.yaml') as f:
+            tree = safe_load(f)
+        tree['vpc'] = {'id': 'vpc-1', 'cidr_block': '10.0.0.0/16'}
+        with open('./aws.yaml', 'w') as f:
+            f.write(dump(tree))
+        myyaml.stanza('nametag', 'other')
+        with open('./aws.yaml') as f:
+            tree = safe_load(f)
+        self.assertEqual(tree['vpc']['id'], 'vpc-1')
+        self.assertEqual(tree['nametag'], 'other')
+        self.assertEqual(tree['delegates'], 3)
+        self.assertEqual(myyaml.stanza('vpc')['id'], 'vpc-1')
@@ -0,0 +1,194 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import argparse
+import handson.myyaml as myyaml
+import os
+import tempfile
+import unittest
+
+from handson.bake import (
+    BAKE_DIR,
+    Baker,
+    BakeRoles,
+    wrap_script,
+)
+from handson.config import config
+from handson.region import Region
+from handson.test_setup import SetUp
+from handson.waiter import WaitTimeout
+
+
+class MockInstance(object):
+
+    def __init__(self, i_id):
+        self.id = i_id
+
+
+class MockReservation(object):
+
+    def __init__(self, instance):
+        self.instances = [instance]
+
+
+class MockEC2Connection(object):
+
+    def __init__(self):
+        self.deregistered = []
+        self.images = []
+        self.run = []
+        self.tags = []
+        self.terminated = []
+
+    def run_instances(self, ami_id, **kwargs):
+        self.run.append((ami_id, kwargs))
+        return MockReservation(MockInstance('i-builder'))
+
+    def create_tags(self, resource_ids, tags):
+        self.tags.append((resource_ids, tags))
+
+    def create_image(self, i_id, name, description=None):
+        self.images.append((i_id, name))
+        return 'ami-baked'
+
+    def deregister_image(self, ami_id):
+        self.deregistered.append(ami_id)
+
+    def terminate_instances(self, instance_ids=None):
+        self.terminated.extend(instance_ids)
+
+
+class MockPoller(object):
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.waits = []
+
+    def wait(self, kind, r_id, state, deadline=None):
+        self.waits.append((kind, r_id, state))
+        if kind == self.fail:
+            raise WaitTimeout("{} {} is not {}".format(kind, r_id, state))
+
+
+class TestBake(SetUp, unittest.TestCase):
+
+    def setUp(self):
+        super(TestBake, self).setUp()
+        self.reset_yaml()
+        fd, self.fn = tempfile.mkstemp()
+        os.write(fd, b"#!/bin/bash\nzypper -n install @@ROLE@@-stuff\n")
+        os.close(fd)
+        rd = myyaml.stanza('role-definitions')
+        rd['osd'] = {
+            'ami-id': 'ami-base',
+            'bake-user-data': self.fn,
+            'last-octet': 14,
+        }
+        myyaml.stanza('role-definitions', rd)
+
+    def tearDown(self):
+        os.unlink(self.fn)
+
+    def mock_baker(self, ec2, poller):
+        b = Baker.__new__(Baker)
+        Region.__init__(b, {})
+        b.args = argparse.Namespace(timeout=60)
+        b._baker = {
+            'base_ami_id': 'ami-base',
+            'ec2': ec2,
+            'poller': poller,
+            'rd': config().role_defs['osd'],
+            'role': 'osd',
+        }
+        return b
+
+    def test_roles_to_bake(self):
+        args = argparse.Namespace(yamlfile='./aws.yaml', role_list=[])
+        self.assertEqual(BakeRoles(args).roles_to_bake(), ['osd'])
+        args.role_list = ['mon1']
+        with self.assertRaises(AssertionError):
+            BakeRoles(args).roles_to_bake()
+
+    def test_bake(self):
+        ec2 = MockEC2Connection()
+        poller = MockPoller()
+        b = self.mock_baker(ec2, poller)
+        self.assertEqual(b.bake('subnet-0'), 'ami-baked')
+        (ami_id, kwargs) = ec2.run[0]
+        self.assertEqual(ami_id, 'ami-base')
+        self.assertEqual(kwargs['subnet_id'], 'subnet-0')
+        self.assertEqual(kwargs['instance_initiated_shutdown_behavior'],
+                         'stop')
+        u = kwargs['user_data']
+        self.assertTrue(u.startswith('Content-Type: multipart/mixed'))
+        self.assertIn('osd-stuff', u)
+        self.assertIn('{}/0.sh && touch'.format(BAKE_DIR), u)
+        self.assertIn('poweroff', u)
+        self.assertEqual(poller.waits, [
+            ('instance', 'i-builder', 'stopped'),
+            ('image', 'ami-baked', 'available'),
+        ])
+        self.assertEqual(ec2.terminated, ['i-builder'])
+        rd = myyaml.stanza('role-definitions')['osd']
+        self.assertEqual(rd['ami-id'], 'ami-baked')
+        self.assertEqual(rd['base-ami-id'], 'ami-base')
+        # baking again starts from the base AMI
+        self.assertEqual(config().role_defs['osd'].base_ami_id, 'ami-base')
+
+    def test_wrap_script(self):
+        w = wrap_script(2, "#!/bin/bash\necho $HOME")
+        self.assertTrue(w.startswith('#!/bin/sh\n'))
+        self.assertIn("\necho $HOME\nHANDSON_BAKE_EOF\n", w)
+        self.assertIn('{0}/2.sh && touch {0}/2.sh.ok'.format(BAKE_DIR), w)
+        # only scripts can be wrapped
+        c = "#cloud-config\npackages: [ceph]\n"
+        self.assertEqual(wrap_script(0, c), c)
+
+    def test_bake_timeout(self):
+        ec2 = MockEC2Connection()
+        b = self.mock_baker(ec2, MockPoller(fail='instance'))
+        with self.assertRaises(WaitTimeout):
+            b.bake('subnet-0')
+        # the builder is not left behind, and the role is unchanged
+        self.assertEqual(ec2.terminated, ['i-builder'])
+        self.assertEqual(ec2.images, [])
+        rd = myyaml.stanza('role-definitions')['osd']
+        self.assertEqual(rd['ami-id'], 'ami-base')
+
+    def test_image_timeout(self):
+        ec2 = MockEC2Connection()
+        b = self.mock_baker(ec2, MockPoller(fail='image'))
+        with self.assertRaises(WaitTimeout):
+            b.bake('subnet-0')
+        # the AMI that did not become available is not kept
+        self.assertEqual(ec2.deregistered, ['ami-baked'])
+        self.assertEqual(ec2.terminated, ['i-builder'])
+        rd = myyaml.stanza('role-definitions')['osd']
+        self.assertEqual(rd['ami-id'], 'ami-base')
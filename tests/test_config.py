@@ -0,0 +1,85 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import handson.myyaml as myyaml
+import unittest
+
+from handson.config import config
+from handson.test_setup import SetUp
+
+
+class TestConfig(SetUp, unittest.TestCase):
+
+    def test_snapshot(self):
+        self.reset_yaml()
+        cfg = config()
+        self.assertIs(config(), cfg)
+        self.assertEqual(cfg.cluster_roles, ('admin',))
+        rd = cfg.role_defs['admin']
+        self.assertEqual(rd.last_octet, 10)
+        self.assertEqual(rd.type, 't2.small')
+        self.assertEqual(rd.replace_from_environment, ())
+        with self.assertRaises(AttributeError):
+            rd.type = 't2.micro'
+        with self.assertRaises(AttributeError):
+            cfg.cluster_roles = ()
+        self.assertEqual(rd.replace({'type': 't2.micro'}).type, 't2.micro')
+        self.assertEqual(rd.type, 't2.small')
+
+    def test_state_writes(self):
+        self.reset_yaml()
+        cfg = config()
+        # the state stanzas are not part of the configuration
+        myyaml.stanza('subnets', {1: {'cidr_block': '10.0.1.0/24',
+                                      'id': 'subnet-1'}})
+        myyaml.stanza('transition-times', {})
+        myyaml.journal('instance launched', ['clusters', 1, 'admin'],
+                       {'instance_id': 'i-1'})
+        myyaml.compact()
+        self.assertIs(config(), cfg)
+
+    def test_recompile(self):
+        self.reset_yaml()
+        cfg = config()
+        rd_stanza = myyaml.stanza('role-definitions')
+        rd_stanza['defaults']['type'] = 't2.micro'
+        myyaml.stanza('role-definitions', rd_stanza)
+        myyaml.stanza('cluster-definition', [
+            {'role': 'admin'}, {'role': 'osd'},
+        ])
+        self.assertIsNot(config(), cfg)
+        self.assertEqual(config().cluster_roles, ('admin', 'osd'))
+        self.assertEqual(config().role_defs['osd'].type, 't2.micro')
+        myyaml.stanza('cluster-definition', [{'role': 'bogus'}])
+        with self.assertRaises(AssertionError):
+            config()
+        rd_stanza['defaults']['type'] = 't2.small'
+        myyaml.stanza('role-definitions', rd_stanza)
+        myyaml.stanza('cluster-definition', [{'role': 'admin'}])
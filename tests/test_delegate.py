@@ -0,0 +1,217 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import handson.myyaml as myyaml
+import os
+import tempfile
+import threading
+import unittest
+
+from handson.config import config
+from handson.delegate import Delegate
+from handson.poller import Poller
+from handson.region import Region
+from handson.tag import Tagger
+from handson.test_setup import SetUp
+
+
+class MockAWSObject(object):
+
+    def __init__(self, obj_id, state=None):
+        self.id = obj_id
+        self.placement = 'eu-west-1a'
+        self.state = state
+        self.status = state
+        self.tags = {}
+
+    def add_tag(self, tag, val):
+        self.tags[tag] = val
+
+
+class MockReservation(object):
+
+    def __init__(self, instance):
+        self.instances = [instance]
+
+
+class MockEC2Connection(object):
+
+    def __init__(self):
+        self.attached = []
+        self.attached_event = threading.Event()
+        self.instance_states = {}
+        self.run_kwargs = None
+        self.volumes_created = 0
+
+    def run_instances(self, ami_id, **kwargs):
+        self.run_kwargs = kwargs
+        return MockReservation(MockAWSObject('i-new'))
+
+    def create_volume(self, size, placement):
+        self.volumes_created += 1
+        return MockAWSObject('vol-new')
+
+    def get_only_instances(self, filters=None):
+        return [MockAWSObject(i_id, self.instance_states.get(i_id, 'pending'))
+                for i_id in filters['instance-id']]
+
+    def get_all_volumes(self, filters=None):
+        return [MockAWSObject(v_id, 'available')
+                for v_id in filters['volume-id']]
+
+    def attach_volume(self, v_id, i_id, device):
+        self.attached.append((v_id, i_id))
+        self.attached_event.set()
+        return True
+
+
+class MockPoller(object):
+    """
+        Reports every resource ready at once, except instance i-slow, which
+        becomes ready only after the others have been attached.
+    """
+
+    def __init__(self, ec2):
+        self.ec2 = ec2
+
+    def register(self, kind, r_id, state, callback):
+        if r_id == 'i-slow':
+            def later():
+                self.ec2.attached_event.wait()
+                callback(r_id, state)
+            threading.Thread(target=later).start()
+        else:
+            callback(r_id, state)
+
+
+class TestDelegate(SetUp, unittest.TestCase):
+
+    def mock_delegate(self, ec2, role_def):
+        d = Delegate.__new__(Delegate)
+        Region.__init__(d, {})
+        d._delegate = {
+            'delegate': 1,
+            'ec2': ec2,
+            'keyname': 'test-d1',
+            'role_defs': {'osd': role_def},
+            'subnet_obj': MockAWSObject('subnet-1'),
+            'tagger': Tagger(ec2),
+        }
+        d._delegate['subnet_obj'].cidr_block = '10.0.1.0/24'
+        return d
+
+    def test_volume_modes(self):
+        self.reset_yaml()
+        rd = config().role_defs['osd']
+        self.assertEqual(rd.volume_mode, 'attach')
+        rd = rd.replace({'volume': 20})
+        # separate volume
+        ec2 = MockEC2Connection()
+        d = self.mock_delegate(ec2, rd)
+        (i_obj, v_obj) = d.instantiate_role('osd')
+        self.assertEqual(v_obj.id, 'vol-new')
+        self.assertNotIn('block_device_map', ec2.run_kwargs)
+        # instance and volume are tagged together
+        self.assertEqual(d._delegate['tagger'].plan(), [
+            ({'Delegate': '1', 'Name': 'handson', 'Role': 'osd'},
+             ['i-new', 'vol-new']),
+        ])
+        # block device mapping
+        rd = rd.replace({'volume-mode': 'block-device'})
+        ec2 = MockEC2Connection()
+        (i_obj, v_obj) = self.mock_delegate(ec2, rd).instantiate_role('osd')
+        self.assertIsNone(v_obj)
+        self.assertEqual(ec2.volumes_created, 0)
+        bdt = ec2.run_kwargs['block_device_map']['/dev/sdb']
+        self.assertEqual(bdt.size, 20)
+        self.assertTrue(bdt.delete_on_termination)
+
+    def test_package_cache(self):
+        self.reset_yaml()
+        rd = myyaml.stanza('role-definitions')
+        rd['master']['package-cache'] = True
+        myyaml.stanza('role-definitions', rd)
+        fd, fn = tempfile.mkstemp()
+        os.write(fd, b"#!/bin/sh\n"
+                     b"zypper ar http://download.opensuse.org/r/ r\n")
+        os.close(fd)
+        try:
+            role_def = config().role_defs['osd'].replace({'user-data': fn})
+            ec2 = MockEC2Connection()
+            self.mock_delegate(ec2, role_def).instantiate_role('osd')
+            self.assertEqual(ec2.run_kwargs['user_data'], (
+                "#!/bin/sh\nzypper ar "
+                "http://10.0.0.10:8080/http/download.opensuse.org/r/ r\n"))
+        finally:
+            os.unlink(fn)
+
+    def test_attach_volumes(self):
+        self.reset_yaml()
+        d = Delegate.__new__(Delegate)
+        ec2 = MockEC2Connection()
+        d._delegate = {'delegate': 1, 'ec2': ec2, 'poller': MockPoller(ec2)}
+        d.attach_volumes({
+            'mon1': ('i-fast', 'vol-1'),
+            'mon2': ('i-slow', 'vol-2'),
+        })
+        self.assertEqual(ec2.attached, [
+            ('vol-1', 'i-fast'),
+            ('vol-2', 'i-slow'),
+        ])
+        self.assertTrue(
+            myyaml.stanza('clusters')[1]['mon2']['volume_attached']
+        )
+        myyaml.compact()
+
+
+class TestPoller(SetUp, unittest.TestCase):
+
+    def test_poll_batches(self):
+        self.reset_yaml()
+        p = Poller({})
+        ec2 = MockEC2Connection()
+        p._region['ec2_conn'] = ec2
+        fired = []
+        with p._poller['lock']:
+            # keep the background thread out of the way
+            p._poller['thread'] = 'dummy'
+        for r_id in ['i-1', 'i-2']:
+            p.register('instance', r_id, 'running',
+                       lambda r_id, state: fired.append(r_id))
+        p.register('volume', 'vol-1', 'available',
+                   lambda r_id, state: fired.append(r_id))
+        self.assertIsNotNone(p.poll())
+        self.assertEqual(fired, ['vol-1'])
+        ec2.instance_states['i-2'] = 'running'
+        self.assertIsNotNone(p.poll())
+        self.assertEqual(fired, ['vol-1', 'i-2'])
+        ec2.instance_states['i-1'] = 'running'
+        self.assertIsNone(p.poll())
+        self.assertEqual(fired, ['vol-1', 'i-2', 'i-1'])
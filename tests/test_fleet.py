@@ -0,0 +1,167 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import handson.myyaml
+import unittest
+
+from handson.fleet import Fleet
+from handson.test_setup import SetUp
+from mock import patch
+
+
+class MockInstance(object):
+
+    def __init__(self, delegate, role, ip_address):
+        self.ip_address = ip_address
+        self.tags = {'Delegate': delegate, 'Role': role}
+
+
+class MockReservations(list):
+
+    def __init__(self, instances, next_token):
+        super(MockReservations, self).__init__()
+        r = MockReservation()
+        r.instances = instances
+        self.append(r)
+        self.next_token = next_token
+
+
+class MockReservation(object):
+    pass
+
+
+class MockEC2Connection(object):
+
+    def __init__(self):
+        self.calls = []
+        self.pages = {
+            None: MockReservations([
+                MockInstance('1', 'admin', '1.2.3.4'),
+                MockInstance('1', 'osd', None),
+            ], 'page2'),
+            'page2': MockReservations([
+                MockInstance('2', 'admin', '5.6.7.8'),
+                MockInstance(None, 'untagged', '9.9.9.9'),
+            ], None),
+        }
+
+    def get_all_reservations(self, filters=None, max_results=None,
+                             next_token=None):
+        self.calls.append(('describe', next_token))
+        return self.pages[next_token]
+
+    def start_instances(self, instance_ids=None):
+        self.calls.append(('start', list(instance_ids)))
+
+    def stop_instances(self, instance_ids=None):
+        self.calls.append(('stop', list(instance_ids)))
+
+    def terminate_instances(self, instance_ids=None):
+        self.calls.append(('terminate', list(instance_ids)))
+
+    def delete_volume(self, v_id):
+        self.calls.append(('delete', v_id))
+
+
+class MockPoller(object):
+
+    def register(self, kind, r_id, state, callback):
+        callback(r_id, None if r_id == 'vol-stuck' else state)
+
+
+class TestFleet(SetUp, unittest.TestCase):
+
+    @patch('handson.fleet.shared_poller', return_value=MockPoller())
+    def test_wipeout(self, mock_poller):
+        self.reset_yaml()
+        handson.myyaml.stanza('clusters', {
+            1: {
+                'admin': {'instance_id': 'i-1a'},
+                'osd': {'instance_id': 'i-1o', 'volume_id': 'vol-1'},
+            },
+            2: {
+                'admin': {'instance_id': 'i-2a'},
+                'osd': {'instance_id': 'i-2o', 'volume_id': 'vol-stuck'},
+            },
+            3: {
+                'admin': {'instance_id': 'i-3a'},
+            },
+        })
+        f = Fleet({}, [1, 2, 4])
+        ec2 = MockEC2Connection()
+        f._region['ec2_conn'] = ec2
+        f.wipeout()
+        self.assertEqual(ec2.calls, [
+            ('terminate', ['i-1a', 'i-1o', 'i-2a', 'i-2o']),
+            ('delete', 'vol-1'),
+        ])
+        self.assertEqual(list(handson.myyaml.stanza('clusters').keys()), [3])
+        handson.myyaml.stanza('clusters', {})
+
+    @patch('handson.fleet.API_CHUNK', 2)
+    def test_start_stop(self):
+        self.reset_yaml()
+        handson.myyaml.stanza('clusters', {
+            1: {'admin': {'instance_id': 'i-1a'}},
+            2: {'admin': {'instance_id': 'i-2a'}},
+            3: {'admin': {'instance_id': 'i-3a'}},
+        })
+        f = Fleet({}, [1, 2, 3])
+        ec2 = MockEC2Connection()
+        f._region['ec2_conn'] = ec2
+        f.stop()
+        f.start(dry_run=True)
+        f.start()
+        self.assertEqual(ec2.calls, [
+            ('stop', ['i-1a', 'i-2a']),
+            ('stop', ['i-3a']),
+            ('start', ['i-1a', 'i-2a']),
+            ('start', ['i-3a']),
+        ])
+        handson.myyaml.stanza('clusters', {})
+
+    def test_public_ips(self):
+        self.reset_yaml()
+        handson.myyaml.stanza('clusters', {
+            1: {'admin': {}, 'osd': {}},
+            2: {'admin': {}, 'mon1': {}},
+        })
+        f = Fleet({}, [0, 1, 2])
+        ec2 = MockEC2Connection()
+        f._region['ec2_conn'] = ec2
+        self.assertEqual(f.public_ips(), {
+            1: {'admin': '1.2.3.4', 'osd': '(none)'},
+            2: {'admin': '5.6.7.8', 'mon1': '(none)'},
+        })
+        self.assertEqual(ec2.calls, [
+            ('describe', None),
+            ('describe', 'page2'),
+        ])
+        handson.myyaml.stanza('clusters', {})
@@ -29,6 +29,9 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 import logging
+import os
+import shutil
+import tempfile
 import unittest
 
 from handson import main
@@ -194,8 +197,13 @@ class TestHandsOn(SetUp, unittest.TestCase):
                 'probe', 'yaml',
             ])
 
+        # copied, so that its parse cache does not end up in data/
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        bogus = os.path.join(tmpdir, 'bogus.yaml')
+        shutil.copy('./data/bogus.yaml', bogus)
         with self.assertRaises(AssertionError):
             m.run([
-                '-y', './data/bogus.yaml',
+                '-y', bogus,
                 'probe', 'yaml',
             ])
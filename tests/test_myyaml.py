@@ -29,10 +29,12 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 import handson.myyaml as myyaml
+import os
 # import logging
 import unittest
 
 from handson.test_setup import SetUp
+from mock import patch
 
 
 class TestMyYaml(SetUp, unittest.TestCase):
@@ -56,3 +58,94 @@ class TestMyYaml(SetUp, unittest.TestCase):
         self.reset_yaml()
         with self.assertRaises(AssertionError):
             myyaml.stanza('prd', {})
+
+    def reload_yaml(self):
+        myyaml.initialize_internal_buffers()
+        myyaml.yaml_file_name('./aws.yaml')
+        myyaml.load()
+
+    def test_journal_replay(self):
+        self.reset_yaml()
+        myyaml.journal('instance launched', ['clusters', 7, 'admin'],
+                       {'instance_id': 'i-1'})
+        myyaml.journal('instance launched', ['clusters', 8, 'admin'],
+                       {'instance_id': 'i-2'})
+        myyaml.journal('delegate wiped', ['clusters', 8], delete=True)
+        self.assertTrue(os.path.exists('./aws.yaml.journal'))
+        # simulate a crash in the middle of an append
+        with open('./aws.yaml.journal', 'a') as f:
+            f.write('{"event": "instance laun')
+        self.reload_yaml()
+        self.assertEqual(myyaml.stanza('clusters'),
+                         {7: {'admin': {'instance_id': 'i-1'}}})
+        myyaml.compact()
+        self.assertFalse(os.path.exists('./aws.yaml.journal'))
+        self.reload_yaml()
+        self.assertEqual(myyaml.stanza('clusters'),
+                         {7: {'admin': {'instance_id': 'i-1'}}})
+        myyaml.stanza('clusters', {})
+
+    def test_journal_compaction(self):
+        self.reset_yaml()
+        with patch('handson.myyaml.JOURNAL_COMPACT_RECORDS', 3):
+            for d in range(1, 4):
+                myyaml.journal('delegate installing', ['clusters', d], {})
+                self.assertEqual(
+                    os.path.exists('./aws.yaml.journal'), d < 3
+                )
+        self.reload_yaml()
+        self.assertEqual(sorted(myyaml.stanza('clusters')), [1, 2, 3])
+        myyaml.stanza('clusters', {})
+
+    def test_refresh_in_place(self):
+        self.reset_yaml()
+        myyaml.stanza('subnets', {1: {'id': 'subnet-1'}})
+        held = myyaml.stanza('subnets')
+        # another process adds a subnet
+        tree = myyaml.read_tree('./aws.yaml')
+        tree['subnets'][2] = {'id': 'subnet-2'}
+        myyaml.dump_tree(tree, './aws.yaml')
+        # an unrelated write refreshes the stanza, but in place
+        myyaml.stanza('keypairs', {})
+        self.assertIs(myyaml.stanza('subnets'), held)
+        self.assertEqual(sorted(held), [1, 2])
+        held[3] = {'id': 'subnet-3'}
+        myyaml.stanza('subnets', held)
+        self.reload_yaml()
+        self.assertEqual(sorted(myyaml.stanza('subnets')), [1, 2, 3])
+        myyaml.stanza('subnets', {})
+
+    def test_parse_cache(self):
+        self.reset_yaml()
+        myyaml.stanza('delegates', 4)
+        self.assertTrue(os.path.exists('./.aws.yaml.cache'))
+        with patch('handson.myyaml.yaml_load') as mock_load:
+            self.reload_yaml()
+            self.assertEqual(mock_load.call_count, 0)
+        self.assertEqual(myyaml.stanza('delegates'), 4)
+        # editing the file invalidates the cache
+        with open('./aws.yaml', 'a') as f:
+            f.write('nametag: edited\n')
+        self.reload_yaml()
+        self.assertEqual(myyaml.stanza('nametag'), 'edited')
+        myyaml.stanza('delegates', 1)
+
+    def test_lazy_defaults(self):
+        if os.path.exists('./aws.yaml'):
+            os.unlink('./aws.yaml')
+        self.reset_yaml()
+        with patch('handson.myyaml.flush') as mock_flush:
+            self.assertEqual(myyaml.stanza('nametag'), 'handson')
+            self.assertEqual(mock_flush.call_count, 0)
+            myyaml.probe_yaml()
+            self.assertEqual(mock_flush.call_count, 1)
+        myyaml.probe_yaml()
+        with open('./aws.yaml') as f:
+            self.assertIn('nametag', f.read())
+        # defaults are copies, not the built-in values themselves
+        myyaml.stanza('vpc')['id'] = 'vpc-1'
+        self.assertEqual(myyaml.tree_stanzas['vpc']['default'], {})
+        # once checked, stanza() is a plain lookup
+        with patch('handson.myyaml.load') as mock_load:
+            myyaml.stanza('nametag')
+            self.assertEqual(mock_load.call_count, 0)
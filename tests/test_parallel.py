@@ -0,0 +1,73 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import threading
+import time
+import unittest
+
+from handson.parallel import run_in_parallel
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_results(self):
+        def square(x):
+            return x * x
+        results = run_in_parallel(square, [1, 2, 3], parallel=2)
+        self.assertEqual(results, {1: (True, 1), 2: (True, 4), 3: (True, 9)})
+
+    def test_failure_isolated(self):
+        def picky(x):
+            assert x != 2, "two is not allowed"
+            return x
+        results = run_in_parallel(picky, [1, 2, 3], parallel=3)
+        self.assertEqual(results[1], (True, 1))
+        self.assertEqual(results[3], (True, 3))
+        (ok, e) = results[2]
+        self.assertFalse(ok)
+        self.assertIsInstance(e, AssertionError)
+
+    def test_bounded(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def busy(_):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+
+        run_in_parallel(busy, range(10), parallel=3)
+        self.assertTrue(1 < state['peak'] <= 3)
+
+    def test_empty(self):
+        self.assertEqual(run_in_parallel(lambda x: x, []), {})
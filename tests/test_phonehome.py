@@ -0,0 +1,107 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import handson.myyaml as myyaml
+import unittest
+
+try:
+    from urllib.error import HTTPError
+    from urllib.request import urlopen
+except ImportError:  # pragma: no cover
+    from urllib2 import (
+        HTTPError,
+        urlopen,
+    )
+
+from handson.phonehome import (
+    PhoneHome,
+    callback_url,
+    expected_nodes,
+)
+from handson.test_setup import SetUp
+from handson.waiter import WaitTimeout
+
+
+class TestPhoneHome(SetUp, unittest.TestCase):
+
+    def test_callback_url(self):
+        self.reset_yaml()
+        self.assertIsNone(callback_url(1, 'mon1'))
+        myyaml.stanza('phone-home', {'address': '192.0.2.1', 'port': 9000})
+        self.assertEqual(callback_url(1, 'mon1'),
+                         'http://192.0.2.1:9000/ready/1/mon1')
+
+    def test_expected_nodes(self):
+        self.reset_yaml()
+        myyaml.stanza('cluster-definition', [{'role': 'admin'},
+                                             {'role': 'mon1'}])
+        self.assertEqual(expected_nodes([0, 2]), [
+            (0, 'master'), (2, 'admin'), (2, 'mon1'),
+        ])
+        self.assertEqual(expected_nodes([1, 2], roles=['mon1']), [
+            (1, 'mon1'), (2, 'mon1'),
+        ])
+
+    def test_no_address(self):
+        self.reset_yaml()
+        myyaml.stanza('phone-home', {'address': None, 'port': 0})
+        with self.assertRaises(AssertionError):
+            PhoneHome().start()
+
+    def test_wait(self):
+        self.reset_yaml()
+        # any free port
+        myyaml.stanza('phone-home', {'address': '127.0.0.1', 'port': 0})
+        myyaml.stanza('clusters', {1: {'mon1': {}, 'mon2': {}, 'mon3': {}}})
+        with self.assertRaises(AssertionError):
+            PhoneHome().wait([(1, 'mon1'), (2, 'mon1')], timeout=0)
+        p = PhoneHome()
+        p.start()
+        try:
+            port = p._phone_home['server'].server_address[1]
+            url = 'http://127.0.0.1:{}'.format(port)
+            with self.assertRaises(HTTPError):
+                urlopen(url + '/bogus')
+            # unexpected nodes are not recorded
+            urlopen(url + '/ready/99/evil').read()
+            self.assertEqual(
+                urlopen(url + '/ready/1/mon1?uptime=42.5').read(), b'OK\n')
+            urlopen(url + '/ready/1/mon2').read()
+            p.wait([(1, 'mon1'), (1, 'mon2')], timeout=10)
+        finally:
+            p.stop()
+        clusters = myyaml.stanza('clusters')
+        self.assertNotIn(99, clusters)
+        self.assertEqual(clusters[1]['mon1']['ready'], 42.5)
+        self.assertTrue(clusters[1]['mon2']['ready'])
+        # nodes that phoned home earlier need not do so again
+        PhoneHome().wait([(1, 'mon1')], timeout=0)
+        with self.assertRaises(WaitTimeout):
+            PhoneHome().wait([(1, 'mon1'), (1, 'mon3')], timeout=0.1)
@@ -0,0 +1,170 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import argparse
+import handson.myyaml as myyaml
+import os
+import tempfile
+import unittest
+
+from handson.config import config
+from handson.install import InstallDelegates
+from handson.pkgcache import (
+    repo_urls,
+    rewrite,
+    setup_script,
+    upstreams,
+)
+from handson.test_setup import SetUp
+from mock import patch
+
+USER_DATA = """\
+#!/bin/bash -x
+zypper -n addrepo http://download.opensuse.org/repositories/foo.repo
+zypper ar https://updates.suse.com/SUSE/Updates/ update
+zypper -n addrepo http://ip-10-0-0-10/SES2-media1 SES2-media1
+curl -o /tmp/x http://example.com/x
+"""
+
+CLOUD_CONFIG = """\
+#cloud-config
+zypper:
+  repos:
+    - id: salt
+      baseurl: http://download.opensuse.org/repositories/salt/
+"""
+
+
+class TestPackageCache(unittest.TestCase):
+
+    def test_repo_urls(self):
+        self.assertEqual(repo_urls(USER_DATA, '10.0.0.10'), set([
+            ('http', 'download.opensuse.org'),
+            ('https', 'updates.suse.com'),
+        ]))
+        self.assertEqual(repo_urls(CLOUD_CONFIG, '10.0.0.10'), set([
+            ('http', 'download.opensuse.org'),
+        ]))
+
+    def test_rewrite(self):
+        lines = rewrite(USER_DATA, '10.0.0.10').splitlines()
+        self.assertEqual(lines[1], (
+            "zypper -n addrepo http://10.0.0.10:8080/http/"
+            "download.opensuse.org/repositories/foo.repo"))
+        self.assertEqual(lines[2], (
+            "zypper ar http://10.0.0.10:8080/https/updates.suse.com"
+            "/SUSE/Updates/ update"))
+        # repos on the master itself and other URLs are left alone
+        self.assertEqual(lines[3:], USER_DATA.splitlines()[3:])
+        self.assertIn(
+            "baseurl: http://10.0.0.10:8080/http/download.opensuse.org/",
+            rewrite(CLOUD_CONFIG, '10.0.0.10'))
+
+    def test_upstreams(self):
+        fd, fn = tempfile.mkstemp()
+        os.write(fd, USER_DATA.encode())
+        os.close(fd)
+        try:
+            self.assertEqual(upstreams([fn], '10.0.0.10'), [
+                ('http', 'download.opensuse.org'),
+                ('https', 'updates.suse.com'),
+            ])
+        finally:
+            os.unlink(fn)
+
+    def test_setup_script(self):
+        script = setup_script([
+            ('http', 'download.opensuse.org'),
+            ('https', 'updates.suse.com'),
+        ], '10.0.0.10')
+        self.assertTrue(script.startswith('#!/bin/bash'))
+        self.assertIn("listen 8080;", script)
+        self.assertIn("proxy_pass https://updates.suse.com/;", script)
+        self.assertIn(
+            "sub_filter 'http://download.opensuse.org/' "
+            "'http://10.0.0.10:8080/http/download.opensuse.org/';", script)
+        # the upstreams are resolved when nginx starts; only the mirrors
+        # that packages are redirected to are looked up at run time
+        for line in script.splitlines():
+            if 'proxy_pass' in line and 'proxy_pass $mirror;' not in line:
+                self.assertNotIn('$', line)
+        self.assertIn("resolver $(awk '/^nameserver/", script)
+        self.assertIn("include /etc/nginx/pkgcache-resolver.conf;", script)
+        self.assertIn("error_page 301 302 303 307 = @mirror;", script)
+        self.assertIn("location @mirror {", script)
+        self.assertNotIn('curl', script)
+        script = setup_script([], '10.0.0.10',
+                              callback='http://192.0.2.1:8765/ready/0/master')
+        self.assertIn('curl -fsS "http://192.0.2.1:8765/ready/0/master?',
+                      script.splitlines()[-1])
+
+
+class TestPackageCacheRole(SetUp, unittest.TestCase):
+
+    def test_package_cache_valid(self):
+        self.reset_yaml()
+        self.assertFalse(config().role_defs['master'].package_cache)
+        rd = myyaml.stanza('role-definitions')
+        rd['master']['package-cache'] = 'yes'
+        myyaml.stanza('role-definitions', rd)
+        with self.assertRaises(AssertionError):
+            config()
+        rd['master']['package-cache'] = True
+        myyaml.stanza('role-definitions', rd)
+        self.assertTrue(config().role_defs['master'].package_cache)
+
+    def install_delegates(self, delegate_list):
+        args = argparse.Namespace(
+            yamlfile='./aws.yaml', delegate_list=delegate_list, all=False,
+            master=None, dry_run=None, parallel=4, wait=None, timeout=60)
+        return InstallDelegates(args)
+
+    @patch('handson.install.PhoneHome')
+    def test_install_gated(self, phone_home):
+        self.reset_yaml()
+        myyaml.stanza('delegates', 2)
+        rd = myyaml.stanza('role-definitions')
+        rd['master']['package-cache'] = True
+        myyaml.stanza('role-definitions', rd)
+        # without phone-home, there is no telling when the cache is up
+        with self.assertRaises(AssertionError):
+            self.install_delegates([1, 2]).run()
+        myyaml.stanza('phone-home', {'address': '192.0.2.1', 'port': 8765})
+        calls = []
+        phone_home.return_value.wait.side_effect = (
+            lambda nodes, timeout=None: calls.append(('wait', nodes)))
+        with patch.object(InstallDelegates, 'install_delegates',
+                          lambda self, ds: calls.append(('install', ds))):
+            self.install_delegates([0, 1, 2]).run()
+        self.assertEqual(calls, [
+            ('install', [0]),
+            ('wait', [(0, 'master')]),
+            ('install', [1, 2]),
+        ])
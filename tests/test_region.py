@@ -29,15 +29,36 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 import handson.myyaml
-# import logging
+import handson.region
+import socket
 import unittest
 
+from handson.region import (
+    Region,
+    connection_stats,
+    get_connection,
+)
 from handson.test_setup import SetUp
-from handson.region import Region
+from mock import patch
+
+
+class MockConnection(object):
+
+    http_exceptions = (socket.error,)
+    http_unretryable_exceptions = []
+
+    def make_request(self, action, params=None, path='/', verb='GET'):
+        return None
 
 
 class TestRegion(SetUp, unittest.TestCase):
 
+    def setUp(self):
+        super(TestRegion, self).setUp()
+        handson.region._connections.clear()
+        handson.region._connection_stats['opened'] = 0
+        handson.region._connection_stats['reused'] = 0
+
     def test_region_cache(self):
         self.reset_yaml()
         handson.myyaml.yaml_file_name('./aws.yaml')
@@ -45,3 +66,25 @@ class TestRegion(SetUp, unittest.TestCase):
         r = Region({})
         r.region()  # loads from yaml
         r.region()  # loads from cache
+
+    @patch('boto.ec2.connect_to_region')
+    def test_shared_connection(self, mock_connect):
+        mock_connect.side_effect = lambda *a, **kw: MockConnection()
+        r1 = Region({})
+        r2 = Region({})
+        r1._region['region_str'] = r2._region['region_str'] = 'eu-west-1'
+        self.assertIs(r1.ec2(), r2.ec2())
+        self.assertIs(r1.ec2(), r2.ec2())
+        self.assertEqual(mock_connect.call_count, 1)
+        self.assertEqual(connection_stats(),
+                         {'opened': 1, 'reused': 1, 'open': 1})
+
+    @patch('boto.ec2.connect_to_region')
+    def test_separate_keys(self, mock_connect):
+        mock_connect.side_effect = lambda *a, **kw: MockConnection()
+        c1 = get_connection('ec2', 'eu-west-1')
+        c2 = get_connection('ec2', 'us-east-1')
+        c3 = get_connection('ec2', 'eu-west-1', api_version='2014-06-15')
+        self.assertEqual(len(set([id(c1), id(c2), id(c3)])), 3)
+        self.assertIs(get_connection('ec2', 'eu-west-1'), c1)
+        self.assertEqual(connection_stats()['opened'], 3)
@@ -0,0 +1,166 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import argparse
+import handson.myyaml as myyaml
+import io
+import time
+import unittest
+
+from handson.execute import ExecCommand
+from handson.ssh import (
+    ConnectionManager,
+    key_file,
+    run,
+    ssh_config,
+)
+from handson.test_setup import SetUp
+from mock import patch
+
+
+class MockInstance(object):
+
+    def __init__(self, ip_address):
+        self.ip_address = ip_address
+
+
+class TestSSH(SetUp, unittest.TestCase):
+
+    def test_key_file(self):
+        self.reset_yaml()
+        myyaml.stanza('keyname', 'smithfarm')
+        myyaml.stanza('keypairs', {2: {'keyname': 'imported-d2'}})
+        self.assertEqual(key_file(1), 'keys/smithfarm-d1')
+        self.assertEqual(key_file(2), 'keys/imported-d2')
+
+    def test_ssh_config(self):
+        self.reset_yaml()
+        myyaml.stanza('keyname', 'smithfarm')
+        config = ssh_config([
+            (1, 'admin', '192.0.2.1'),
+            (1, 'mon1', None),
+            (7, 'mon1', '192.0.2.7'),
+        ], 'ec2-user')
+        hosts = [line.split()[1] for line in config.splitlines()
+                 if line.startswith('Host ')]
+        self.assertEqual(hosts, ['d1-admin', 'd7-mon1'])
+        block = config.split('Host d7-mon1\n')[1]
+        self.assertIn('    HostName 192.0.2.7\n', block)
+        self.assertIn('    User ec2-user\n', block)
+        self.assertIn('keys/smithfarm-d7\n', block)
+        self.assertIn('    ControlMaster auto\n', block)
+        self.assertIn('    ControlPersist 10m\n', block)
+
+    def test_connection_manager(self):
+        manager = ConnectionManager('test_config')
+        self.assertEqual(manager.argv('d7-mon1', 'uptime'),
+                         ['ssh', '-F', 'test_config', 'd7-mon1', 'uptime'])
+        self.assertEqual(manager.argv('d7-mon1', control='check'),
+                         ['ssh', '-F', 'test_config', '-O', 'check',
+                          'd7-mon1'])
+        self.assertEqual(manager.argv('d7-mon1', master=True),
+                         ['ssh', '-F', 'test_config', '-f', '-N', '-M',
+                          'd7-mon1'])
+
+    def test_run(self):
+        out = io.StringIO()
+        rc = run('d1/mon1', ['sh', '-c', 'echo one; echo two >&2; exit 3'],
+                 out=out)
+        self.assertEqual(rc, 3)
+        self.assertEqual(out.getvalue(), u"[d1/mon1] one\n[d1/mon1] two\n")
+
+    def test_run_pipe_held(self):
+        # like an ssh master connection started by the first session, the
+        # background sleep keeps the output pipe open after sh exits
+        out = io.StringIO()
+        start = time.time()
+        rc = run('d1/mon1', ['sh', '-c', 'sleep 10 & echo one'], out=out)
+        self.assertEqual(rc, 0)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(out.getvalue(), u"[d1/mon1] one\n")
+        start = time.time()
+        self.assertIsNone(run('d1/mon1', ['sh', '-c', 'sleep 10 & sleep 10'],
+                              timeout=0.2, out=out))
+        self.assertLess(time.time() - start, 5)
+
+    def test_run_timeout(self):
+        out = io.StringIO()
+        self.assertIsNone(run('d1/mon1', ['sleep', '10'], timeout=0.2,
+                              out=out))
+
+
+class TestExec(SetUp, unittest.TestCase):
+
+    def exec_command(self, **kwargs):
+        args = argparse.Namespace(
+            yamlfile='./aws.yaml', delegate_list=[1, 2], all=False,
+            master=None, dry_run=None, parallel=4, roles=None,
+            command='uptime', script=None, timeout=10, user='ec2-user')
+        for (k, v) in kwargs.items():
+            setattr(args, k, v)
+        return ExecCommand(args)
+
+    @patch('handson.execute.write_ssh_config')
+    @patch('handson.ssh.Fleet')
+    def test_nodes(self, fleet, write_ssh_config):
+        self.reset_yaml()
+        fleet.return_value.inventory.return_value = {
+            (1, 'admin'): MockInstance('192.0.2.1'),
+            (1, 'mon1'): MockInstance(None),
+            (3, 'admin'): MockInstance('192.0.2.3'),
+        }
+        self.assertEqual(self.exec_command().nodes(), [
+            (1, 'admin', '192.0.2.1'),
+            (1, 'mon1', None),
+        ])
+        # the ssh_config covers all nodes
+        self.assertEqual(len(write_ssh_config.call_args[0][0]), 3)
+        self.assertEqual(self.exec_command(roles=['admin']).nodes(), [
+            (1, 'admin', '192.0.2.1'),
+        ])
+
+    @patch('handson.execute.write_ssh_config')
+    @patch('handson.execute.ConnectionManager')
+    @patch('handson.ssh.Fleet')
+    def test_exit_status(self, fleet, manager, write_ssh_config):
+        self.reset_yaml()
+        myyaml.stanza('delegates', 2)
+        fleet.return_value.inventory.return_value = {
+            (1, 'admin'): MockInstance('192.0.2.1'),
+            (2, 'admin'): MockInstance('192.0.2.2'),
+        }
+        run = manager.return_value.run
+        run.side_effect = lambda alias, command, **kwargs: (
+            0 if alias == 'd1-admin' else None)
+        with self.assertRaises(AssertionError) as cm:
+            self.exec_command().run()
+        self.assertIn('d2-admin', str(cm.exception))
+        self.assertNotIn('d1-admin', str(cm.exception))
+        self.assertEqual(run.call_count, 2)
@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import unittest
+
+from boto.exception import EC2ResponseError
+from handson.tag import (
+    Tagger,
+    tag_resources,
+)
+from mock import patch
+
+
+class MockEC2Connection(object):
+
+    def __init__(self, failures=0):
+        self.calls = []
+        self.failures = failures
+
+    def create_tags(self, resource_ids, tags):
+        if self.failures:
+            self.failures -= 1
+            e = EC2ResponseError(400, 'Bad Request')
+            e.error_code = 'InvalidInstanceID.NotFound'
+            raise e
+        self.calls.append((list(resource_ids), tags))
+        return True
+
+
+class TestTag(unittest.TestCase):
+
+    def test_coalesce_by_set(self):
+        ec2 = MockEC2Connection()
+        t = Tagger(ec2)
+        for d in [1, 2]:
+            for r_id in ['i-{}'.format(d), 'vol-{}'.format(d)]:
+                t.add(r_id, {'Name': 'handson', 'Delegate': d})
+        self.assertEqual(t.flush(), 2)
+        self.assertEqual(ec2.calls, [
+            (['i-1', 'vol-1'], {'Delegate': '1', 'Name': 'handson'}),
+            (['i-2', 'vol-2'], {'Delegate': '2', 'Name': 'handson'}),
+        ])
+        self.assertEqual(t.flush(), 0)
+
+    def test_coalesce_by_tag(self):
+        ec2 = MockEC2Connection()
+        t = Tagger(ec2)
+        t.add('i-1', {'Name': 'handson', 'Owner': 'a'})
+        t.add('i-2', {'Name': 'handson', 'Owner': 'b'})
+        t.add('i-3', {'Name': 'handson'})
+        t.add('i-4', {'Owner': 'a'})
+        t.add('i-5', {'Owner': 'b'})
+        # four distinct tag sets, but only three distinct tags
+        self.assertEqual(t.flush(), 3)
+
+    @patch('handson.tag.time.sleep')
+    def test_retry(self, mock_sleep):
+        ec2 = MockEC2Connection(failures=2)
+        tag_resources(ec2, ['i-1'], {'Name': 'handson'})
+        self.assertEqual(ec2.calls, [(['i-1'], {'Name': 'handson'})])
+        self.assertEqual(mock_sleep.call_count, 2)
+        ec2 = MockEC2Connection(failures=10)
+        with self.assertRaises(EC2ResponseError):
+            tag_resources(ec2, ['i-1'], {'Name': 'handson'})
@@ -0,0 +1,96 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import os
+import tempfile
+import unittest
+
+from handson.template import (
+    Template,
+    load_template,
+    render_user_data,
+)
+from mock import patch
+
+
+class TestTemplate(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.fn) = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write("#!/bin/sh\n"
+                    "echo @@ROLE@@ @@DELEGATE@@ > /etc/role\n"
+                    "echo @@SECRET@@ @@ROLE@@\n"
+                    "#EMAIL=@@EMAIL@@\n")
+
+    def tearDown(self):
+        os.unlink(self.fn)
+
+    def test_render(self):
+        t = Template("@@A@@-x-@@B@@@@A@@")
+        self.assertEqual(t.literals, ('', '-x-', '', ''))
+        self.assertEqual(t.tokens, ('A', 'B', 'A'))
+        self.assertEqual(t.render({'A': 1, 'B': 'b'}), "1-x-b1")
+        self.assertEqual(Template("no tokens").render({}), "no tokens")
+
+    def test_render_none(self):
+        t = Template("node @@NODE_NO@@ calls @@CALLBACK@@", name='ud')
+        with patch('handson.template.log') as mock_log:
+            self.assertEqual(t.render({'NODE_NO': 0, 'CALLBACK': None}),
+                             "node 0 calls @@CALLBACK@@")
+            self.assertEqual(mock_log.warning.call_count, 1)
+            self.assertIn('CALLBACK', mock_log.warning.call_args[0][0])
+
+    @patch.dict(os.environ, {'SECRET': 's3cr3t'})
+    def test_user_data(self):
+        with patch('handson.template.log') as mock_log:
+            u = render_user_data(self.fn, {'ROLE': 'mon1', 'DELEGATE': 7},
+                                 ['SECRET'])
+            render_user_data(self.fn, {'ROLE': 'mon2', 'DELEGATE': 7},
+                             ['SECRET'])
+            # the unknown token is reported once
+            self.assertEqual(mock_log.warning.call_count, 1)
+        self.assertEqual(u, "#!/bin/sh\n"
+                            "echo mon1 7 > /etc/role\n"
+                            "echo s3cr3t mon1\n"
+                            "#EMAIL=@@EMAIL@@\n")
+        self.assertIs(load_template(self.fn), load_template(self.fn))
+
+    def test_missing_environment(self):
+        with patch.dict(os.environ, {}, clear=True):
+            with self.assertRaises(AssertionError):
+                render_user_data(self.fn, {}, ['SECRET'])
+
+    def test_reload(self):
+        t = load_template(self.fn)
+        with open(self.fn, 'a') as f:
+            f.write("echo @@REGION@@\n")
+        self.assertIsNot(load_template(self.fn), t)
+        self.assertIn('REGION', load_template(self.fn).tokens)
@@ -0,0 +1,234 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import socket
+import unittest
+
+from boto.ec2.connection import EC2Connection
+from boto.exception import BotoServerError
+from handson.throttle import (
+    TokenBucket,
+    action_family,
+    get_bucket,
+    throttle_connection,
+)
+from mock import patch
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+THROTTLE_BODY = (
+    b'<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+    b'<Message>Request limit exceeded.</Message></Error></Errors>'
+    b'<RequestID>1</RequestID></Response>'
+)
+
+
+class MockResponse(object):
+
+    def __init__(self, status, body=b'', reason='OK'):
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+    def read(self):
+        return self.body
+
+    def getheader(self, name, default=None):
+        return default
+
+    def getheaders(self):
+        return []
+
+
+THROTTLED = BotoServerError(503, 'Service Unavailable', THROTTLE_BODY)
+UNAVAILABLE = BotoServerError(500, 'Internal Server Error', b'')
+
+
+class MockConnection(object):
+    """
+        Behaves like boto's make_request: returns 4xx responses and raises
+        BotoServerError for 5xx ones.
+    """
+
+    http_exceptions = (socket.error,)
+    http_unretryable_exceptions = []
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.actions = []
+
+    def make_request(self, action, params=None, path='/', verb='GET'):
+        self.actions.append(action)
+        r = self.responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+
+class MockHTTPConnection(object):
+    """
+        Stands in for the HTTP connection that boto sends requests over, so
+        that a real boto connection goes through its own error handling.
+    """
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def request(self, method, path, body, headers):
+        pass
+
+    def getresponse(self):
+        r = self.responses.pop(0)
+        if isinstance(r, Exception):
+            raise r
+        return r
+
+
+class TestThrottle(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patchers = [
+            patch('time.time', self.clock.time),
+            patch('time.sleep', self.clock.sleep),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_action_family(self):
+        self.assertEqual(action_family('DescribeInstances'), 'describe')
+        self.assertEqual(action_family('CreateTags'), 'tag')
+        self.assertEqual(action_family('RunInstances'), 'mutate')
+
+    def test_bucket_rate(self):
+        b = TokenBucket('test', 10.0, 2)
+        b.acquire()
+        b.acquire()
+        self.assertEqual(self.clock.slept, [])
+        # the bucket is empty now, so the next caller has to wait
+        b.acquire()
+        self.assertAlmostEqual(self.clock.slept[0], 0.1)
+
+    def test_throttle_and_recover(self):
+        ok = MockResponse(200)
+        conn = MockConnection([THROTTLED, THROTTLED, ok, ok])
+        throttle_connection(conn, 'test-region-1')
+        self.assertIs(conn.make_request('DescribeVolumes', {}), ok)
+        self.assertEqual(conn.actions, ['DescribeVolumes'] * 3)
+        b = get_bucket('test-region-1', 'describe')
+        self.assertEqual(b.throttled_count, 2)
+        self.assertLess(b.rate, b.nominal_rate)
+        slowed = b.rate
+        conn.make_request('DescribeVolumes', {})
+        self.assertGreater(b.rate, slowed)
+
+    def test_throttled_response(self):
+        throttled = MockResponse(
+            400, b'<Response><Errors><Error><Code>Throttling</Code>')
+        ok = MockResponse(200)
+        conn = MockConnection([throttled, ok])
+        throttle_connection(conn, 'test-region-3')
+        self.assertIs(conn.make_request('CreateTags', {}), ok)
+        self.assertEqual(get_bucket('test-region-3', 'tag').throttled_count,
+                         1)
+
+    def test_server_error(self):
+        ok = MockResponse(200)
+        conn = MockConnection([UNAVAILABLE, ok])
+        throttle_connection(conn, 'test-region-4')
+        self.assertIs(conn.make_request('RunInstances', {}), ok)
+        # retried, but not counted as throttling
+        b = get_bucket('test-region-4', 'mutate')
+        self.assertEqual(b.throttled_count, 0)
+        self.assertEqual(b.rate, b.nominal_rate)
+        # other errors are not retried
+        conn = MockConnection([
+            BotoServerError(400, 'Bad Request', b''), ok])
+        throttle_connection(conn, 'test-region-4')
+        with self.assertRaises(BotoServerError):
+            conn.make_request('RunInstances', {})
+        self.assertEqual(len(conn.actions), 1)
+
+    def test_give_up(self):
+        conn = MockConnection([THROTTLED] * 10)
+        throttle_connection(conn, 'test-region-2')
+        with self.assertRaises(BotoServerError):
+            conn.make_request('RunInstances', {})
+        self.assertEqual(len(conn.actions), 7)
+
+    def test_boto_connection(self):
+        # boto does not retry the 503 itself, but raises it to the bucket
+        conn = EC2Connection('access-key', 'secret-key')
+        http = MockHTTPConnection([
+            MockResponse(503, THROTTLE_BODY, 'Service Unavailable'),
+            MockResponse(200, b'<DescribeRegionsResponse/>'),
+        ])
+        conn.get_http_connection = lambda host, port, is_secure: http
+        conn.put_http_connection = lambda *args: None
+        throttle_connection(conn, 'test-region-5')
+        response = conn.make_request('DescribeRegions', {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(
+            get_bucket('test-region-5', 'describe').throttled_count, 1)
+
+    def test_connection_reset(self):
+        # boto does not retry transport errors either, so the bucket does
+        conn = EC2Connection('access-key', 'secret-key')
+        http = MockHTTPConnection([
+            socket.error(104, 'Connection reset by peer'),
+            MockResponse(200, b'<DescribeRegionsResponse/>'),
+        ])
+        conn.get_http_connection = lambda host, port, is_secure: http
+        conn.new_http_connection = lambda host, port, is_secure: http
+        conn.put_http_connection = lambda *args: None
+        throttle_connection(conn, 'test-region-6')
+        response = conn.make_request('DescribeRegions', {})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(
+            get_bucket('test-region-6', 'describe').throttled_count, 0)
+        # unless they keep happening
+        http.responses = [socket.error(104, 'Connection reset')] * 10
+        with self.assertRaises(socket.error):
+            conn.make_request('DescribeRegions', {})
+        self.assertEqual(len(http.responses), 3)
@@ -0,0 +1,74 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import email
+import gzip
+import io
+import unittest
+
+from handson.userdata import (
+    USER_DATA_LIMIT,
+    build_user_data,
+)
+
+CLOUD_CONFIG = "#cloud-config\nssh_authorized_keys:\n- ssh-rsa AAAA\n"
+SCRIPT = "#!/bin/sh\n" + "echo installing salt-minion\n" * 200
+
+
+class TestUserData(unittest.TestCase):
+
+    def test_single_part(self):
+        self.assertEqual(build_user_data([('s', SCRIPT)]), SCRIPT)
+
+    def test_multipart_gzip(self):
+        u = build_user_data([
+            ('keys.yaml', CLOUD_CONFIG),
+            ('setup.sh', SCRIPT),
+        ], compressed=True)
+        self.assertLess(len(u), len(SCRIPT))
+        with gzip.GzipFile(fileobj=io.BytesIO(u)) as gz:
+            msg = email.message_from_string(gz.read().decode('utf-8'))
+        self.assertTrue(msg.is_multipart())
+        parts = msg.get_payload()
+        self.assertEqual(
+            [p.get_content_type() for p in parts],
+            ['text/cloud-config', 'text/x-shellscript'],
+        )
+        self.assertEqual(parts[1].get_filename(), 'setup.sh')
+        self.assertEqual(parts[1].get_payload(), SCRIPT)
+
+    def test_limit(self):
+        big = "#!/bin/sh\n" + "true\n" * USER_DATA_LIMIT
+        with self.assertRaises(AssertionError):
+            build_user_data([('big.sh', big)])
+        self.assertLess(
+            len(build_user_data([('big.sh', big)], compressed=True)),
+            USER_DATA_LIMIT,
+        )
@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2016, SUSE LLC
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of ceph-auto-aws nor the names of its contributors may be
+# used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+import handson.myyaml as myyaml
+import handson.waiter as waiter
+import unittest
+
+from handson.test_setup import SetUp
+
+
+class TestWaiter(SetUp, unittest.TestCase):
+
+    def test_backoff(self):
+        self.reset_yaml()
+        w = waiter.Waiter('volume', 'available')
+        delays = [w.next_delay() for _ in range(10)]
+        # first polls are short, later ones are capped
+        self.assertTrue(delays[0] <= 10 / 8.0 * 2)
+        self.assertTrue(all(d <= waiter.MAX_DELAY for d in delays))
+        self.assertTrue(delays[-1] >= waiter.MAX_DELAY / 2.0)
+
+    def test_done(self):
+        self.reset_yaml()
+        w = waiter.Waiter('volume', 'deleted')
+        self.assertFalse(w.expired())
+        w.done()
+        self.assertEqual(waiter._load_stats()['volume:deleted']['count'], 1)
+        # do not persist our fake latencies
+        waiter.initialize_internal_buffers()
+
+    def test_timeout(self):
+        self.reset_yaml()
+        w = waiter.Waiter('instance', 'running', deadline=-1)
+        self.assertTrue(w.expired())
+        self.assertIsInstance(w.timeout_error('i-1'), waiter.WaitTimeout)
+
+    def test_stats(self):
+        self.reset_yaml()
+        self.assertEqual(waiter.expected_time('volume', 'deleted'), 10)
+        waiter.record('volume', 'deleted', 4)
+        self.assertEqual(waiter.expected_time('volume', 'deleted'), 4)
+        waiter.record('volume', 'deleted', 9)
+        self.assertEqual(waiter.expected_time('volume', 'deleted'), 5)
+        # do not persist our fake latencies
+        waiter.initialize_internal_buffers()
+
+    def test_stats_survive_flush(self):
+        self.reset_yaml()
+        myyaml.stanza('transition-times', {
+            'volume:deleted': {'count': 1, 'mean': 4.0},
+        })
+        self.reset_yaml()
+        waiter.record('instance', 'running', 12)
+        # another stanza is written, refreshing the rest from the file
+        myyaml.stanza('delegates', 3)
+        self.assertEqual(waiter.expected_time('instance', 'running'), 12)
+        waiter.save_stats()
+        self.assertEqual(myyaml.stanza('transition-times'), {
+            'instance:running': {'count': 1, 'mean': 12.0},
+            'volume:deleted': {'count': 1, 'mean': 4.0},
+        })